@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""Build fake Bitbucket support zips for benchmarking the health check.
+
+Each zip has the layout health.py reads: application.xml with the
+cluster-information, operating-system and java-runtime-environment
+sections (and the rest of what the report uses), bitbucket.properties,
+access logs (the older half gzipped, as Bitbucket rotates them),
+profiler and GC logs, thread dumps and an application log. The
+application log is padded so the zip reaches roughly the requested
+size, with an occasional known error (OutOfMemoryError, a rejected
+hosting ticket, ...) for the error signature scan to find. The same arguments always produce the same zips.
+
+    python3 benchmarks/generate.py /tmp/bundle --nodes 3 --log-lines 50000
+"""
+from optparse import OptionParser
+import gzip
+import os
+import random
+import zipfile
+
+DEFAULTS = {
+    'nodes': 3,
+    'present': None,
+    'log_lines': 20000,
+    'thread_dumps': 6,
+    'plugins': 40,
+    'gc_events': 2000,
+    'profiled_requests': 2000,
+    'size_mb': 0,
+    'seed': 1,
+}
+
+ENDPOINTS = ('"GET /rest/api/1.0/projects/P{0}/repos/r{1}/commits?limit=25 HTTP/1.1"',
+             '"GET /projects/P{0}/repos/r{1}/browse HTTP/1.1"',
+             '"GET /rest/api/latest/projects/P{0}/repos/r{1}/pull-requests/{2} HTTP/1.1"',
+             '"POST /rest/api/1.0/projects/P{0}/repos/r{1}/pull-requests HTTP/1.1"')
+#one application log line in ERROR_RATE is one of these
+ERROR_RATE = 0.0005
+ERROR_LINES = (
+    'ERROR [http-nio-7990-exec-%d] user%d @1A2B c.a.b.i.s.DefaultRepositoryService java.lang.OutOfMemoryError: Java heap space',
+    'WARN  [ssh-scm-request-handler] user%d @1A2B c.a.b.i.t.ThrottleServiceImpl A [scm-hosting] ticket could not be acquired (0/%d)',
+    'WARN  [Caesium-1-%d] c.a.b.s.i.e.DefaultElasticsearchClient Request to Elasticsearch timed out after %d ms',
+    'ERROR [hz._hzInstance_1_bitbucket.cached.thread-%d] c.h.i.c.i.o.MergeClustersOp [10.0.0.%d]:5701 is merging to the other cluster',
+)
+IDLE_STACK = ('sun.misc.Unsafe.park', 'java.util.concurrent.LinkedBlockingQueue.take', 'java.util.concurrent.ThreadPoolExecutor.getTask')
+BUSY_STACKS = (
+    ('WAITING', ('sun.misc.Unsafe.park', 'java.util.concurrent.locks.LockSupport.parkNanos', 'com.zaxxer.hikari.util.ConcurrentBag.borrow')),
+    ('RUNNABLE', ('java.lang.UNIXProcess.waitFor', 'com.atlassian.bitbucket.internal.process.NioProcess.waitFor', 'com.atlassian.bitbucket.scm.git.GitCommand.call')),
+    ('RUNNABLE', ('java.net.SocketInputStream.socketRead0', 'org.postgresql.core.VisibleBufferedInputStream.read', 'org.postgresql.jdbc.PgStatement.execute')),
+    ('WAITING', ('sun.misc.Unsafe.park', 'com.hazelcast.spi.impl.AbstractInvocationFuture.get', 'com.hazelcast.concurrent.lock.LockProxy.lock')),
+)
+
+
+def plugin_list(count, rng):
+    plugins = []
+    for i in range(count):
+        vendor = 'vendor%d' % (i % 7)
+        plugins.append({'name': 'Plugin %d' % i, 'key': 'com.%s.bitbucket.plugin%d' % (vendor, i), 'version': '%d.%d.%d' % (rng.randint(1, 5), rng.randint(0, 9), rng.randint(0, 20)),
+                        'vendor': vendor.capitalize(), 'status': 'ENABLED', 'user-installed': 'true'})
+    return plugins
+
+
+def heap_size(node):
+    """-Xmx of the node in GB; every fifth node has a smaller heap."""
+    return 4 if node % 5 else 2
+
+
+def application_xml(node, nodes, plugins, rng):
+    cluster = ''.join('<node><id>BB-Node-%d</id><address>/10.0.0.%d:5701</address><local>%s</local></node>'
+                      % (i, i, 'true' if i == node else 'false') for i in range(1, nodes + 1))
+    pluginXml = ''.join('<plugin>' + ''.join('<%s>%s</%s>' % (tag, value, tag) for tag, value in plugin.items()) + '</plugin>' for plugin in plugins)
+    heap = heap_size(node)
+    return '''<?xml version="1.0" encoding="UTF-8"?>
+<application-information>
+<product name="Bitbucket" version="7.6.4"/>
+<bitbucket-information><base-url>https://bitbucket.example.com</base-url><server-id>B1A2-C3D4-E5F6-G7H8</server-id></bitbucket-information>
+<cluster-information><clustered>%s</clustered>%s</cluster-information>
+<operating-system><os-name>Linux</os-name><os-architecture>amd64</os-architecture><os-version>5.4.0-1045-aws</os-version>
+<available-processors>16</available-processors><total-physical-memory>62.8 GB</total-physical-memory><total-swap-space>0 bytes</total-swap-space>
+<max-file-descriptor>65536</max-file-descriptor><system-load-average>%.2f</system-load-average><system-cpu-load>%d%%</system-cpu-load>
+<free-swap-space>0 bytes</free-swap-space><free-physical-memory>%d GB</free-physical-memory><open-file-descriptor>%d</open-file-descriptor></operating-system>
+<database-information><database-name>PostgreSQL</database-name><version>12.6</version><support-level>Supported</support-level>
+<connection-url>jdbc:postgresql://db.example.com:5432/bitbucket</connection-url><driver><driver-name>PostgreSQL JDBC Driver</driver-name><driver-version>42.2.18</driver-version></driver></database-information>
+<git><version>2.30.1</version></git>
+<scm-cache><http-enabled>true</http-enabled><ssh-enabled>true</ssh-enabled><refs-advertisement><enabled>true</enabled></refs-advertisement></scm-cache>
+<java-runtime-environment><java.runtime.version>11.0.10+9</java.runtime.version><java.vendor>AdoptOpenJDK</java.vendor>
+<virtual-machine-arguments>-Xms%dg -Xmx%dg -XX:+UseG1GC -XX:+HeapDumpOnOutOfMemoryError -XX:HeapDumpPath=/var/atlassian/bitbucket/log -Dfile.encoding=UTF-8 -Datlassian.standalone=BITBUCKET</virtual-machine-arguments>
+<percent-heap-used>%d</percent-heap-used><heap-used>%d MB</heap-used><heap-available>%d MB</heap-available></java-runtime-environment>
+<filesystem><home><name>/dev/nvme1n1</name><path>/var/atlassian/application-data/bitbucket</path><type>ext4</type><free-size>%d GB</free-size><total-size>500 GB</total-size></home>
+<shared-home><name>nfs.example.com:/shared</name><path>/mnt/bitbucket-shared</path><type>nfs4</type><free-size>1.2 TB</free-size><total-size>4 TB</total-size></shared-home></filesystem>
+<Elasticsearch><base-url>https://search.example.com:9200</base-url><connection-result>OK</connection-result></Elasticsearch>
+<projects><count>%d</count></projects><repositories><count>%d</count></repositories>
+<plugins>%s</plugins>
+</application-information>
+''' % ('true' if nodes > 1 else 'false', cluster, rng.uniform(0.5, 8), rng.randint(5, 80), rng.randint(4, 40), rng.randint(500, 5000),
+       heap, heap, rng.randint(20, 90), rng.randint(500, 3000), rng.randint(500, 3000), rng.randint(50, 400), 120, 4500, pluginXml)
+
+
+def bitbucket_properties(nodes):
+    props = ['setup.displayName=Bitbucket', 'setup.baseUrl=https://bitbucket.example.com',
+             'jdbc.driver=org.postgresql.Driver', 'jdbc.url=jdbc:postgresql://db.example.com:5432/bitbucket', 'jdbc.user=bitbucket', 'jdbc.password=secret',
+             'throttle.resource.scm-hosting.strategy=adaptive', 'db.pool.size.max=120']
+    if nodes > 1:
+        props += ['hazelcast.network.tcpip=true', 'hazelcast.group.name=bitbucket',
+                  'hazelcast.network.tcpip.members=' + ','.join('10.0.0.%d:5701' % i for i in range(1, nodes + 1))]
+    return '\n'.join(props) + '\n'
+
+
+def access_log(lines, rng):
+    out = []
+    for k in range(lines):
+        #spread over ten hours of the day
+        minute = k * 600 // lines
+        ts = '2021-02-03 %02d:%02d:%02d,%03d' % (8 + minute // 60, minute % 60, k % 60, k % 1000)
+        kind = rng.random()
+        if kind < 0.3:
+            action, labels, protocol = "SSH - git-upload-pack '/proj%d/repo%d.git'" % (k % 9, k % 40), rng.choice(('clone, protocol:2', 'fetch, protocol:2')), 'ssh'
+        elif kind < 0.5:
+            action, labels, protocol = '"GET /scm/proj%d/repo%d.git/info/refs?service=git-upload-pack HTTP/1.1"' % (k % 9, k % 40), 'refs, cache:hit', 'https'
+        else:
+            action, labels, protocol = rng.choice(ENDPOINTS).format(k % 9, k % 40, k % 500), '-', 'https'
+        out.append('10.1.%d.%d | %s | i@1A2Bx%dx0 | user%d | %s | %s | "" "git/2.30.1" | - | - | - | - | - | - |'
+                   % (k % 256, k % 200, protocol, k, k % 300, ts, action))
+        out.append('10.1.%d.%d | %s | o@1A2Bx%dx0 | user%d | %s | %s | "" "git/2.30.1" | 200 | 0 | %d | %s | %d | 1a2b3c |'
+                   % (k % 256, k % 200, protocol, k, k % 300, ts, action, rng.randint(100, 50 * 1024**2), labels, int(rng.expovariate(1 / 150.0))))
+    return out
+
+
+def thread_dump(index, rng):
+    out = ['2021-02-03 10:%02d:00' % index, 'Full thread dump OpenJDK 64-Bit Server VM (11.0.10+9 mixed mode):', '']
+    for t in range(150):
+        if rng.random() < 0.8:
+            state, frames = 'WAITING', IDLE_STACK
+        else:
+            state, frames = BUSY_STACKS[t % len(BUSY_STACKS)]
+        out.append('"http-nio-7990-exec-%d" #%d daemon prio=5 os_prio=0 tid=0x00007f%06x nid=0x%x waiting on condition  [0x00007f]' % (t, t + 40, t, t + 100))
+        out.append('   java.lang.Thread.State: %s' % state)
+        out.extend('\tat %s(Unknown Source)' % frame for frame in frames)
+        out.append('\tat java.lang.Thread.run(Thread.java:834)')
+        out.append('')
+    return '\n'.join(out) + '\n'
+
+
+def gc_log(events, heap, rng):
+    out = []
+    uptime = 10.0
+    capacity = heap * 1024
+    #the live set wanders between 40% and 65% of the heap, below the live set warning
+    live = capacity // 2
+    for i in range(events):
+        uptime += rng.uniform(1, 20)
+        live = min(capacity * 65 // 100, max(capacity * 40 // 100, live + rng.randint(-capacity // 200, capacity // 160)))
+        full = i % 500 == 499
+        pause = rng.expovariate(1 / 15.0) * (40 if full else 1)
+        kind = 'Pause Full (G1 Compaction Pause)' if full else 'Pause Young (Normal) (G1 Evacuation Pause)'
+        out.append('[2021-02-03T10:00:00.000+0000][%.3fs][info][gc] GC(%d) %s %dM->%dM(%dM) %.3fms'
+                   % (uptime, i, kind, live + rng.randint(capacity // 5, capacity * 3 // 10), live + rng.randint(0, capacity // 80), capacity, pause))
+    return '\n'.join(out) + '\n'
+
+
+def profiler_log(requests, plugins, rng):
+    out = []
+    hooks = [plugin['key'] for plugin in plugins[:5]] or ['com.example.hooks']
+    for i in range(requests):
+        git = rng.randint(20, 2000)
+        hook = rng.randint(1, 300)
+        out.append('2021-02-03 10:%02d:%02d,%03d | http-nio-7990-exec-%d | %dx%dx1 | user%d | 1a2b3c' % (i // 60 % 60, i % 60, i % 1000, i % 50, 600 + i, i, i % 300))
+        out.append('[%dms] - %s' % (git + hook + 15, rng.choice(ENDPOINTS).format(i % 9, i % 40, i % 500)))
+        out.append('  [%dms] - com.atlassian.bitbucket.internal.scm.git.command.GitCommandBuilder.build(Repository)' % git)
+        out.append('    [%dms] - /usr/bin/git rev-list --format=%%H refs/heads/master' % max(git - 5, 1))
+        out.append('  [%dms] - %s.RepositoryHook.onEvent(Event)' % (hook, rng.choice(hooks)))
+        out.append("  [%dms] - select * from sta_repository where id = %d" % (rng.randint(1, 12), i % 40))
+    return '\n'.join(out) + '\n'
+
+
+def padding(size, rng):
+    """Application log lines adding up to about size bytes."""
+    out = []
+    total = 0
+    while total < size:
+        if rng.random() < ERROR_RATE:
+            line = '2021-02-03 10:00:%02d,%03d ' % (total % 60, total % 1000) + rng.choice(ERROR_LINES) % (total % 50, total % 12) + '\n'
+        else:
+            line = '2021-02-03 10:00:%02d,%03d INFO  [http-nio-7990-exec-%d] user%d @1A2B %s c.a.b.i.s.DefaultRepositoryService Request %08x\n' % (
+                total % 60, total % 1000, total % 50, total % 300, '%032x' % rng.getrandbits(128), rng.getrandbits(32))
+        out.append(line)
+        total += len(line)
+    return ''.join(out)
+
+
+def generate_zip(path, node, nodes, settings):
+    rng = random.Random(settings['seed'] * 1000 + node)
+    plugins = plugin_list(settings['plugins'], random.Random(settings['seed']))
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('application-properties/application.xml', application_xml(node, nodes, plugins, rng))
+        z.writestr('application-config/bitbucket.properties', bitbucket_properties(nodes))
+        lines = access_log(settings['log_lines'], rng)
+        half = len(lines) // 2
+        z.writestr('application-logs/atlassian-bitbucket-access-2021-02-02.0.log.gz', gzip.compress(('\n'.join(lines[:half]) + '\n').encode()))
+        z.writestr('application-logs/atlassian-bitbucket-access.log', '\n'.join(lines[half:]) + '\n')
+        if settings['profiled_requests']:
+            z.writestr('application-logs/atlassian-bitbucket-profiler.log', profiler_log(settings['profiled_requests'], plugins, rng))
+        if settings['gc_events']:
+            z.writestr('application-logs/gc-2021-02-03.log', gc_log(settings['gc_events'], heap_size(node), rng))
+        for index in range(settings['thread_dumps']):
+            z.writestr('thread-dump/threaddump_2021-02-03_10-%02d-00.txt' % index, thread_dump(index, rng))
+        z.writestr('application-logs/atlassian-bitbucket.log', padding(settings['size_mb'] * 1024 * 1024, rng) if settings['size_mb'] else 'INFO started\n')
+
+
+def generate_bundle(dest, **settings):
+    """Write one support zip per present node into dest and return their paths."""
+    settings = dict(DEFAULTS, **settings)
+    nodes = settings['nodes']
+    present = settings['present'] or nodes
+    os.makedirs(dest, exist_ok=True)
+    paths = []
+    for node in range(1, present + 1):
+        path = os.path.join(dest, 'Bitbucket_support_2021-02-03T10_%02d_%02d.000Z.zip' % (node // 60, node % 60))
+        generate_zip(path, node, nodes, settings)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = OptionParser(usage="%prog [options] /path/to/output/directory")
+    parser.add_option('--nodes', type="int", default=DEFAULTS['nodes'], help="Nodes in the cluster (default: %default).")
+    parser.add_option('--present', type="int", default=None, help="Support zips to write, to leave some nodes missing (default: one per node).")
+    parser.add_option('--log-lines', type="int", dest='log_lines', default=DEFAULTS['log_lines'], help="Requests in each node's access logs (default: %default).")
+    parser.add_option('--thread-dumps', type="int", dest='thread_dumps', default=DEFAULTS['thread_dumps'], help="Thread dumps per node (default: %default).")
+    parser.add_option('--plugins', type="int", default=DEFAULTS['plugins'], help="User installed plugins (default: %default).")
+    parser.add_option('--gc-events', type="int", dest='gc_events', default=DEFAULTS['gc_events'], help="GC pauses in each node's GC log (default: %default).")
+    parser.add_option('--profiled-requests', type="int", dest='profiled_requests', default=DEFAULTS['profiled_requests'], help="Requests in each node's profiler log (default: %default).")
+    parser.add_option('--size-mb', type="int", dest='size_mb', default=DEFAULTS['size_mb'], help="Extra application log per node, in MB before compression (default: %default).")
+    parser.add_option('--seed', type="int", default=DEFAULTS['seed'], help="Random seed (default: %default).")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("expected one output directory")
+    for path in generate_bundle(args[0], **vars(options)):
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Time the health check on generated support zips and compare with a baseline.
+
+For each cluster size a bundle is generated with generate.py and
+health.py is run on it with --profile and --no-cache, so every run does
+the full work. The best of --repeat runs is kept: the total wall time and
+the wall time of each phase, summed over the nodes (e.g. 'access logs' is
+the time spent on the access logs of all nodes).
+
+The results are compared with benchmarks/baseline.json, or --baseline. A
+time that is more than --tolerance slower than its baseline (and slower
+by more than MIN_REGRESSION seconds, so tiny phases don't flap) is a
+regression, and the run exits with 1; without a baseline it exits with 2.
+Baselines depend on the machine, so create one with --update-baseline
+before changing anything:
+
+    python3 benchmarks/run.py --update-baseline
+    ...change the health check...
+    python3 benchmarks/run.py
+
+health.py runs with --offline, so plugins are only looked up in the
+plugin catalog, an empty one for each run; with --no-cache, and without
+--record, the runs leave nothing behind in the cache directory. plugin_checker.main, should it run, is left out of the
+comparison as it depends on Marketplace, not on the health check.
+"""
+from optparse import OptionParser
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import generate
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+HEALTH = os.path.join(os.path.dirname(BENCHMARKS), 'health.py')
+DEFAULT_BASELINE = os.path.join(BENCHMARKS, 'baseline.json')
+DEFAULT_NODES = '1,3,12,30'
+DEFAULT_TOLERANCE = 25
+#slowdowns smaller than this (in seconds) are noise, whatever the percentage
+MIN_REGRESSION = 0.05
+IGNORED_PHASES = ('plugin_checker.main',)
+TOTAL = 'total'
+
+
+def run_once(bundle, jobs):
+    """{phase: wall seconds} of one health.py run, plus TOTAL."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        profilePath = os.path.join(tmpdir, 'profile.json')
+        #--offline keeps Marketplace out of the timings; the plugin catalog is still read, from a fresh one in tmpdir.
+        #Metrics aren't recorded without --record, so the synthetic nodes stay out of the user's metrics history
+        command = [sys.executable, HEALTH, '-d', bundle, '--no-cache', '--offline', '--plugin-catalog', os.path.join(tmpdir, 'plugin-catalog.sqlite'),
+                   '--profile', '--profile-output', profilePath, '-j', str(jobs)]
+        started = time.perf_counter()
+        done = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+        total = time.perf_counter() - started
+        if done.returncode != 0:
+            raise RuntimeError("health.py failed on "+bundle+": "+done.stderr.strip()[-500:])
+        with open(profilePath) as f:
+            phases = json.load(f)['phases']
+    times = {}
+    ignored = 0.0
+    for phase in phases:
+        if phase['name'] in IGNORED_PHASES:
+            ignored += phase['wall']
+        else:
+            times[phase['name']] = times.get(phase['name'], 0.0) + phase['wall']
+    times[TOTAL] = total - ignored
+    return times
+
+
+def run_benchmark(nodes, jobs, repeat, settings, workdir):
+    """The best time of each phase over repeat runs on a generated cluster of the given size."""
+    bundle = os.path.join(workdir, 'nodes-'+str(nodes))
+    generate.generate_bundle(bundle, nodes=nodes, **settings)
+    best = {}
+    for _ in range(repeat):
+        for name, wall in run_once(bundle, jobs).items():
+            best[name] = min(wall, best.get(name, wall))
+    return best
+
+
+def compare(results, baseline, tolerance):
+    """[(benchmark, phase, baseline seconds, seconds, regressed)] for every measured phase."""
+    rows = []
+    for benchmark, times in results.items():
+        expected = baseline.get(benchmark, {})
+        for name in sorted(times, key=lambda name: (name != TOTAL, name)):
+            before = expected.get(name)
+            regressed = before is not None and times[name] > before * (1 + tolerance / 100.0) and times[name] - before > MIN_REGRESSION
+            rows.append((benchmark, name, before, times[name], regressed))
+    return rows
+
+
+def format_rows(rows):
+    table = [('Benchmark', 'Phase', 'Baseline (s)', 'Now (s)', 'Change', '')]
+    for benchmark, name, before, now, regressed in rows:
+        change = format((now - before) / before * 100, '+.0f') + '%' if before else '-'
+        table.append((benchmark, name, '-' if before is None else format(before, '.3f'), format(now, '.3f'), change, 'REGRESSION' if regressed else ''))
+    widths = [max(len(row[i]) for row in table) for i in range(len(table[0]))]
+    return "\n".join("  ".join(cell.ljust(width) if i < 2 or i == 5 else cell.rjust(width) for i, (cell, width) in enumerate(zip(row, widths))).rstrip()
+                     for row in table)
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--nodes', default=DEFAULT_NODES, help="Comma separated cluster sizes to benchmark (default: %default).")
+    parser.add_option('-j', '--jobs', type="int", default=1, help="Worker processes for health.py (default: %default).")
+    parser.add_option('--repeat', type="int", default=3, help="Runs per cluster size; the fastest counts (default: %default).")
+    parser.add_option('--log-lines', type="int", dest='log_lines', default=5000, help="Requests in each node's access logs (default: %default).")
+    parser.add_option('--size-mb', type="int", dest='size_mb', default=0, help="Extra application log per node, in MB (default: %default).")
+    parser.add_option('--baseline', default=DEFAULT_BASELINE, help="Baseline to compare with (default: benchmarks/baseline.json).")
+    parser.add_option('--tolerance', type="float", default=DEFAULT_TOLERANCE, help="Percentage a time may exceed its baseline by (default: %default).")
+    parser.add_option('--update-baseline', action="store_true", dest='update', default=False, help="Save the results as the new baseline instead of comparing.")
+    parser.add_option('--keep', default=None, help="Generate the bundles in this directory and keep them, instead of a temporary one.", metavar="/path/to/directory")
+    options, args = parser.parse_args()
+
+    #without a baseline nothing could count as a regression, so that isn't a pass
+    if not options.update and not os.path.exists(options.baseline):
+        print("No baseline at "+options.baseline+", run with --update-baseline to create one", file=sys.stderr)
+        return 2
+
+    settings = {'log_lines': options.log_lines, 'size_mb': options.size_mb}
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for nodes in [int(count) for count in options.nodes.split(',')]:
+            benchmark = str(nodes)+' node'+('s' if nodes != 1 else '')
+            print("Running "+benchmark+"...", file=sys.stderr)
+            results[benchmark] = run_benchmark(nodes, options.jobs, options.repeat, settings, options.keep or tmpdir)
+
+    if options.update:
+        with open(options.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(format_rows(compare(results, {}, options.tolerance)))
+        print("Baseline saved to "+options.baseline)
+        return 0
+
+    with open(options.baseline) as f:
+        baseline = json.load(f)
+    rows = compare(results, baseline, options.tolerance)
+    print(format_rows(rows))
+    regressions = [row for row in rows if row[4]]
+    if regressions:
+        print(str(len(regressions))+" time(s) more than "+format(options.tolerance, 'g')+"% slower than the baseline", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,62 +1,21 @@
 #!/usr/bin/env python3
+#Only cheap modules are imported up front so that --help and small runs start quickly; the rest are imported in run()
 import os
 import sys
-import xml.etree.ElementTree as ET
-from packaging import version
-import zipfile,fnmatch,glob
 import subprocess
+import tempfile
+import time
+import io
+import contextlib
 from optparse import (OptionParser,BadOptionError,AmbiguousOptionError)
 import logging
-import pathlib
 
-#Import plugin_checker, and attempt submodule update if failure to import - as it's possible the user didn't do the pre-req steps in the README
+from healthcheck.defaults import DEFAULT_CACHE_SIZE_MB, DEFAULT_WATCH_INTERVAL, DEFAULT_MARKETPLACE_URL, REPORT_FORMATS
 
-current_path = os.getcwd()
-repo_path = pathlib.Path(__file__).parent
-
-try:
-    print("Updating plugin checker...")
-    os.chdir(repo_path)
-    out = subprocess.Popen(['git', 'submodule', 'update', '--init', '--recursive'], stdout=subprocess.PIPE)
-    for stdout_line in iter(out.stdout.readline, b''):
-        print(stdout_line)
-    out.stdout.close()
-    return_code = out.wait()
-    if return_code:
-        raise subprocess.CalledProcessError(return_code, ['git', 'submodule', 'update', '--init', '--recursive'])
-    print("Done!")
-    os.chdir(current_path)
-except Exception as e:
-    print("Update failed:")
-    print(e)
-    print("Proceeding with healthcheck using existing plugin checker directory")
-
-try:
-    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__))+"/plugin_checker")
-    from plugin_checker import main
-except Exception as e:
-    print("#######Exception#######")
-    print(e)
-    print("#######Exception#######")
-    print("Error importing plugin_checker module. Attempting automatic submodule import with 'git submodule update --init --recursive'")
-    import pathlib
-    current_path = os.getcwd()
-    repo_path = pathlib.Path(__file__).parent
-    os.chdir(repo_path)
-    try:
-        out = subprocess.Popen(['git', 'submodule', 'update', '--init', '--recursive'], stdout=subprocess.PIPE)
-        for stdout_line in iter(out.stdout.readline, b''):
-            print(stdout_line)
-        out.stdout.close()
-        return_code = out.wait()
-        if return_code:
-            raise subprocess.CalledProcessError(return_code, ['git', 'submodule', 'update', '--init', '--recursive'])
-        print("#######################")
-        print("Submodule update completed successfully. Please re-attempt running the script, and be sure you followed all the pre-req steps in the README")
-        exit(-1)
-    except Exception as e2:
-        print("Automatic submodule import failed. Be sure that you went through all of the pre-reqs in the README before running this script:")
-        print("""# Initialize submodule(s)
+#plugin compatibility changes as vendors release, so cached plugin_checker output is only reused for a day
+PLUGIN_RESULTS_TTL = 24*60*60
+SUBMODULE_UPDATE = ['git', 'submodule', 'update', '--init', '--recursive']
+PREREQS = """# Initialize submodule(s)
 git submodule update --init --recursive
 
 # First install plugin_checker's dependencies
@@ -65,472 +24,326 @@ pip3 install -r requirements.txt
 
 # Now install the main healthcheck dependencies
 cd ..
-pip3 install -r requirements.txt""")
-        print("#######Exception#######")
-        print(e2)
-        print("#######Exception#######")
-        exit(-1)
+pip3 install -r requirements.txt"""
 
-parser = OptionParser()
-parser.add_option('-d', '--directory', dest='zipdirectory', help="Path to the folder containing the support zips", metavar="/path/to/directory/with/zips")
-parser.add_option("-v", "--verbose", action="store_true", dest="verbose", default=False, help="Print healthcheck parsing information to stdout before printing the health check.")
-parser.add_option('-p', '--pluginpanel', action="store_true", dest='pluginpanel', default=False, help="Changes the plugin analysis from a single table to its own panel.")
-options, args = parser.parse_args()
-
-print("############################ Healthchecker Logs ############################")
-
-if options.verbose:
-    logging.basicConfig(format='%(levelname)s:\t%(message)s', datefmt='%m/%d/%Y %I:%M:%S %p', level=logging.DEBUG)
-    logging.debug("Debug Logging Enabled:")
-    logging.debug("Options: ")
-    logging.debug(options)
-    logging.debug("Args: ")
-    logging.debug(args)
-else:
-    logging.basicConfig(format='%(levelname)s:\t%(message)s', datefmt='%m/%d/%Y %I:%M:%S %p', level=logging.INFO)
-
-# Wish list / Improvement ideas / Work in progress
-# 1. Don't skip the DB information. If one Support Zip doesn't have it, maybe the other does?
-#    Line #217
-# 2. Scal JVM arguments for "-XX:+HeapDumpOnOutOfMemoryError" and "-XX:HeapDumpPath=" ; call it out if they're missing
-#    Line #295
-
-
-#Set Current direct as root
-noprops=""
-skipPrintprops=False
-
-#if specified, use directory and strip trailing slash if present
-if options.zipdirectory:
-    rootPath = options.zipdirectory[:-1] if options.zipdirectory.endswith("/") or options.zipdirectory.endswith("\\") else options.zipdirectory
-else:
-    rootPath = r"."
-# look for .zip files and unzip each into its own folder using name of support.zip
-pattern = '*.zip'
-
-try:
-    logging.debug("Traversing specified directory ("+rootPath+") and unzipping any .zip files found")
-    for root, dirs, files in os.walk(rootPath):
-        for filename in fnmatch.filter(files, pattern):
-            logging.debug("Zip found: "+os.path.join(root, filename))
-            extn = filename.split(".")
-            # Check if the filename of the zip file exists in the list of directories. 
-            if (extn[0] not in dirs):
-                zipfile.ZipFile(os.path.join(root, filename)).extractall(os.path.join(root, os.path.splitext(filename)[0]))
-except Exception as e:
-    logging.error("Issue resolving the path containing the support zips: "+rootPath)
-    logging.error(e)
-    print("############################ Healthchecker Logs ############################")
-    parser.print_help()
-    exit(-1)
-
-#list directories into a list. Now sure I will need it may be better to just search for files
-#dirlist=list((filter(lambda x: os.path.isdir(x), os.listdir('.'))))
-#print(dirlist)
-#print(dirlist[0])
-
-
-#search for files in all support.zips
-xml_list=[]
-for xml in glob.iglob(rootPath+'/**/application-properties/application.xml', recursive=True):
-    logging.debug("application.xml found: "+xml)
-    xml_list.append(xml)
-
-
-pp_list=[]
-for properties in glob.iglob(rootPath+'/**/application-config/bitbucket.properties', recursive=True):
-        logging.debug("bitbucket.properties found: "+properties)
-        pp_list.append(properties)
-
-if len(pp_list) == 0:
-    logging.debug("There is no bitbucket.properties file(s) in Support Zip(s) \nThis may be a containerized Instance such as Docker")
-    noprops="There is no bitbucket.properties file(s) in Support Zip(s) \nThis may be a containerized Instance such as Docker"
-    skipPrintprops=True
-
-try:
-    mytree = ET.parse(xml_list[0])
-except:
-    logging.error("We couldn't find an application.xml file based on the query: "+rootPath+"/**/application-properties/application.xml")
-    print("############################ Healthchecker Logs ############################")
-    parser.print_help()
-    exit(-1)
-myroot = mytree.getroot()
-
-#################################Display Missing Support Zips##################
-#used later to compare lists (which nodes are present and which are missing)
-def Diff(li1, li2): 
-    return (list(set(li1) - set(li2)))
-
-
-#find if clustered
-cluster=myroot.find('cluster-information/clustered')
-#if true then check to see how many node in cluster and compare against zips
-if cluster.text == 'true':
-    checknode=myroot.find('cluster-information')
-    howmanynodes=[]
-    for nodes in myroot.findall('cluster-information/node'):
-        howmanynodes.append(nodes)
-    if len(howmanynodes) == len(xml_list):
-        logging.info('All Support zips are present')
-    else:
-        logging.info('You have: '+str(len(howmanynodes))+' Nodes in the cluster')
-        logging.info('You have: '+str(len(xml_list))+' Support Zips from the cluster')
-        
-
-
-        #Get names of nodes from support zips present
-        foundlocal=[]
-		
-        for xmlfiles in xml_list:
-            tree2 = ET.parse(xmlfiles)
-            root2 = tree2.getroot()
-           # foundlocal=[]
-            if cluster.text == 'true':
-                #Need to use full xpaht to node
-                for getnode in root2.findall('cluster-information/node'):
-                    getip=getnode.find('id')
-                    getadder=getnode.find('address')
-                    getlocal=getnode.find('local')
-                    if getlocal.text == 'true':
-                        foundlocal.append(getip.text)
-                        foundlocal.append(getadder.text)                
-            #print("The following nodes have been found: ",foundlocal)
- 
-        #get missing nodes
-        othernodes=[]
-        for missingNode in myroot.findall('cluster-information/node'):
-            nodemissingID=missingNode.find('id')
-            nodemissingAdd=missingNode.find('address')
-            othernodes.append(nodemissingID.text)
-            othernodes.append(nodemissingAdd.text)
-                #need to compare list
-        logging.info("Found the following nodes :")
-        for found in foundlocal:
-        	logging.info(found)
-        miss=Diff(othernodes,foundlocal)
-        logging.info('\n')
-        logging.info("The following nodes are not present: ")
-        for nothing in miss:
-        	logging.info(nothing)
-print("\n")
-print(noprops)
-print("############################ Healthchecker Logs ############################")
-print('\n\n\n')
-
-# PRINT THE DISCLAIMER
-
-print("{panel:title=(!) Important:|borderStyle=solid|borderColor=#FF0000|titleBGColor=#FF0000|titleColor=#FFFF00|bgColor=#E7F4FA}")
-print("Please be aware that health checks are not completely conclusive. We provide analysis based on the logging provided and any other details offered at the start of the health check. The health checks also do not specify whether you will or will not encounter some type of issue in the future, and therefore should not be viewed as an overall pass/fail analysis of your system.")
-print("{panel}\nh6.\n----")
-print('h2. Health Check')
-print('(/) Ok/Good')
-print('(!) Warning, may need to follow up on or keep an eye out')
-print("(?) Need more information")
-print("(x) Needs to be addressed / Incorrect configuration")
-print("h6.")
-#start table for health check
-print("||Configurations & Settings||Values||")
-
-#get product and version
-prod=myroot.find('product')
-#prodName is an attribute of product
-prodName=prod.get('name')
-#the prodVer is a list
-prodVer=prod.items()
-#print just product name
-print("|*"+prodName+"*| |")
-#check version against recommend 6.10 or below
-testVer=(prodVer[1][1])
-if version.parse(testVer) >= version.parse("6.10.0"):
-    #print version and value
-    print("|*Product Version*|(/) *"+testVer+"* Version is Good|")
-else:
-    print("|*Product Version*|(!) *"+testVer+"* While your version is supported. \n You should think about upgrading. \n We recommend our [Long Term Support (LTS) Release|https://confluence.atlassian.com/enterprise/atlassian-enterprise-releases-948227420.html].|")
-
-
-
-#Check if clustered and get nodes
-cluster=myroot.find('cluster-information/clustered')
-if cluster.text == 'true':
-    nodes=myroot.findall('cluster-information/node')
-    print("|*Clustered DC Instance*\n* "+str(len(nodes))+" Nodes|", end="")
-    for x in nodes:
-        id=x.find('id')
-        ip=x.find('address')
-        print("*Node:* "+id.text)
-        print("*IP:* "+ip.text)
-    print("|")
-else:
-    print("|*Standalone Server*| |")
-
-
-#Get base url / should check if proxy good
-baseURL=myroot.find('bitbucket-information/base-url')
-print("|*Base URL*| "+baseURL.text+"|")
-# try to read props to check if proxy for standalone add later
-
-#get bb.props/ Should make a switch to turn on or off
-if skipPrintprops == True:
-    print("|*bitbucket.properties*|No bitbucket.properties file|")
-else:
-    bbprops=open(pp_list[0],'r')
-    print("|*bitbucket.properties*|{code}"+bbprops.read()+"{code}|")
-
-#OS information
-osEvn=myroot.find('operating-system')
-osName=osEvn.find('os-name')
-osArch=osEvn.find('os-architecture')
-osVer=osEvn.find('os-version')
-
-#check props file to see how many tickets
-osPross=osEvn.find('available-processors')
-osMem=osEvn.find('total-physical-memory')
-osSwap=osEvn.find('total-swap-space')
-osUlim=osEvn.find('max-file-descriptor')
-print("|*Operating System*\n* OS\n* Version\n* Processors\n* Memory\n* Swap\n* Ulimit|*Values*\n* "+osName.text+"\n* "+osVer.text+"\n* "+osPross.text+"\n* "+osMem.text+"\n* "+osSwap.text+"\n* "+osUlim.text+"|")
-
-#System resources
-print("|*System Resources*|", end='')
-for fileXML in xml_list:
-    mytree1 = ET.parse(fileXML)
-    myroot1 = mytree1.getroot()
-    sysloalave=myroot1.find('operating-system/system-load-average')
-    syscpu=myroot1.find('operating-system/system-cpu-load')
-    sysfreeswap=myroot1.find('operating-system/free-swap-space')
-    sysfreemem=myroot1.find('operating-system/free-physical-memory')
-    openfiles=myroot1.find('operating-system/open-file-descriptor')
-    foundlocal=[]
-    for getnode in myroot1.findall('cluster-information/node'):
-        getip=getnode.find('id')
-        getadder=getnode.find('address')
-        getlocal=getnode.find('local')
-        if getlocal.text == 'true':
-            foundlocal.append(getip.text)
-            foundlocal.append(getadder.text)
-    print('{panel:title=',foundlocal[0],foundlocal[1],'|borderStyle=dashed|borderColor=#3cb579|titleBGColor=#3cabb5|bgColor=#ccffcc}\n* From Support Zip:',fileXML[2:],'\n* Load Average:',sysloalave.text,'\n* CPU Load:',syscpu.text,'\n* System Memory Free:',sysfreemem.text,'\n* Swap Memory Free:',sysfreeswap.text,'\n* Open Files:',openfiles.text,'{panel}')
-print('|')
-
-# Database
-# note: "database-info" element structure may be different between versions. additional checks if value is "None" needed
-dbInfo=myroot.find('database-information')
-if dbInfo is not None:
-    dbName=dbInfo.find('database-name') 
-    dbVersion=dbInfo.find('version')
-    dbSupportLevel=dbInfo.find('support-level')
-    dbConnUrl=dbInfo.find('connection-url')
-    dbDriverName=dbInfo.find('.//driver-name')
-    dbDriverVersion=dbInfo.find('.//driver-version')
-    dbLabels="|*Database*"
-    dbValues="|*Values*"
-    if dbName is not None:
-        dbLabels += "\n* Name"
-        dbValues += "\n* "+dbName.text
-    if dbVersion is not None:
-        dbLabels += "\n* Version"
-        dbValues += "\n* "+dbVersion.text
-    if dbSupportLevel is not None:
-        dbLabels += "\n* Support Level" 
-        dbValues += "\n* "+dbSupportLevel.text
-    if dbConnUrl is not None:
-        dbLabels += "\n* Connection URL"
-        dbValues += "\n* "+dbConnUrl.text
-    if dbDriverName is not None:
-        dbLabels += "\n* Driver Name"
-        dbValues += "\n* "+dbDriverName.text
-    if dbDriverVersion is not None:
-        dbLabels += "\n* Driver Version"
-        dbValues += "\n* "+dbDriverVersion.text
-    print(dbLabels + dbValues + "|")
-
-#GIT
-git=myroot.find('git/version')
-if version.parse(git.text) >= version.parse("2.20"):
-    print('|*GIT Version*|(/) Your Git version is good: *'+git.text+'*|')
-elif version.parse("2.20") >= version.parse(git.text) >= version.parse("2.11"):
-    print('|*GIT Version*|(!) *While you meet the minimum requirements:* ',git.text,'\n* We recommend an upgrade to a later version 2.20+\n'+git.text+'\nPlease see our [Supported Platforms|https://confluence.atlassian.com/bitbucketserver076/supported-platforms-1026535721.html]\nAll Recommendations are based on the latest Bitbucket LTS Release.|')
-else:
-    print('|*GIT Version*|(x) *Unsupported Version:* ',git.text,'(x)\n* We recommend an upgrade to a later version 2.20+\nPlease see our [Supported Platforms|https://confluence.atlassian.com/bitbucketserver076/supported-platforms-1026535721.html]\nAll Recommendations are based on the latest Bitbucket LTS Release.|')
-
-#SCM cache settings
-scmhttp=myroot.find('scm-cache/http-enabled')
-if scmhttp.text == 'true':
-    print('|*HTTP cache*|(/) SCM cache for HTTP is *Enabled*|')
-else:
-    print('|*HTTP cache*|(!) SCM cache for HTTP is *Disabled*\n*Recommendation:* If possible, we recommend enabling SCM for better performance.\nThere are some configurations in which it should be disabled.\nFor more information please refer to:\n[Scaling Bitbucket for CI performance|https://confluence.atlassian.com/bitbucketserver/scaling-bitbucket-server-for-continuous-integration-performance-776640088.html]')
-
-scmssh=myroot.find('scm-cache/ssh-enabled')
-if scmssh.text == 'true':
-    print('|*SSH cache*|(/) SCM cache for SSH is *Enabled*|')
-else:
-    print('|*SSH cache*|(!) SCM cache for SSH is *Disabled*\n*Recommendation:* If possible we recommend enabling SCM for better performance.\nThere are some configurations in which it should be disabled.\nFor more information please refer to:\n[Scaling Bitbucket for CI performance|https://confluence.atlassian.com/bitbucketserver/scaling-bitbucket-server-for-continuous-integration-performance-776640088.html]')
-
-#Only check ref advertisement cache if version is lower than 7.3
-if version.parse(testVer) < version.parse("7.3.0"):
-    scmrefs=myroot.find('scm-cache/refs-advertisement/enabled')
-    if scmrefs.text == 'true':
-        print('|*Ref advertisement cache*|(/) SCM cache for ref advertisement is *Enabled*|')
+
+def update_plugin_checker():
+    """The update-plugin-checker subcommand: fetch or refresh the plugin_checker submodule. Returns an exit code."""
+    repo_path = os.path.dirname(os.path.abspath(__file__))
+    print("Updating plugin checker...")
+    try:
+        out = subprocess.Popen(SUBMODULE_UPDATE, stdout=subprocess.PIPE, cwd=repo_path)
+        for stdout_line in iter(out.stdout.readline, b''):
+            print(stdout_line.decode('utf-8', 'replace'), end='')
+        out.stdout.close()
+        return_code = out.wait()
+        if return_code:
+            raise subprocess.CalledProcessError(return_code, SUBMODULE_UPDATE)
+    except Exception as e:
+        print("Update failed:")
+        print(e)
+        return -1
+    print("Done!")
+    return 0
+
+
+def import_plugin_checker():
+    """Import plugin_checker's main(), or return None if the submodule isn't there (it is never fetched implicitly)."""
+    try:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__))+"/plugin_checker")
+        from plugin_checker import main
+    except Exception as e:
+        logging.error("Error importing plugin_checker module, so plugins won't be checked: "+str(e))
+        logging.error("Run '"+os.path.basename(__file__)+" update-plugin-checker' (needs network access) or go through the pre-reqs in the README:\n"+PREREQS)
+        return None
+    return main
+
+
+def check_plugins(load_plugin_checker, source, tableFormat, cache=None, nodeKey=None, timings=None):
+    """Run plugin_checker against a support zip's application.xml and return (output, success).
+
+    plugin_checker is only imported when there is no cached result. The output is cached for
+    PLUGIN_RESULTS_TTL, as it depends on Marketplace data and not just on the zip.
+    """
+    if cache is not None and nodeKey is not None:
+        key = cache.key('plugins', nodeKey, tableFormat)
+        cached = cache.load(key)
+        if cached is not None and time.time() - cached['checked'] < PLUGIN_RESULTS_TTL:
+            logging.debug("Using cached plugin_checker results")
+            cache.touch(key)
+            return cached['output'], cached['success']
+
+    plugin_checker_main = load_plugin_checker()
+    if plugin_checker_main is None:
+        return "(?) Plugins could not be checked as plugin_checker is not installed.\n", False
+
+    #plugin_checker wants a path on disk, so only application.xml is pulled out of the zip for it
+    from healthcheck.supportzip import APP_XML
+    output = io.StringIO()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        appXmlPath = source.extract_member(APP_XML, tmpdir)
+        logging.disable()
+        try:
+            with contextlib.redirect_stdout(output), (timings.phase('plugin_checker.main') if timings else contextlib.nullcontext()):
+                success = plugin_checker_main(appXmlPath,True,False,tableFormat)
+        finally:
+            logging.disable(logging.NOTSET)
+            source.close()
+
+    if cache is not None and nodeKey is not None:
+        try:
+            cache.store(key, {'output': output.getvalue(), 'success': success, 'checked': time.time()})
+            cache.save()
+        except OSError as e:
+            logging.warning("Couldn't update the analysis cache in "+cache.path+": "+str(e))
+    return output.getvalue(), success
+
+
+def run():
+    parser = OptionParser(usage="%prog [options]\n       %prog [options] --batch /path/to/bundle ...\n       %prog [options] --watch /path/to/drop/folder\n       %prog update-plugin-checker")
+    parser.add_option('-d', '--directory', dest='zipdirectory', help="Path to the folder containing the support zips", metavar="/path/to/directory/with/zips")
+    parser.add_option("-v", "--verbose", action="store_true", dest="verbose", default=False, help="Print healthcheck parsing information to stdout before printing the health check.")
+    parser.add_option('-p', '--pluginpanel', action="store_true", dest='pluginpanel', default=False, help="Changes the plugin analysis from a single table to its own panel.")
+    parser.add_option('-x', '--extract', action="store_true", dest='extract', default=False, help="Extract each support zip next to it before analysing it. By default the zips are read in place.")
+    parser.add_option('--cache-dir', dest='cachedir', default=None, help="Where to cache analysis results between runs (default: ~/.cache/bb_healthcheck).", metavar="/path/to/cache")
+    parser.add_option('--cache-size', type="int", dest='cachesize', default=DEFAULT_CACHE_SIZE_MB, help="Size limit of the analysis cache in MB; least recently used results are evicted first (default: %default).", metavar="MB")
+    parser.add_option('--no-cache', action="store_false", dest='cache', default=True, help="Don't read or write the analysis cache.")
+    parser.add_option('-j', '--jobs', type="int", dest='jobs', default=1, help="Number of worker processes used to read and parse the support zips (default: 1).", metavar="N")
+    parser.add_option('--profile', action="store_true", dest='profile', default=False, help="Measure the wall time, CPU time and memory of each phase and report section, print them after the report and save them as JSON.")
+    parser.add_option('--profile-output', dest='profileoutput', default=None, help="Where to save the --profile JSON (default: healthcheck-profile.json in the support zip directory).", metavar="/path/to/profile.json")
+    parser.add_option('--offline', action="store_true", dest='offline', default=False, help="Don't contact Marketplace; check plugins against the local plugin catalog only, however old its entries are.")
+    parser.add_option('--plugin-catalog', dest='plugincatalog', default=None, help="SQLite catalog of Marketplace answers used to check plugins (default: plugin-catalog.sqlite in the cache directory).", metavar="/path/to/catalog.sqlite")
+    parser.add_option('--catalog-ttl', type="int", dest='catalogttl', default=PLUGIN_RESULTS_TTL//3600, help="Hours before a plugin catalog entry is fetched from Marketplace again (default: %default).", metavar="HOURS")
+    parser.add_option('--marketplace-url', dest='marketplaceurl', default=DEFAULT_MARKETPLACE_URL, help="Marketplace to look plugins up in, e.g. a local stand-in server (default: %default).", metavar="URL")
+    parser.add_option('--plugin-checker', action="store_true", dest='pluginchecker', default=False, help="Check the first node's plugins with the plugin_checker submodule instead of the plugin catalog.")
+    parser.add_option('-f', '--format', type="choice", choices=REPORT_FORMATS, dest='format', default='jira', help="Report format: "+", ".join(REPORT_FORMATS)+" (default: %default).")
+    parser.add_option('-o', '--output', dest='output', default=None, help="Write the report to this file instead of stdout.", metavar="/path/to/report")
+    parser.add_option('--history', dest='history', default=None, help="SQLite store of each node's metrics across runs (default: history.sqlite in the cache directory).", metavar="/path/to/history.sqlite")
+    parser.add_option('--record', action="store_true", dest='record', default=False, help="Record each node's metrics, with the instance's server ID and base URL, in the history store for --trend. Off by default, as the store outlives the run.")
+    parser.add_option('--trend', action="store_true", dest='trend', default=False, help="Report how heap usage, open files and disk use have changed across this instance's support zips, and when they will reach their limits.")
+    parser.add_option('--only', dest='only', default=None, help="Run only these checks, comma separated; the logs and other inputs no other check needs aren't read. See --list-checks.", metavar="CHECK,...")
+    parser.add_option('--skip', dest='skip', default=None, help="Leave these checks out, comma separated.", metavar="CHECK,...")
+    parser.add_option('--list-checks', action="store_true", dest='listchecks', default=False, help="List the checks and the inputs each one reads, then exit.")
+    parser.add_option('--check-timeout', type="int", dest='checktimeout', default=None, help="Seconds any one check may take before it is reported as (?) (default: 60, 600 for plugins).", metavar="SECONDS")
+    parser.add_option('--batch', action="store_true", dest='batch', default=False, help="Analyse each directory given as an argument as a separate bundle of support zips, writing a report next to each one.")
+    parser.add_option('--watch', dest='watch', default=None, help="Keep watching a drop folder and analyse each of its subdirectories when new support zips arrive.", metavar="/path/to/drop/folder")
+    parser.add_option('--batch-jobs', type="int", dest='batchjobs', default=None, help="Number of bundles analysed at the same time in --batch and --watch mode (default: number of CPUs).", metavar="N")
+    parser.add_option('--batch-index', dest='batchindex', default=None, help="Where to write the index of --batch/--watch runs (default: ./healthcheck-index.txt, or in the drop folder).", metavar="/path/to/index.txt")
+    parser.add_option('--interval', type="int", dest='interval', default=DEFAULT_WATCH_INTERVAL, help="Seconds between checks of the drop folder in --watch mode (default: %default).", metavar="SECONDS")
+    options, args = parser.parse_args()
+
+    if args and args[0] == 'update-plugin-checker':
+        exit(update_plugin_checker())
+
+    if options.listchecks:
+        from healthcheck import checks, rules
+        print(rules.describe())
+        exit(0)
+
+    if options.batch or options.watch:
+        from healthcheck import batch
+        logging.basicConfig(format='%(levelname)s:\t%(message)s', level=logging.DEBUG if options.verbose else logging.INFO)
+        exit(batch.main(options, args, os.path.abspath(__file__)))
+
+    from healthcheck import supportzip
+    from healthcheck.ingest import ingest
+    from healthcheck.cache import AnalysisCache
+    from healthcheck.timing import Timings
+    from healthcheck.report import Report, write_report
+    #importing checks registers them with rules
+    from healthcheck import checks, rules
+    import functools
+    import sqlite3
+
+    #the checks asked for decide which inputs are read at all
+    split = lambda names: [name.strip() for name in names.split(',') if name.strip()] if names else None
+    try:
+        selected = rules.select(split(options.only), split(options.skip), ['capacity-trend'] if options.trend else [])
+    except ValueError as e:
+        parser.error(str(e))
+    needed = rules.needed_inputs(selected)
+
+    startTime = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+    timings = Timings(options.profile)
+    timings.lap('setup')
+
+    #the log banners are part of the Jira text that gets pasted into tickets; other formats go to stdout on their own
+    logBanners = options.format == 'jira' and not options.output
+    if logBanners:
+        print("############################ Healthchecker Logs ############################")
+
+    if options.verbose:
+        logging.basicConfig(format='%(levelname)s:\t%(message)s', datefmt='%m/%d/%Y %I:%M:%S %p', level=logging.DEBUG)
+        logging.debug("Debug Logging Enabled:")
+        logging.debug("Options: ")
+        logging.debug(options)
+        logging.debug("Args: ")
+        logging.debug(args)
     else:
-        print('|*Ref advertisement cache*|(!) SCM cache for *ref advertisement* is *Disabled*\n*Recommendation:* If possible we recommend enabling SCM for better performance.\nThere are some configurations in which it should be disabled.\nFor more information please refer to:\n[Scaling Bitbucket for CI performance|https://confluence.atlassian.com/bitbucketserver/scaling-bitbucket-server-for-continuous-integration-performance-776640088.html]')
-        print('(!) *Please note:* Ref advertisement cache is no longer applicable to Bitbucket versions 7.4 and later.|')
-else:
-    print("|*Ref advertisement cache*|(/) SCM cache for ref advertisement is [no longer used|https://confluence.atlassian.com/bitbucketserver/scaling-bitbucket-server-776640073.html#ScalingBitbucketServer-Caching] in Bitbucket version "+testVer+".|")
-#JAVA
-jv=myroot.find('java-runtime-environment/java.runtime.version')
-# Marek: Automatic assessment of Java version + printing the outcome with recommendation (where applicable)
-# Possible outcomes and final message of the assessment to be printed out
-bad_java_version  = "|*Java Version*|(x) Your Java version *"+jv.text+"* is not supported!\nPlease refer to [Supported Platforms|https://confluence.atlassian.com/bitbucketserver076/supported-platforms-1026535721.html#Supportedplatforms-javaJava] for more information.|"
-warn_java_version = "|*Java Version*|(!) *"+jv.text+"*\nJava versions 11.0.0 - 11.0.7 are not recommended due to Java bug: [JDK-8241054|https://bugs.openjdk.java.net/browse/JDK-8241054].\nWe recommended Java version 11.0.8 (or later).|"
-OK_java_version   = "|*Java Version*|(/) Your Java version *"+jv.text+"* is good.\n* *Please note:* _Bitbucket Server 8.0 will raise the minimum supported Java version to 11.0.8._|"
-good_java_version = "|*Java Version*|(/) Your Java version *"+jv.text+"* is good.|"
-# Assessment
-if (version.parse(jv.text) <= version.parse("1.8") and jv.text.find('_')<0):
-    print(bad_java_version)
-else:
-    if version.parse(jv.text) < version.parse("1.8.0_65"):
-        print(bad_java_version)
+        logging.basicConfig(format='%(levelname)s:\t%(message)s', datefmt='%m/%d/%Y %I:%M:%S %p', level=logging.INFO)
+
+    # Wish list / Improvement ideas / Work in progress
+    # 1. Don't skip the DB information. If one Support Zip doesn't have it, maybe the other does?
+    #    check_database() in healthcheck/checks.py
+
+
+    #Set Current direct as root
+    noprops=""
+
+    #if specified, use directory and strip trailing slash if present
+    if options.zipdirectory:
+        rootPath = options.zipdirectory[:-1] if options.zipdirectory.endswith("/") or options.zipdirectory.endswith("\\") else options.zipdirectory
     else:
-        if version.parse(jv.text) < version.parse("1.8.0_9999"):
-            print(OK_java_version)
+        rootPath = r"."
+    # look for support zips and read each one in place (or extract it first if asked to)
+    try:
+        logging.debug("Traversing specified directory ("+rootPath+") looking for support zips")
+        timings.lap('find support zips')
+        sources = supportzip.find_sources(rootPath)
+    except Exception as e:
+        logging.error("Issue resolving the path containing the support zips: "+rootPath)
+        logging.error(e)
+        print("############################ Healthchecker Logs ############################")
+        parser.print_help()
+        exit(-1)
+
+    #parse every support zip once into a node record that all the checks share, analysing only the logs they read
+    cache = AnalysisCache(options.cachedir, options.cachesize*1024*1024) if options.cache else None
+    nodes=[]
+    nodeKeys=[]
+    ingested=[]
+    timings.lap('ingest')
+    for result in ingest(sources, rootPath, extract=options.extract, jobs=options.jobs, cache=cache, timings=timings, logs=rules.wanted_logs(selected)):
+        if result.error is not None:
+            logging.warning("Skipping "+result.source.path+": "+result.error)
+        elif result.node is None:
+            logging.debug("Skipping "+result.source.path+", it isn't a support zip")
         else:
-            if version.parse(jv.text) < version.parse("11"):
-                print(bad_java_version)
-            else:
-                if version.parse(jv.text) < version.parse("11.0.8"):
-                    print(warn_java_version)
-                else:
-                    if version.parse(jv.text) < version.parse("12"):
-                        print(good_java_version)
-                    else:
-                        print(bad_java_version)
-#get jvm args
-javaParams=myroot.find('java-runtime-environment/virtual-machine-arguments')
-#list jvm args/ add newlines by replacing a space with a newline
-jp=javaParams.text.replace(' ', '\n')
-j1=jp.replace('|','\|')
-j=j1.replace('*','\*')
-print("|*JVM arguments*|",j,"|")
-
-#Put java params in a list
-jplist=j.splitlines()
-
-# Could loop through the java param list in search for "-XX:+HeapDumpOnOutOfMemoryError" and "-XX:HeapDumpPath=" ; call it out if they're missing!
-
-#loop through list and find heap
-heap=[]
-for elem in jplist:
-    if "Xms" in elem or "Xmx" in elem:
-        heap.append(elem)
-# can add check for to see if both min and max are present
-# then check if they are same and recommend its for heaps under 12gb
-if len(heap) == 2:
-    if heap[0][4] == heap[1][4]:
-        print("|*Java HEAP*|(/) *Heap Settings*\n* ", end="")
-        print(','.join(heap),"|")
-    else:
-        print("|*Java HEAP*|(!) *Heap Settings*: " + ','.join(heap))
-        print("* We recommend setting {{-Xms}} and {{-Xmx}} to the same value.|\n", end="")
-else:
-    print("|*Java HEAP*|(x) *Heap Settings*\n* We recommend setting {{-Xms}} and {{-Xmx}} to the same value.\n ", end="")
-    print(','.join(heap),"|")
-
-
-#Heap Usage
-
-#looping thought support zips to get heap usage
-print("|*Java Resources*|", end='')
-for fileXML in xml_list:
-    mytree1 = ET.parse(fileXML)
-    myroot1 = mytree1.getroot()
-    heapPercent=myroot1.find('java-runtime-environment/percent-heap-used')
-    heapUsed=myroot1.find('java-runtime-environment/heap-used')
-    heapAvailable=myroot1.find('java-runtime-environment/heap-available')
-    #checking if clustered and find local node name
-    cluster=myroot1.find('cluster-information/clustered')
-    #creaete list at this level to hold the localID for node
-    foundlocal=[]
-    for getnode in myroot1.findall('cluster-information/node'):
-        getip=getnode.find('id')
-        getadder=getnode.find('address')
-        getlocal=getnode.find('local')
-        if getlocal.text == 'true':
-            foundlocal.append(getip.text)
-            foundlocal.append(getadder.text)
-
-    print('{panel:title=',foundlocal[0],foundlocal[1],'|borderStyle=dashed|borderColor=#3C78B5|titleBGColor=#3C78B5|bgColor=#E7F4FA}\n* From Support Zip:',fileXML[2:],'\n* Heap Percentage Used:',heapPercent.text,'\n* Heap Space Free:',heapAvailable.text,'\n* Max Heap/Size:',heapUsed.text,'{panel}')
-print('|')
-
-# Filesystem - home
-print("|*Filesystem -*\n*Home directory*|", end='')
-for fileXML in xml_list:
-    mytree1 = ET.parse(fileXML)
-    myroot1 = mytree1.getroot()
-    fsHome = myroot1.find('filesystem/home')
-    dirName = fsHome.find('name')
-    dirPath = fsHome.find('path')
-    dirType = fsHome.find('type')
-    dirFreeSize = fsHome.find('free-size')
-    dirTotalSize = fsHome.find('total-size')
-    dirFreeSizeStr = dirFreeSize.text + ' out of ' + dirTotalSize.text
-    #checking if clustered and find local node name
-    cluster=myroot1.find('cluster-information/clustered')
-    #creaete list at this level to hold the localID for node
-    foundlocal=[]
-    for getnode in myroot1.findall('cluster-information/node'):
-        getip=getnode.find('id')
-        getadder=getnode.find('address')
-        getlocal=getnode.find('local')
-        if getlocal.text == 'true':
-            foundlocal.append(getip.text)
-            foundlocal.append(getadder.text)
-
-    print('{panel:title=',foundlocal[0],foundlocal[1],'|borderStyle=dashed|borderColor=#3C78B5|titleBGColor=#8587FB|bgColor=#E3E4FF}\n* Name:',
-        dirName.text,'\n* Path:',dirPath.text,'\n* Type:',dirType.text,'\n* Free space:',dirFreeSizeStr,'{panel}')
-print('|')
-
-# Filesystem - shared home (only need one)
-print("|*Filesystem -*\n*Shared Home directory*|", end='')
-fsSharedHome = myroot.find('filesystem/shared-home')
-dirName = fsSharedHome.find('name')
-dirPath = fsSharedHome.find('path')
-dirType = fsSharedHome.find('type')
-dirFreeSize = fsSharedHome.find('free-size')
-dirTotalSize = fsSharedHome.find('total-size')
-dirFreeSizeStr = dirFreeSize.text + ' out of ' + dirTotalSize.text
-print('{panel:title=Shared Home|borderStyle=dashed|borderColor=#3C78B5|titleBGColor=#8587FB|bgColor=#E3E4FF}\n* Name:',
-    dirName.text,'\n* Path:',dirPath.text,'\n* Type:',dirType.text,'\n* Free space:',dirFreeSizeStr,'{panel}')
-print('|')
-
-# Elasticsearch
-es=myroot.find('Elasticsearch')
-esBaseUrl=es.find('base-url')
-esConnStatus=es.find('connection-result')
-print("|*Elasticsearch*\n* URL\n* Status|*Values*\n*",
-    esBaseUrl.text,"\n*",esConnStatus.text,"|")
-
-
-if testVer[0] == 7:
-
-    getprojects = myroot.find('projects/count')
-    if getprojects != "":
-        print("|*Project Count*|*",getprojects.text,"|")
-
-    getrepos = myroot.find('repositories/count')
-    if getrepos != "":
-        print("|*Repository Count*|*",getrepos.text,"|")
-
-
-#Call to plugin_checker.py
-#Method sig:
-#   main(String pathToAppXml, Boolean jiraMarkdown, Boolean verbose, Boolean tableFormat)
-
-if options.pluginpanel:
+            logging.debug(("Cached analysis used for: " if result.cached else "application.xml found: ")+result.node.label)
+            nodes.append(result.node)
+            nodeKeys.append(result.key)
+            ingested.append(result.source)
+    sources = ingested
+
+    #with --record the run adds its numbers to the history, keyed by the instance, so --trend can compare support zips over time
+    series = {}
+    if options.record or 'history' in needed:
+        timings.lap('history')
+        from healthcheck import history
+        from healthcheck.cache import default_cache_dir
+        historyPath = options.history or os.path.join(options.cachedir or default_cache_dir(), history.HISTORY_FILE)
+        try:
+            store = history.MetricsStore(historyPath)
+            if options.record:
+                for node, source in zip(nodes, sources):
+                    store.record(node.server_id, node.base_url, history.node_name(node), history.sample_time(source.path),
+                                 os.path.basename(source.path), history.node_metrics(node))
+                logging.info("Recorded the metrics of "+str(len(nodes))+" node(s) in "+historyPath)
+            if 'history' in needed and nodes:
+                series = store.series(nodes[0].server_id, nodes[0].base_url)
+            store.close()
+        except (OSError, sqlite3.Error) as e:
+            logging.warning("Couldn't use the metrics history in "+historyPath+": "+str(e))
+    timings.lap('cluster overview')
+
+    pp_list=[node for node in nodes if node.properties is not None]
+
+    if len(pp_list) == 0:
+        logging.debug("There is no bitbucket.properties file(s) in Support Zip(s) \nThis may be a containerized Instance such as Docker")
+        noprops="There is no bitbucket.properties file(s) in Support Zip(s) \nThis may be a containerized Instance such as Docker"
+
+    if len(nodes) == 0:
+        logging.error("We couldn't find an application.xml file in any support zip under: "+rootPath)
+        print("############################ Healthchecker Logs ############################")
+        parser.print_help()
+        exit(-1)
+    #cluster wide settings are taken from the first support zip
+    mynode = nodes[0]
+
+    #################################Display Missing Support Zips##################
+    #used later to compare lists (which nodes are present and which are missing)
+    def Diff(li1, li2): 
+        return (list(set(li1) - set(li2)))
+
+
+    #if clustered then check to see how many node in cluster and compare against zips
+    if mynode.clustered:
+        if len(mynode.cluster_nodes) == len(nodes):
+            logging.info('All Support zips are present')
+        else:
+            logging.info('You have: '+str(len(mynode.cluster_nodes))+' Nodes in the cluster')
+            logging.info('You have: '+str(len(nodes))+' Support Zips from the cluster')
+
+            #Get names of nodes from support zips present
+            foundlocal=[]
+            for node in nodes:
+                if node.local_id is not None:
+                    foundlocal.append(node.local_id)
+                    foundlocal.append(node.local_address)
+
+            #get missing nodes
+            othernodes=[]
+            for nodeId, nodeAddress in mynode.cluster_nodes:
+                othernodes.append(nodeId)
+                othernodes.append(nodeAddress)
+            #need to compare list
+            logging.info("Found the following nodes :")
+            for found in foundlocal:
+                logging.info(found)
+            miss=Diff(othernodes,foundlocal)
+            logging.info('\n')
+            logging.info("The following nodes are not present: ")
+            for nothing in miss:
+                logging.info(nothing)
+    if logBanners:
         print("\n")
-        logging.disable()
-        plugin_check_success = main(xml_list[0],True,False,False)
-        logging.disable(logging.NOTSET)
-else:
-        print("|*User-Installed Plugins*|{panel}",end='')
-        logging.disable()
-        plugin_check_success = main(xml_list[0],True,False,True)
-        logging.disable(logging.NOTSET)
-        print("{panel}|")
+        print(noprops)
+        print("############################ Healthchecker Logs ############################")
+        print('\n\n\n')
+
+    # PRINT THE DISCLAIMER
+    timings.lap('report: header')
+    report = Report(disclaimer="Please be aware that health checks are not completely conclusive. We provide analysis based on the logging provided and any other details offered at the start of the health check. The health checks also do not specify whether you will or will not encounter some type of issue in the future, and therefore should not be viewed as an overall pass/fail analysis of your system.",
+                    legend=[('(/)', 'Ok/Good'), ('(!)', 'Warning, may need to follow up on or keep an eye out'), ('(?)', 'Need more information'),
+                            ('(x)', 'Needs to be addressed / Incorrect configuration')])
+
+    #the checks run side by side and each adds its rows; the report keeps the order they are registered in, whichever finishes first
+    timings.lap('checks')
+    #a check that overruns its time limit may still be inside plugin_checker, with stdout redirected, so the report goes to the real one
+    reportOut = sys.stdout
+    context = rules.CheckContext(nodes, sources, nodeKeys, options, cache, series, functools.partial(check_plugins, import_plugin_checker))
+    for outcome in rules.run_rules(selected, context, options.checktimeout, options.profile):
+        timings.extend(outcome.timings)
+        for item in outcome.items:
+            report.add(item)
+
+    #the whole report is rendered and written at once, in the format asked for
+    timings.lap('render')
+    try:
+        if options.output:
+            with open(options.output, 'w', encoding='utf-8') as out:
+                write_report(report, out, options.format)
+            logging.info("Report written to "+options.output)
+        else:
+            write_report(report, reportOut, options.format)
+    except OSError as e:
+        logging.error("Couldn't write the report to "+str(options.output)+": "+str(e))
+        exit(-1)
+
+    timings.lap(None)
+    if options.profile:
+        #every report section is timed too, so the table can only come after the report; it goes to stderr with the logs
+        sys.stdout.flush()
+        print("############################ Healthchecker Profile ############################", file=sys.stderr)
+        print(timings.table(), file=sys.stderr)
+        print("############################ Healthchecker Profile ############################", file=sys.stderr)
+        profilePath = options.profileoutput or os.path.join(rootPath, 'healthcheck-profile.json')
+        try:
+            timings.save(profilePath, started=startTime, argv=sys.argv[1:], python=sys.version.split()[0], nodes=len(nodes), jobs=options.jobs)
+            logging.info("Profile saved to "+profilePath)
+        except OSError as e:
+            logging.warning("Couldn't save the profile to "+profilePath+": "+str(e))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1 @@
+"""Helpers used by health.py to read and analyse Bitbucket support zips."""
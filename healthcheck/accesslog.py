@@ -0,0 +1,179 @@
+"""Throughput and latency from atlassian-bitbucket-access.log*.
+
+Each access log line is a ' | ' separated record:
+
+    ip | protocol | request id | user | date | action | details | status | bytes read | bytes written | labels | duration | session |
+
+Incoming requests (request id starting with 'i@') are logged before they
+have a status or duration, so only the outgoing 'o@' lines are counted.
+The logs are streamed line by line through a small generator pipeline
+and durations are kept in compact integer arrays, so memory use grows
+with the number of requests (4 bytes each) rather than the size of the
+logs.
+"""
+from array import array
+from collections import Counter
+from dataclasses import dataclass, field
+import datetime
+import gzip
+import io
+import math
+import re
+
+from healthcheck.supportzip import ACCESS_LOGS
+
+TOP_ENDPOINTS = 5
+TOP_REPOSITORIES = 5
+#endpoints seen fewer times than this are too noisy to rank by percentile
+MIN_ENDPOINT_REQUESTS = 5
+
+#path segments that are followed by a project key, repository slug, id, etc.
+_COLLECTIONS = {'projects', 'repos', 'users', 'commits', 'pull-requests', 'branches', 'tags', 'browse',
+                'raw', 'files', 'diff', 'hooks', 'settings', 'permissions', 'tasks', 'comments', 'builds'}
+_SCM_HTTP = re.compile(r'/scm/([^/]+)/([^/]+?)(?:\.git)?(?:/|$)')
+_SCM_SSH = re.compile(r"'/?([^/']+)/([^/']+?)(?:\.git)?'")
+
+
+@dataclass
+class AccessLogStats:
+    files: int = 0
+    requests: int = 0
+    first: str = None
+    last: str = None
+    avg_rpm: float = 0.0
+    peak_rpm: int = 0
+    peak_minute: str = None
+    p50: int = None
+    p95: int = None
+    p99: int = None
+    clones: int = 0
+    fetches: int = 0
+    pushes: int = 0
+    #[(endpoint, requests, p95 ms, max ms)]
+    slow_endpoints: list = field(default_factory=list)
+    #[(repository, clones + fetches, bytes written)]
+    clone_repositories: list = field(default_factory=list)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted sequence."""
+    if not values:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(values)))
+    return values[rank - 1]
+
+
+def normalise_endpoint(action):
+    """Collapse an access log action into an endpoint, e.g. 'GET /rest/api/1.0/projects/:id/repos/:id'."""
+    if action.startswith('"'):
+        parts = action.strip('"').split(' ')
+        method, path = (parts[0], parts[1]) if len(parts) > 1 else ('', parts[0])
+        path = path.split('?', 1)[0]
+        if path.startswith('/scm/'):
+            tail = _SCM_HTTP.sub('/scm/:id/:id/', path, count=1)
+            return method + ' ' + tail.rstrip('/')
+        segments = path.split('/')
+        for i in range(1, len(segments)):
+            if segments[i - 1] in _COLLECTIONS or segments[i].isdigit():
+                segments[i] = ':id'
+        return method + ' ' + '/'.join(segments)
+    #SSH actions look like: SSH - git-upload-pack '/proj/repo.git'
+    words = action.split()
+    command = next((word for word in words if word.startswith('git-')), words[-1] if words else action)
+    return 'SSH ' + command
+
+
+def repository(action):
+    match = _SCM_HTTP.search(action) or _SCM_SSH.search(action)
+    if match is None:
+        return None
+    return match.group(1).upper() + '/' + match.group(2)
+
+
+def read_lines(source, names):
+    """Yield the lines of each log in turn, decompressing rotated .gz logs on the fly."""
+    for name in names:
+        with source.open(name) as raw:
+            stream = gzip.GzipFile(fileobj=raw) if name.endswith('.gz') else raw
+            for line in io.TextIOWrapper(stream, encoding='utf-8', errors='replace'):
+                yield line
+
+
+def parse(lines):
+    """Yield (minute, action, labels, duration ms, bytes written) for every completed request."""
+    for line in lines:
+        fields = line.split(' | ')
+        if len(fields) < 12 or not fields[2].startswith('o@'):
+            continue
+        try:
+            duration = int(fields[11])
+        except ValueError:
+            continue
+        try:
+            written = int(fields[9])
+        except ValueError:
+            written = 0
+        #'2021-02-03 17:01:00,120' -> '2021-02-03 17:01'
+        yield fields[4][:16], fields[5], fields[10], duration, written
+
+
+def analyse(records, files=0):
+    durations = array('I')
+    perEndpoint = {}
+    perMinute = Counter()
+    repoOps = Counter()
+    repoBytes = Counter()
+    stats = AccessLogStats(files=files)
+
+    for minute, action, labels, duration, written in records:
+        duration = min(max(duration, 0), 0xFFFFFFFF)
+        durations.append(duration)
+        perMinute[minute] += 1
+        perEndpoint.setdefault(normalise_endpoint(action), array('I')).append(duration)
+        #labels are a comma separated list, e.g. 'clone, protocol:2, cache:miss'
+        labelSet = set(label.strip() for label in labels.split(','))
+        if 'push' in labelSet:
+            stats.pushes += 1
+        elif 'clone' in labelSet or 'shallow clone' in labelSet or 'fetch' in labelSet:
+            if 'fetch' in labelSet:
+                stats.fetches += 1
+            else:
+                stats.clones += 1
+            repo = repository(action)
+            if repo is not None:
+                repoOps[repo] += 1
+                repoBytes[repo] += written
+
+    stats.requests = len(durations)
+    if not durations:
+        return stats
+    ordered = sorted(durations)
+    stats.p50, stats.p95, stats.p99 = (percentile(ordered, pct) for pct in (50, 95, 99))
+
+    minutes = sorted(perMinute)
+    stats.first, stats.last = minutes[0], minutes[-1]
+    stats.peak_minute, stats.peak_rpm = max(perMinute.items(), key=lambda item: (item[1], item[0]))
+    try:
+        span = datetime.datetime.strptime(stats.last, '%Y-%m-%d %H:%M') - datetime.datetime.strptime(stats.first, '%Y-%m-%d %H:%M')
+        stats.avg_rpm = stats.requests / (span.total_seconds() / 60 + 1)
+    except ValueError:
+        stats.avg_rpm = stats.requests / float(len(minutes))
+
+    ranked = []
+    for endpoint, values in perEndpoint.items():
+        if len(values) >= MIN_ENDPOINT_REQUESTS:
+            ordered = sorted(values)
+            ranked.append((endpoint, len(values), percentile(ordered, 95), ordered[-1]))
+    ranked.sort(key=lambda item: (-item[2], item[0]))
+    stats.slow_endpoints = ranked[:TOP_ENDPOINTS]
+    stats.clone_repositories = [(repo, count, repoBytes[repo]) for repo, count in
+                                sorted(repoOps.items(), key=lambda item: (-item[1], item[0]))[:TOP_REPOSITORIES]]
+    return stats
+
+
+def analyse_source(source):
+    """Analyse every access log in a support zip; None if it has none."""
+    names = source.files(ACCESS_LOGS)
+    if not names:
+        return None
+    return analyse(parse(read_lines(source, names)), files=len(names))
@@ -0,0 +1,193 @@
+"""Known error signatures in the application logs (atlassian-bitbucket.log*).
+
+The application logs of a cluster often add up to gigabytes, and the
+problems looked for first (Hazelcast split brain, an exhausted database
+pool, OutOfMemoryError, rejected hosting tickets, Elasticsearch timeouts)
+each leave a recognisable line. SIGNATURES is the catalog of them, and
+each log is read once however long the catalog is:
+
+  * logs in an extracted folder are memory-mapped and searched in place,
+  * logs read from a zip, and rotated .gz logs, are streamed in
+    CHUNK_SIZE blocks cut at line boundaries.
+
+Python's re has no fast multi-pattern mode: an alternation of all the
+patterns tries every branch at nearly every byte, and ran at a few MB/s.
+So every signature also lists anchors, literals at least one of which is
+on any line it matches. Each block is searched for the anchors with
+bytes.find, at memchr speed, and only the lines containing one go through
+the combined regex (a named group per signature), which decides the
+signature. A line counts once, for the first signature on it; its
+timestamp moves the first and last occurrence, and the first SAMPLES
+lines of each signature are kept.
+
+Each node's logs are scanned by the worker that ingests its support zip,
+so -j spreads the scanning across nodes.
+"""
+from collections import OrderedDict, namedtuple
+from dataclasses import dataclass, field
+import gzip
+import mmap
+import os
+import re
+
+from healthcheck.supportzip import APP_LOGS, DirectorySource
+
+CHUNK_SIZE = 8 * 1024 * 1024
+SAMPLES = 3
+#sample lines are cut to this many characters
+SAMPLE_LENGTH = 300
+
+#anchors are case sensitive bytes, one of which is on every line pattern matches (so they leave out a first letter that may be
+#either case); pattern is a bytes regex matched within one line, whose groups must be non-capturing
+Signature = namedtuple('Signature', 'name label status anchors pattern')
+#anchors of every signature, and one regex of all their patterns
+Matcher = namedtuple('Matcher', 'anchors pattern')
+
+SIGNATURES = (
+    Signature('out-of-memory', 'OutOfMemoryError', '(x)', (b'OutOfMemoryError',), rb'java\.lang\.OutOfMemoryError'),
+    #split brain is matched in any case, so the anchors are the lower and upper case 'plit' of split, SPLIT, Split-Brain, ...
+    Signature('split-brain', 'Hazelcast split brain', '(x)', (b'plit', b'PLIT', b'MergeClustersOp', b'is merging '),
+              rb'(?i:split[- ]?brain)|MergeClustersOp|is merging (?:to|with) '),
+    Signature('db-pool', 'Database pool exhausted', '(x)', (b'Connection is not available', b'Timeout waiting for idle object', b'Cannot get a connection', b'exhausted'),
+              rb'Connection is not available, request timed out|Timeout waiting for idle object|Cannot get a connection, pool error|(?i:pool)[^\n]{0,80}?exhausted'),
+    Signature('hosting-tickets', 'Hosting ticket rejected', '(!)', (b'ResourceBusyException', b'icket could not be acquired'),
+              rb'ResourceBusyException|[Tt]icket could not be acquired'),
+    Signature('elasticsearch-timeout', 'Elasticsearch timeout', '(!)', (b'lasticsearch', b'lasticSearch', b'ELASTICSEARCH', b'pensearch', b'penSearch', b'PENSEARCH'),
+              rb'(?i:elasticsearch|opensearch)[^\n]{0,200}?(?:SocketTimeoutException|(?i:timed out|timeout))'),
+    Signature('open-files', 'Too many open files', '(x)', (b'Too many open files',), rb'Too many open files'),
+)
+
+_TIME = re.compile(rb'\d{4}-\d\d-\d\d[ T]\d\d:\d\d:\d\d')
+
+
+@dataclass
+class SignatureHits:
+    name: str
+    label: str
+    status: str
+    #matching lines
+    count: int = 0
+    first: str = None
+    last: str = None
+    samples: list = field(default_factory=list)
+
+
+@dataclass
+class AppLogStats:
+    files: int = 0
+    #bytes scanned, after decompression
+    size: int = 0
+    #SignatureHits of the signatures found, in catalog order
+    hits: list = field(default_factory=list)
+
+
+def compile_signatures(signatures=SIGNATURES):
+    """The Matcher of the signatures; match.lastgroup of its pattern is 's' and the signature's index."""
+    anchors = tuple(OrderedDict.fromkeys(anchor for signature in signatures for anchor in signature.anchors))
+    return Matcher(anchors, re.compile(b'|'.join(b'(?P<s' + str(index).encode() + b'>' + signature.pattern + b')' for index, signature in enumerate(signatures))))
+
+
+def _record(hits, signature, line):
+    found = hits.get(signature.name)
+    if found is None:
+        found = hits[signature.name] = SignatureHits(signature.name, signature.label, signature.status)
+    found.count += 1
+    stamp = _TIME.match(line)
+    if stamp is not None:
+        when = stamp.group().decode('ascii').replace('T', ' ')
+        found.first = when if found.first is None else min(found.first, when)
+        found.last = when if found.last is None else max(found.last, when)
+    if len(found.samples) < SAMPLES:
+        found.samples.append(line.decode('utf-8', 'replace').strip()[:SAMPLE_LENGTH])
+
+
+def candidate_lines(buffer, anchors, end):
+    """{start: end} of the lines in buffer[:end] containing any of the anchors."""
+    lines = {}
+    for anchor in anchors:
+        pos = buffer.find(anchor, 0, end)
+        while pos >= 0:
+            lineStart = buffer.rfind(b'\n', 0, pos) + 1
+            lineEnd = buffer.find(b'\n', pos, end)
+            if lineEnd < 0:
+                lineEnd = end
+            lines[lineStart] = lineEnd
+            pos = buffer.find(anchor, lineEnd, end)
+    return lines
+
+
+def scan(buffer, matcher, hits, signatures=SIGNATURES, end=None):
+    """Add the signature hits of the lines in buffer[:end] (bytes or an mmap) to hits, {name: SignatureHits}."""
+    end = len(buffer) if end is None else end
+    for lineStart, lineEnd in sorted(candidate_lines(buffer, matcher.anchors, end).items()):
+        line = buffer[lineStart:lineEnd]
+        #one hit per line, so a stack trace line naming two signatures isn't counted twice
+        match = matcher.pattern.search(line)
+        if match is not None:
+            _record(hits, signatures[int(match.lastgroup[1:])], line)
+
+
+def scan_stream(stream, matcher, hits, signatures=SIGNATURES):
+    """scan() a binary stream in CHUNK_SIZE blocks, carrying each block's last partial line over; returns the bytes read."""
+    carry = b''
+    size = 0
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        block = carry + chunk
+        cut = block.rfind(b'\n') + 1
+        scan(block, matcher, hits, signatures, cut)
+        carry = block[cut:]
+    if carry:
+        scan(carry, matcher, hits, signatures)
+    return size
+
+
+def scan_file(path, matcher, hits, signatures=SIGNATURES):
+    """scan() a file on disk through a memory map; returns its size."""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        #empty files can't be mapped
+        if size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                scan(mapped, matcher, hits, signatures)
+    return size
+
+
+def analyse_source(source, signatures=SIGNATURES):
+    """Scan every application log in a support zip for the signatures; None if it has none."""
+    names = source.files(APP_LOGS)
+    if not names:
+        return None
+    matcher = compile_signatures(signatures)
+    hits = {}
+    stats = AppLogStats(files=len(names))
+    for name in names:
+        if name.endswith('.gz'):
+            with source.open(name) as raw, gzip.GzipFile(fileobj=raw) as stream:
+                stats.size += scan_stream(stream, matcher, hits, signatures)
+        elif isinstance(source, DirectorySource):
+            stats.size += scan_file(source.local_path(name), matcher, hits, signatures)
+        else:
+            with source.open(name) as stream:
+                stats.size += scan_stream(stream, matcher, hits, signatures)
+    stats.hits = [hits[signature.name] for signature in signatures if signature.name in hits]
+    return stats
+
+
+def merge(stats):
+    """[(SignatureHits summed over every node, nodes it was found on)] in catalog order, from each node's AppLogStats (or None)."""
+    merged = OrderedDict((signature.name, None) for signature in SIGNATURES)
+    nodes = {}
+    for nodeStats in stats:
+        for hit in (nodeStats.hits if nodeStats is not None else []):
+            total = merged.get(hit.name)
+            if total is None:
+                total = merged[hit.name] = SignatureHits(hit.name, hit.label, hit.status)
+            total.count += hit.count
+            total.first = min(filter(None, (total.first, hit.first)), default=None)
+            total.last = max(filter(None, (total.last, hit.last)), default=None)
+            nodes[hit.name] = nodes.get(hit.name, 0) + 1
+    return [(total, nodes[name]) for name, total in merged.items() if total is not None]
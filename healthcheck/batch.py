@@ -0,0 +1,236 @@
+"""Health checks for many support zip bundles at once.
+
+A bundle is a directory holding the support zips of one instance, i.e.
+what -d points at for a single run. Each bundle is analysed by its own
+health.py process, so one broken bundle can only fail its own run, and
+throughput grows with the number of workers. The workers are threads
+that only wait for those processes, fed from the executor's queue.
+
+Every report is written next to its bundle (see report_name()), and an index
+of all runs (status, start time, duration, report) is rewritten as each
+run finishes.
+
+In watch mode every subdirectory of a drop folder is a bundle. A bundle
+is analysed once its zips have stopped changing between two polls, so
+zips that are still being copied in are left alone, and again whenever
+its zips change.
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from healthcheck.defaults import DEFAULT_WATCH_INTERVAL
+from healthcheck.report import EXTENSIONS
+
+#the extension follows the report format, e.g. healthcheck-report.html for --format html
+REPORT_NAME = 'healthcheck-report'
+INDEX_NAME = 'healthcheck-index.txt'
+
+#status is 'ok', 'failed' or 'timeout'; error is the last line the run logged, if it failed
+BatchResult = namedtuple('BatchResult', 'bundle status started duration report error')
+
+
+def child_args(options):
+    """health.py options that apply to each bundle's run."""
+    args = ['--format', options.format]
+    if options.pluginpanel:
+        args.append('-p')
+    if options.extract:
+        args.append('-x')
+    if options.verbose:
+        args.append('-v')
+    if options.profile:
+        #without --profile-output the profile is saved in the bundle, next to its report
+        args.append('--profile')
+    if not options.cache:
+        args.append('--no-cache')
+    if options.cachedir:
+        args += ['--cache-dir', options.cachedir]
+    args += ['--cache-size', str(options.cachesize), '-j', str(options.jobs)]
+    #bundles share the plugin catalog, so each plugin is only fetched from Marketplace once
+    if options.offline:
+        args.append('--offline')
+    if options.pluginchecker:
+        args.append('--plugin-checker')
+    if options.plugincatalog:
+        args += ['--plugin-catalog', options.plugincatalog]
+    args += ['--catalog-ttl', str(options.catalogttl), '--marketplace-url', options.marketplaceurl]
+    if options.record:
+        args.append('--record')
+    if options.history:
+        args += ['--history', options.history]
+    if options.trend:
+        args.append('--trend')
+    if options.only:
+        args += ['--only', options.only]
+    if options.skip:
+        args += ['--skip', options.skip]
+    if options.checktimeout is not None:
+        args += ['--check-timeout', str(options.checktimeout)]
+    return args
+
+
+def report_name(format='jira'):
+    return REPORT_NAME + '.' + EXTENSIONS[format]
+
+
+def analyse_bundle(bundle, script, args=(), timeout=None, reportName=None):
+    """Run the health check on one bundle, writing its report next to it."""
+    started = time.time()
+    report = os.path.join(bundle, reportName or report_name())
+    error = None
+    try:
+        with open(report + '.tmp', 'w') as out:
+            done = subprocess.run([sys.executable, script, '-d', bundle] + list(args), stdout=out, stderr=subprocess.PIPE,
+                                  timeout=timeout, universal_newlines=True)
+        if done.returncode == 0:
+            os.replace(report + '.tmp', report)
+            status = 'ok'
+        else:
+            #a failed run keeps the bundle's last good report, if it has one
+            _remove(report + '.tmp')
+            status, report = 'failed', None
+            lines = [line for line in done.stderr.splitlines() if line.strip()]
+            #drop the logging level prefix, e.g. 'ERROR:\t'
+            error = lines[-1].split(':\t', 1)[-1] if lines else "exit code "+str(done.returncode)
+    except subprocess.TimeoutExpired:
+        _remove(report + '.tmp')
+        status, report, error = 'timeout', None, "no report after "+str(timeout)+"s"
+    except OSError as e:
+        status, report, error = 'failed', None, str(e)
+    return BatchResult(bundle, status, started, time.time() - started, report, error)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def write_index(path, results):
+    """Write a Jira table of every run so far, newest first."""
+    icons = {'ok': '(/)', 'failed': '(x)', 'timeout': '(!)'}
+    lines = ["||Bundle||Status||Started||Duration||Report||"]
+    for result in sorted(results, key=lambda result: -result.started):
+        status = icons.get(result.status, '(?)')+" "+result.status+(": "+result.error.replace('|', '\\|') if result.error else "")
+        lines.append("|"+result.bundle+"|"+status+"|"+datetime.datetime.fromtimestamp(result.started).strftime('%Y-%m-%d %H:%M:%S')
+                     +"|"+format(result.duration, '.1f')+" s|"+(result.report or "-")+"|")
+    with open(path + '.tmp', 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(path + '.tmp', path)
+
+
+class BatchRunner:
+    """A bounded pool of workers analysing bundles, keeping the index up to date as runs finish."""
+
+    def __init__(self, script, args=(), workers=None, indexPath=INDEX_NAME, timeout=None, reportName=None):
+        self.script = script
+        self.reportName = reportName or report_name()
+        self.args = list(args)
+        self.indexPath = indexPath
+        self.timeout = timeout
+        self.results = []
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+
+    def submit(self, bundle):
+        logging.info("Queued "+bundle)
+        future = self._pool.submit(analyse_bundle, bundle, self.script, self.args, self.timeout, self.reportName)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        result = future.result()
+        if result.status == 'ok':
+            logging.info("Finished "+result.bundle+" in "+format(result.duration, '.1f')+"s: "+result.report)
+        else:
+            logging.warning(result.status.capitalize()+" "+result.bundle+": "+str(result.error))
+        with self._lock:
+            self.results.append(result)
+            try:
+                write_index(self.indexPath, self.results)
+            except OSError as e:
+                logging.warning("Couldn't write the batch index "+self.indexPath+": "+str(e))
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+
+def bundle_fingerprint(bundle):
+    """(name, size, mtime) of every zip below a bundle, or None if it has none yet."""
+    found = []
+    for dirpath, dirnames, filenames in os.walk(bundle):
+        for name in filenames:
+            if name.lower().endswith('.zip'):
+                try:
+                    stat = os.stat(os.path.join(dirpath, name))
+                except OSError:
+                    continue
+                found.append((os.path.relpath(os.path.join(dirpath, name), bundle), stat.st_size, stat.st_mtime_ns))
+    return tuple(sorted(found)) or None
+
+
+def watch(folder, runner, interval=DEFAULT_WATCH_INTERVAL, polls=None):
+    """Analyse each bundle in the drop folder once it has settled, and again when its zips change. Runs until interrupted."""
+    analysed = {}
+    #fingerprints seen on the previous poll that haven't been analysed yet
+    settling = {}
+    count = 0
+    while polls is None or count < polls:
+        try:
+            entries = sorted(entry.path for entry in os.scandir(folder) if entry.is_dir() and not entry.name.startswith('.'))
+        except OSError as e:
+            logging.warning("Couldn't read the drop folder "+folder+": "+str(e))
+            entries = []
+        for bundle in entries:
+            fingerprint = bundle_fingerprint(bundle)
+            if fingerprint is None or analysed.get(bundle) == fingerprint:
+                continue
+            if settling.get(bundle) == fingerprint:
+                analysed[bundle] = settling.pop(bundle)
+                runner.submit(bundle)
+            else:
+                settling[bundle] = fingerprint
+        count += 1
+        if polls is None or count < polls:
+            time.sleep(interval)
+
+
+def main(options, args, script):
+    """The --batch and --watch modes of health.py. Returns an exit code."""
+    childArgs = child_args(options)
+    if options.watch:
+        folder = os.path.abspath(options.watch)
+        runner = BatchRunner(script, childArgs, options.batchjobs, options.batchindex or os.path.join(folder, INDEX_NAME), reportName=report_name(options.format))
+        logging.info("Watching "+folder+" for support zip bundles every "+str(options.interval)+"s (Ctrl+C to stop)")
+        try:
+            watch(folder, runner, options.interval)
+        except KeyboardInterrupt:
+            logging.info("Stopped watching, waiting for running health checks to finish")
+        runner.close()
+        return 0
+
+    if not args:
+        logging.error("--batch needs one or more bundle directories")
+        return -1
+    bundles = [os.path.abspath(arg) for arg in args]
+    missing = [bundle for bundle in bundles if not os.path.isdir(bundle)]
+    runner = BatchRunner(script, childArgs, options.batchjobs, options.batchindex or INDEX_NAME, reportName=report_name(options.format))
+    for bundle in missing:
+        logging.error("Not a directory: "+bundle)
+        runner.results.append(BatchResult(bundle, 'failed', time.time(), 0.0, None, "not a directory"))
+    for bundle in bundles:
+        if bundle not in missing:
+            runner.submit(bundle)
+    runner.close()
+    write_index(runner.indexPath, runner.results)
+    failed = [result.bundle for result in runner.results if result.status != 'ok']
+    logging.info(str(len(bundles) - len(failed))+" of "+str(len(bundles))+" bundle(s) analysed, index written to "+runner.indexPath)
+    return 1 if failed else 0
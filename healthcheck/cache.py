@@ -0,0 +1,155 @@
+"""On-disk cache of per-node analysis results.
+
+Entries are keyed by a fingerprint of the support zip they came from: its
+size, modification time and a SHA-256 of its contents. Rerunning the
+healthcheck on unchanged zips then only has to load a pickle per node.
+Hashing a 1 GB zip isn't free either, so the content hash is remembered
+against the zip's path, size and mtime and only recomputed when those
+change.
+
+Workers only ever read from the cache. The parent process writes the
+entries and the index, and evicts the least recently used entries once
+the cache grows past its size limit.
+"""
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import time
+
+from healthcheck.defaults import DEFAULT_CACHE_SIZE_MB
+from healthcheck.supportzip import APP_XML_FILES, PROPERTIES_FILES
+
+#bump whenever the shape of anything stored in the cache changes, so old entries are ignored
+CACHE_VERSION = 7
+DEFAULT_MAX_BYTES = DEFAULT_CACHE_SIZE_MB * 1024 * 1024
+INDEX_FILE = 'index.json'
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'bb_healthcheck')
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _atomic_write(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class AnalysisCache:
+
+    def __init__(self, path=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.index = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.path, INDEX_FILE)) as f:
+                index = json.load(f)
+            if index.get('version') == CACHE_VERSION:
+                return index
+        except (OSError, ValueError):
+            pass
+        return {'version': CACHE_VERSION, 'entries': {}, 'fingerprints': {}}
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key + '.pickle')
+
+    def _content_hash(self, path, stat):
+        known = self.index['fingerprints'].get(os.path.abspath(path))
+        if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+        return hash_file(path)
+
+    def fingerprint(self, source):
+        """Fingerprint a source. Returns (digest, memo) where memo should be passed to remember()."""
+        digest = hashlib.sha256()
+        digest.update(str(CACHE_VERSION).encode())
+        if os.path.isfile(source.path):
+            stat = os.stat(source.path)
+            contentHash = self._content_hash(source.path, stat)
+            digest.update(('%d:%d:%s' % (stat.st_size, stat.st_mtime_ns, contentHash)).encode())
+            memo = (os.path.abspath(source.path), [stat.st_size, stat.st_mtime_ns, contentHash])
+        else:
+            #an extracted support zip: every indexed file's size and mtime, plus the content of the files that get parsed
+            for category in sorted(source.index.files):
+                for name in source.files(category):
+                    stat = os.stat(source.local_path(name))
+                    digest.update(('%s:%d:%d;' % (name, stat.st_size, stat.st_mtime_ns)).encode())
+            for category in (APP_XML_FILES, PROPERTIES_FILES):
+                for name in source.files(category):
+                    digest.update(hash_file(source.local_path(name)).encode())
+            memo = None
+        return digest.hexdigest(), memo
+
+    def remember(self, memo):
+        if memo is not None:
+            self.index['fingerprints'][memo[0]] = memo[1]
+
+    def key(self, *parts):
+        return hashlib.sha256(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+    def load(self, key):
+        try:
+            with open(self._entry_path(key), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.debug("Ignoring unreadable cache entry "+key+": "+str(e))
+            return None
+
+    def touch(self, key):
+        entry = self.index['entries'].get(key)
+        if entry is not None:
+            entry['used'] = time.time()
+
+    def store(self, key, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        os.makedirs(self.path, exist_ok=True)
+        _atomic_write(self._entry_path(key), data)
+        self.index['entries'][key] = {'size': len(data), 'used': time.time()}
+
+    def save(self):
+        """Merge with whatever other runs wrote meanwhile, evict down to max_bytes and write the index."""
+        os.makedirs(self.path, exist_ok=True)
+        onDisk = self._load_index()
+        for key, entry in onDisk['entries'].items():
+            mine = self.index['entries'].get(key)
+            if mine is None or mine['used'] < entry['used']:
+                self.index['entries'][key] = entry
+        for path, memo in onDisk['fingerprints'].items():
+            self.index['fingerprints'].setdefault(path, memo)
+        #forget hashes of zips that have since been deleted
+        self.index['fingerprints'] = {path: memo for path, memo in self.index['fingerprints'].items() if os.path.exists(path)}
+
+        entries = self.index['entries']
+        total = sum(entry['size'] for entry in entries.values())
+        for key in sorted(entries, key=lambda key: entries[key]['used']):
+            if total <= self.max_bytes:
+                break
+            logging.debug("Evicting cache entry "+key)
+            total -= entries.pop(key)['size']
+            try:
+                os.remove(self._entry_path(key))
+            except FileNotFoundError:
+                pass
+        _atomic_write(os.path.join(self.path, INDEX_FILE), json.dumps(self.index).encode())
@@ -0,0 +1,588 @@
+"""The checks of the health check report, registered with healthcheck.rules.
+
+Each check reads the nodes (and whatever else it declares) from its
+CheckContext and returns the report rows of its section. Most settings
+are cluster wide, so they are taken from the first node; per-node values
+get a Panel for each node. The text of rows and panels is Jira markup,
+which the renderers in healthcheck.report translate for other formats.
+"""
+import dataclasses
+import logging
+import os
+import sqlite3
+import time
+
+from packaging import version
+
+from healthcheck import applog, drift, gclog, history, plugincatalog, profiler, threaddump
+from healthcheck.cache import default_cache_dir
+from healthcheck.jvmargs import parse_jvm_args, analyse_heap, analyse_gc, analyse_heap_usage, worst_status
+from healthcheck.properties import size_node
+from healthcheck.report import Row, Panel, Block, details_row, escape_jira
+from healthcheck.rules import rule
+from healthcheck.units import parse_size, format_size
+
+#Marketplace lookups of a large plugin list can take minutes when they aren't in the plugin catalog yet
+PLUGINS_TIMEOUT = 10 * 60
+
+
+def node_title(node):
+    return str(node.local_id)+" "+str(node.local_address)
+
+
+def findings_values(findings):
+    return [{'status': status, 'message': message} for status, message in findings]
+
+
+def stats_values(stats):
+    """A log analyser's results as plain data for the JSON report."""
+    return dataclasses.asdict(stats) if dataclasses.is_dataclass(stats) else None
+
+
+def format_access_stats(stats):
+    """Jira markup for one node's access log panel."""
+    if stats is None:
+        return "(?) No access logs in this support zip\n"
+    if stats.requests == 0:
+        return "(?) No completed requests in "+str(stats.files)+" access log(s)\n"
+    out = "* Requests: "+format(stats.requests, ',')+" from "+str(stats.files)+" log(s), "+stats.first+" to "+stats.last+"\n"
+    out += "* Requests per minute: "+format(stats.avg_rpm, ',.1f')+" average, "+format(stats.peak_rpm, ',')+" peak (at "+stats.peak_minute+")\n"
+    out += "* Request duration: p50 "+format(stats.p50, ',')+" ms, p95 "+format(stats.p95, ',')+" ms, p99 "+format(stats.p99, ',')+" ms\n"
+    out += "* SCM operations: "+format(stats.clones, ',')+" clones, "+format(stats.fetches, ',')+" fetches, "+format(stats.pushes, ',')+" pushes\n"
+    if stats.slow_endpoints:
+        out += "*Slowest endpoints (by p95):*\n"
+        for endpoint, count, p95, longest in stats.slow_endpoints:
+            out += "# {{"+escape_jira(endpoint)+"}} - "+format(count, ',')+" requests, p95 "+format(p95, ',')+" ms, max "+format(longest, ',')+" ms\n"
+    if stats.clone_repositories:
+        out += "*Most cloned/fetched repositories:*\n"
+        for repo, count, written in stats.clone_repositories:
+            out += "# "+escape_jira(repo)+" - "+format(count, ',')+" clones/fetches, "+format(written / (1024.0*1024*1024), ',.2f')+" GB sent\n"
+    return out
+
+
+def format_gc_stats(stats, findings):
+    """Jira markup for the GC log part of one node's Java Resources panel."""
+    if stats is None:
+        return "* GC logs: (?) none in this support zip\n"
+    if stats.pauses == 0:
+        return "* GC logs: (?) no pauses found in "+str(stats.files)+" log(s)\n"
+    out = "* GC pauses: "+format(stats.pauses, ',')+" from "+str(stats.files)+" log(s), "+format(stats.full_gcs, ',')+" full GC(s)"
+    if stats.overhead is not None:
+        out += ", "+format(stats.overhead, '.2f')+"% of the time paused"
+    out += "\n* Pause time: p50 "+format(stats.p50, ',.1f')+" ms, p95 "+format(stats.p95, ',.1f')+" ms, p99 "+format(stats.p99, ',.1f')+" ms, max "+format(stats.max_pause, ',.1f')+" ms\n"
+    if stats.allocation_rate is not None:
+        out += "* Allocation rate: "+format_size(stats.allocation_rate)+"/s\n"
+    if stats.live_set:
+        out += "* Live set after GC: "+" → ".join(format_size(size) for size in stats.live_set)+"\n"
+    for status, message in findings:
+        out += "* "+status+" "+message+"\n"
+    return out
+
+
+def format_profiler_stats(stats):
+    """Jira markup for one node's profiler log panel."""
+    if stats is None:
+        return "(?) No profiler logs in this support zip. Profiling is enabled in Administration > Logging and Profiling.\n"
+    if stats.requests == 0:
+        return "(?) No profiled requests in "+str(stats.files)+" profiler log(s)\n"
+    out = "* Profiled requests: "+format(stats.requests, ',')+" from "+str(stats.files)+" log(s)\n"
+    out += "*Slowest request types (by total time):*\n"
+    for name, count, total, p99, longest in stats.slow_requests:
+        out += "# {{"+escape_jira(name)+"}} - "+format(count, ',')+" requests, "+format(total / 1000, ',.1f')+" s total, p99 "+format(p99, ',.0f')+" ms, max "+format(longest, ',.0f')+" ms\n"
+    if stats.operations:
+        out += "*Most expensive operations (by total time):*\n"
+        for name, count, total, p99 in stats.operations:
+            out += "# {{"+escape_jira(name)+"}} - "+format(count, ',')+" calls, "+format(total / 1000, ',.1f')+" s total, p99 "+format(p99, ',.0f')+" ms\n"
+    return out
+
+
+def format_app_log_stats(stats):
+    """Jira markup for one node's error signature panel: a table of the signatures found, then sample lines."""
+    if stats is None:
+        return "(?) No application logs in this support zip\n"
+    scanned = "* Scanned: "+str(stats.files)+" log(s), "+format_size(stats.size)+"\n"
+    if not stats.hits:
+        return scanned+"* (/) No known error signatures\n"
+    out = scanned+"||Signature||Lines||First||Last||\n"
+    for hit in stats.hits:
+        out += "|"+hit.status+" "+hit.label+"|"+format(hit.count, ',')+"|"+(hit.first or "-")+"|"+(hit.last or "-")+"|\n"
+    out += "*Sample lines:*\n"
+    for hit in stats.hits:
+        out += "".join("* "+hit.label+": {{"+escape_jira(sample)+"}}\n" for sample in hit.samples)
+    return out
+
+
+def format_plugin_costs(costs):
+    """Jira table of the time spent in each user installed plugin, to be read alongside the plugin table."""
+    out = "||Plugin||Key||Version||Calls||Total time||p99||\n"
+    for key, name, pluginVersion, count, total, p99 in costs:
+        out += "|"+str(name)+"|"+key+"|"+str(pluginVersion)+"|"+format(count, ',')+"|"+format(total / 1000, ',.1f')+" s|"+format(p99, ',.0f')+" ms|\n"
+    return out
+
+
+def format_plugin_checks(checks, tableFormat):
+    """Jira markup for the plugin catalog results, a table or (for -p) a list."""
+    out = "||Plugin||Vendor||Version||Nodes||Supported Bitbucket||Status||\n" if tableFormat else ""
+    for plugin in checks:
+        supported = (plugin.supported[0] or "?")+" - "+(plugin.supported[1] or "?") if plugin.supported else "?"
+        if tableFormat:
+            out += ("|"+escape_jira(plugin.name)+"|"+escape_jira(plugin.vendor or "-")+"|"+escape_jira(plugin.version)+"|"+", ".join(plugin.nodes)
+                    +"|"+supported+"|"+plugin.status+" "+escape_jira(plugin.message)+"|\n")
+        else:
+            out += ("* "+plugin.status+" *"+escape_jira(plugin.name)+"* "+escape_jira(plugin.version)+" ("+escape_jira(plugin.vendor or "-")+", "+", ".join(plugin.nodes)
+                    +", supports Bitbucket "+supported+"): "+escape_jira(plugin.message)+"\n")
+    return out
+
+
+def format_trends(trends):
+    """Jira markup for one node's capacity trends, one line per metric."""
+    out = ""
+    for trend in trends:
+        show = (lambda value: format_size(value)) if trend.metric in history.SIZE_METRICS else (lambda value: format(value, ',.0f'))
+        out += "* "+trend.status+" *"+trend.label+"*: "+show(trend.last)
+        if trend.samples < 2 or trend.change is None:
+            out += " (only one support zip so far)\n"
+            continue
+        out += ", from "+show(trend.first)+" over "+str(trend.samples)+" support zips, "+("+" if trend.change >= 0 else "-")+show(abs(trend.change))+" a day"
+        if trend.reaches is not None:
+            out += ", reaches "+show(trend.limit)+" around "+time.strftime('%Y-%m-%d', time.localtime(trend.reaches))
+        elif trend.limit is not None:
+            out += ", not growing towards "+show(trend.limit)
+        out += "\n"
+    return out
+
+
+def format_drift(differences, labels):
+    """Jira markup listing each setting that differs between nodes, with the nodes that have each value."""
+    out = ""
+    for field, values in differences:
+        out += "* *"+escape_jira(field)+"*\n"
+        for value, nodeLabels in drift.group_values(values, labels):
+            if value is None:
+                shown = "_(not set)_"
+            elif drift.is_secret(field):
+                shown = "_(hidden)_"
+            elif field in ('JVM -Xms', 'JVM -Xmx'):
+                shown = format_size(value)
+            else:
+                shown = "{{"+escape_jira(str(value))+"}}"
+            out += "** "+shown+" - "+", ".join(nodeLabels)+"\n"
+    return out
+
+
+def format_hotspots(hotspots, cluster=False):
+    """Jira markup for a ranked list of thread dump hotspots."""
+    out = ""
+    for spot in hotspots:
+        out += "# *"+spot.category+"* ("+spot.state+") - "+format(spot.samples, ',')+" threads in "+format(spot.dumps, ',')+" dump(s)"
+        if cluster:
+            out += " on "+str(spot.nodes)+" node(s)"
+        if spot.stuck:
+            out += ", "+format(spot.stuck, ',')+" stuck across consecutive dumps"
+        out += "\n" + "".join("** {{"+escape_jira(frame)+"}}\n" for frame in spot.frames)
+    return out
+
+
+def format_thread_stats(stats, top):
+    """Jira markup for one node's thread dump panel."""
+    if stats is None:
+        return "(?) No thread dumps in this support zip\n"
+    if stats.threads == 0:
+        return "(?) No threads found in "+str(stats.files)+" thread dump file(s)\n"
+    out = "* Dumps: "+format(stats.dumps, ',')+" from "+str(stats.files)+" file(s), "+format(stats.threads, ',')+" thread samples\n"
+    out += "* States: "+", ".join(state+" "+format(count, ',') for state, count in stats.states.items())+"\n"
+    if stats.hotspots:
+        out += "*Hotspots (busy threads, idle pool threads excluded):*\n"
+        out += format_hotspots(stats.hotspots[:top])
+    return out
+
+
+
+@rule('product', "Product")
+def check_product(context):
+    mynode = context.nodes[0]
+    rows = []
+    #get product and version
+    prodName=mynode.product_name
+    #print just product name
+    rows.append(Row(prodName, " ", values={'product': prodName}))
+    #check version against recommend 6.10 or below
+    testVer=mynode.product_version
+    if version.parse(testVer) >= version.parse("6.10.0"):
+        #print version and value
+        rows.append(Row("Product Version", "*"+testVer+"* Version is Good", "(/)", values={'version': testVer}))
+    else:
+        rows.append(Row("Product Version", "*"+testVer+"* While your version is supported. \n You should think about upgrading. \n We recommend our [Long Term Support (LTS) Release|https://confluence.atlassian.com/enterprise/atlassian-enterprise-releases-948227420.html].", "(!)", values={'version': testVer}))
+
+    #Check if clustered and get nodes
+    if mynode.clustered:
+        rows.append(Row("Clustered DC Instance", "".join("*Node:* "+str(nodeId)+"\n*IP:* "+str(nodeAddress)+"\n" for nodeId, nodeAddress in mynode.cluster_nodes),
+                        sublabels=[str(len(mynode.cluster_nodes))+" Nodes"], values={'nodes': [{'id': nodeId, 'address': nodeAddress} for nodeId, nodeAddress in mynode.cluster_nodes]}))
+    else:
+        rows.append(Row("Standalone Server", " ", values={'nodes': []}))
+
+    #Get base url / should check if proxy good
+    rows.append(Row("Base URL", str(mynode.base_url), values={'base_url': mynode.base_url}))
+    return rows
+
+
+@rule('properties', "bitbucket.properties", needs=('application.xml', 'properties'))
+def check_properties(context):
+    #get bb.props/ Should make a switch to turn on or off
+    pp_list=[node for node in context.nodes if node.properties is not None]
+    if not pp_list:
+        return Row("bitbucket.properties", "No bitbucket.properties file", values={'properties': None})
+    return Row("bitbucket.properties", "{code}"+pp_list[0].properties+"{code}", values={'properties': pp_list[0].properties})
+
+
+@rule('drift', "Configuration Drift", needs=('application.xml', 'properties'))
+def check_drift(context):
+    #Everything else mostly describes the first node, so list where the other nodes differ from it
+    nodes = context.nodes
+    if len(nodes) < 2:
+        return None
+    differences = drift.find_drift(nodes)
+    labels = [node.local_id or node.label for node in nodes]
+    if differences:
+        return Row("Configuration Drift", str(len(differences))+" setting(s) differ between the "+str(len(nodes))+" nodes:\n"+format_drift(differences, labels), "(!)",
+                   values={'differences': {field: dict(zip(labels, ['(hidden)' if drift.is_secret(field) and value is not None else value for value in values]))
+                                           for field, values in differences}})
+    return Row("Configuration Drift", "All "+str(len(nodes))+" nodes have the same configuration", "(/)", values={'differences': {}})
+
+
+@rule('operating-system', "Operating System")
+def check_operating_system(context):
+    #OS information
+    osEvn=context.nodes[0].os
+    return details_row("Operating System", [('OS', osEvn['os-name']), ('Version', osEvn['os-version']), ('Processors', osEvn['available-processors']),
+                                            ('Memory', osEvn['total-physical-memory']), ('Swap', osEvn['total-swap-space']), ('Ulimit', osEvn['max-file-descriptor'])])
+
+
+@rule('hosting-tickets', "Hosting Tickets & Throttling", needs=('application.xml', 'properties'))
+def check_hosting_tickets(context):
+    #Hosting tickets, executor and DB pool sizing, from each node's own bitbucket.properties
+    row = Row("Hosting Tickets & Throttling")
+    for node in context.nodes:
+        sizing = size_node(node)
+        row.panels.append(Panel(node_title(node), "".join('* '+label+': '+value+'\n' for label, value in sizing.summary)
+                                + "".join(status+' '+message+'\n' for status, message in sizing.findings),
+                                sizing.status, values={'node': node.label, 'settings': dict(sizing.summary), 'findings': findings_values(sizing.findings)}))
+    return row
+
+
+@rule('system-resources', "System Resources")
+def check_system_resources(context):
+    row = Row("System Resources")
+    for node in context.nodes:
+        resources = [('From Support Zip', node.label), ('Load Average', node.os['system-load-average']), ('CPU Load', node.os['system-cpu-load']),
+                     ('System Memory Free', node.os['free-physical-memory']), ('Swap Memory Free', node.os['free-swap-space']), ('Open Files', node.os['open-file-descriptor'])]
+        row.panels.append(Panel(node_title(node), "".join('* '+label+': '+str(value)+'\n' for label, value in resources), style='green', values=dict(resources)))
+    return row
+
+
+@rule('access-logs', "Access Log Throughput", needs=('application.xml', 'access-logs'))
+def check_access_logs(context):
+    #Access logs - real load on each node: request rate, latency and SCM traffic
+    row = Row("Access Log Throughput")
+    if all(node.access is None for node in context.nodes):
+        row.status, row.text = "(?)", "No access logs (atlassian-bitbucket-access.log) found in the support zip(s)"
+    else:
+        for node in context.nodes:
+            row.panels.append(Panel(node_title(node), format_access_stats(node.access), style='green', values=stats_values(node.access)))
+    return row
+
+
+@rule('profiler-logs', "Profiler Logs", needs=('application.xml', 'profiler-logs'))
+def check_profiler_logs(context):
+    #Profiler logs - where the time of slow requests goes, down to SCM commands, queries and plugins
+    row = Row("Profiler Logs")
+    if all(node.profiler is None for node in context.nodes):
+        row.status, row.text = "(?)", "No profiler logs (atlassian-bitbucket-profiler.log) found in the support zip(s)"
+    else:
+        for node in context.nodes:
+            row.panels.append(Panel(node_title(node), format_profiler_stats(node.profiler), style='green', values=stats_values(node.profiler)))
+    return row
+
+
+@rule('error-signatures', "Known Errors (application logs)", needs=('application.xml', 'app-logs'))
+def check_error_signatures(context):
+    #Application logs - lines matching known problems, e.g. OutOfMemoryError or an exhausted DB pool
+    nodes = context.nodes
+    row = Row("Known Errors (application logs)")
+    if all(node.app_log is None for node in nodes):
+        row.status, row.text = "(?)", "No application logs (atlassian-bitbucket.log) found in the support zip(s)"
+        return row
+    merged = applog.merge(node.app_log for node in nodes)
+    row.status = worst_status([(hit.status, None) for hit, onNodes in merged]) if merged else "(/)"
+    if merged:
+        row.text = (str(len(merged))+" known error signature(s) in the application logs:\n"
+                    + "".join("* "+hit.status+" *"+hit.label+"*: "+format(hit.count, ',')+" line(s) on "+str(onNodes)+" node(s)\n" for hit, onNodes in merged))
+    else:
+        row.text = "No known error signatures in the application logs"
+    row.values = {'signatures': [dict(stats_values(hit), nodes=onNodes) for hit, onNodes in merged]}
+    for node in nodes:
+        status = worst_status([(hit.status, None) for hit in node.app_log.hits]) if node.app_log is not None else None
+        row.panels.append(Panel(node_title(node), format_app_log_stats(node.app_log), status, values=stats_values(node.app_log)))
+    return row
+
+
+@rule('database', "Database")
+def check_database(context):
+    # note: "database-info" element structure may be different between versions. additional checks if value is "None" needed
+    dbInfo=context.nodes[0].database
+    if dbInfo is None:
+        return None
+    return details_row("Database", [(dbLabel, dbInfo[dbKey]) for dbKey, dbLabel in (('database-name', 'Name'), ('version', 'Version'), ('support-level', 'Support Level'),
+                                    ('connection-url', 'Connection URL'), ('driver-name', 'Driver Name'), ('driver-version', 'Driver Version'))
+                                    if dbInfo[dbKey] is not None])
+
+
+@rule('git', "GIT Version")
+def check_git(context):
+    git=context.nodes[0].git_version
+    if git is None:
+        return Row("GIT Version", "No git version in application.xml", "(?)", values={'version': None})
+    if version.parse(git) >= version.parse("2.20"):
+        return Row("GIT Version", "Your Git version is good: *"+git+"*", "(/)", values={'version': git})
+    elif version.parse("2.20") >= version.parse(git) >= version.parse("2.11"):
+        return Row("GIT Version", "*While you meet the minimum requirements:* "+git+"\n* We recommend an upgrade to a later version 2.20+\n"+git+"\nPlease see our [Supported Platforms|https://confluence.atlassian.com/bitbucketserver076/supported-platforms-1026535721.html]\nAll Recommendations are based on the latest Bitbucket LTS Release.", "(!)", values={'version': git})
+    return Row("GIT Version", "*Unsupported Version:* "+git+" (x)\n* We recommend an upgrade to a later version 2.20+\nPlease see our [Supported Platforms|https://confluence.atlassian.com/bitbucketserver076/supported-platforms-1026535721.html]\nAll Recommendations are based on the latest Bitbucket LTS Release.", "(x)", values={'version': git})
+
+
+@rule('scm-cache', "SCM cache")
+def check_scm_cache(context):
+    mynode = context.nodes[0]
+    testVer = mynode.product_version
+    rows = []
+    if mynode.scm_cache is None:
+        return Row("SCM cache", "No scm-cache section in application.xml", "(?)", values={'enabled': None})
+    scmRecommendation = "\n*Recommendation:* If possible we recommend enabling SCM for better performance.\nThere are some configurations in which it should be disabled.\nFor more information please refer to:\n[Scaling Bitbucket for CI performance|https://confluence.atlassian.com/bitbucketserver/scaling-bitbucket-server-for-continuous-integration-performance-776640088.html]"
+    if mynode.scm_cache['http-enabled'] == 'true':
+        rows.append(Row("HTTP cache", "SCM cache for HTTP is *Enabled*", "(/)", values={'enabled': True}))
+    else:
+        rows.append(Row("HTTP cache", "SCM cache for HTTP is *Disabled*"+scmRecommendation, "(!)", values={'enabled': False}))
+
+    if mynode.scm_cache['ssh-enabled'] == 'true':
+        rows.append(Row("SSH cache", "SCM cache for SSH is *Enabled*", "(/)", values={'enabled': True}))
+    else:
+        rows.append(Row("SSH cache", "SCM cache for SSH is *Disabled*"+scmRecommendation, "(!)", values={'enabled': False}))
+
+    #Only check ref advertisement cache if version is lower than 7.3
+    if version.parse(testVer) < version.parse("7.3.0"):
+        if mynode.scm_cache['refs-advertisement'] == 'true':
+            rows.append(Row("Ref advertisement cache", "SCM cache for ref advertisement is *Enabled*", "(/)", values={'enabled': True}))
+        else:
+            rows.append(Row("Ref advertisement cache", "SCM cache for *ref advertisement* is *Disabled*"+scmRecommendation
+                            +"\n(!) *Please note:* Ref advertisement cache is no longer applicable to Bitbucket versions 7.4 and later.", "(!)", values={'enabled': False}))
+    else:
+        rows.append(Row("Ref advertisement cache", "SCM cache for ref advertisement is [no longer used|https://confluence.atlassian.com/bitbucketserver/scaling-bitbucket-server-776640073.html#ScalingBitbucketServer-Caching] in Bitbucket version "+testVer+".", "(/)", values={'enabled': None}))
+    return rows
+
+
+@rule('java', "Java Version")
+def check_java(context):
+    mynode = context.nodes[0]
+    rows = []
+    jv=mynode.jvm['java.runtime.version']
+    # Marek: Automatic assessment of Java version + printing the outcome with recommendation (where applicable)
+    # Possible outcomes and final message of the assessment to be printed out
+    bad_java_version  = Row("Java Version", "Your Java version *"+jv+"* is not supported!\nPlease refer to [Supported Platforms|https://confluence.atlassian.com/bitbucketserver076/supported-platforms-1026535721.html#Supportedplatforms-javaJava] for more information.", "(x)")
+    warn_java_version = Row("Java Version", "*"+jv+"*\nJava versions 11.0.0 - 11.0.7 are not recommended due to Java bug: [JDK-8241054|https://bugs.openjdk.java.net/browse/JDK-8241054].\nWe recommended Java version 11.0.8 (or later).", "(!)")
+    OK_java_version   = Row("Java Version", "Your Java version *"+jv+"* is good.\n* *Please note:* _Bitbucket Server 8.0 will raise the minimum supported Java version to 11.0.8._", "(/)")
+    good_java_version = Row("Java Version", "Your Java version *"+jv+"* is good.", "(/)")
+    # Assessment
+    if (version.parse(jv) <= version.parse("1.8") and jv.find('_')<0):
+        javaRow = bad_java_version
+    else:
+        if version.parse(jv) < version.parse("1.8.0_65"):
+            javaRow = bad_java_version
+        else:
+            if version.parse(jv) < version.parse("1.8.0_9999"):
+                javaRow = OK_java_version
+            else:
+                if version.parse(jv) < version.parse("11"):
+                    javaRow = bad_java_version
+                else:
+                    if version.parse(jv) < version.parse("11.0.8"):
+                        javaRow = warn_java_version
+                    else:
+                        if version.parse(jv) < version.parse("12"):
+                            javaRow = good_java_version
+                        else:
+                            javaRow = bad_java_version
+    javaRow.values = {'version': jv}
+    rows.append(javaRow)
+    #get jvm args
+    javaParams=mynode.jvm['virtual-machine-arguments']
+    #list jvm args/ add newlines by replacing a space with a newline
+    jp=javaParams.replace(' ', '\n')
+    j1=jp.replace('|','\|')
+    j=j1.replace('*','\*')
+    rows.append(Row("JVM arguments", j, values={'arguments': javaParams.split()}))
+
+    #Put java params in a list
+    jplist=j.splitlines()
+
+    #Heap and GC settings, compared in bytes so that e.g. -Xms2048m and -Xmx2g count as the same
+    jvmArgs = parse_jvm_args(javaParams)
+    heap = [elem for elem in jplist if elem.startswith("-Xms") or elem.startswith("-Xmx")]
+    heapFindings = analyse_heap(jvmArgs, parse_size(mynode.os.get('total-physical-memory')))
+    rows.append(Row("Java HEAP", "*Heap Settings*: "+', '.join(heap)+"\n"+"".join("* "+status+" "+message+"\n" for status, message in heapFindings), worst_status(heapFindings),
+                    values={'xms': jvmArgs.heap_min, 'xmx': jvmArgs.heap_max, 'findings': findings_values(heapFindings)}))
+
+    gcFindings = analyse_gc(jvmArgs, jv)
+    rows.append(Row("Garbage Collection", "*GC Settings*\n"+"".join("* "+status+" "+message+"\n" for status, message in gcFindings), worst_status(gcFindings),
+                    values={'collector': jvmArgs.collector, 'findings': findings_values(gcFindings)}))
+    return rows
+
+
+@rule('java-resources', "Java Resources", needs=('application.xml', 'gc-logs'))
+def check_java_resources(context):
+    #looping thought support zips to get heap usage
+    row = Row("Java Resources")
+    for node in context.nodes:
+        usage = analyse_heap_usage(node.jvm['percent-heap-used'])
+        #GC logs show how the heap behaves over time, rather than at the moment the support zip was made
+        gcFindings = gclog.assess(node.gc, parse_jvm_args(node.jvm.get('virtual-machine-arguments')).heap_max) if node.gc is not None else []
+        row.panels.append(Panel(node_title(node), '* From Support Zip: '+node.label+'\n* Heap Percentage Used: '+str(node.jvm['percent-heap-used'])
+                                +'\n* Heap Space Free: '+str(node.jvm['heap-available'])+'\n* Max Heap/Size: '+str(node.jvm['heap-used'])+'\n'+format_gc_stats(node.gc, gcFindings),
+                                worst_status([usage] + gcFindings), values={'node': node.label, 'percent-heap-used': node.jvm['percent-heap-used'],
+                                'heap-available': node.jvm['heap-available'], 'heap-used': node.jvm['heap-used'], 'gc': stats_values(node.gc),
+                                'findings': findings_values([usage] + gcFindings)}))
+    return row
+
+
+@rule('thread-dumps', "Thread Dump Hotspots", needs=('application.xml', 'thread-dumps'))
+def check_thread_dumps(context):
+    #Thread dumps - where busy threads spend their time on each node, and across the cluster
+    nodes = context.nodes
+    row = Row("Thread Dump Hotspots")
+    if all(node.threads is None for node in nodes):
+        row.status, row.text = "(?)", "No thread dumps found in the support zip(s)"
+    else:
+        for node in nodes:
+            row.panels.append(Panel(node_title(node), format_thread_stats(node.threads, threaddump.TOP_HOTSPOTS), values=stats_values(node.threads)))
+        clusterHotspots = threaddump.merge(node.threads for node in nodes)
+        if len(nodes) > 1 and clusterHotspots:
+            row.panels.append(Panel("Cluster wide", format_hotspots(clusterHotspots, cluster=True), values={'hotspots': [stats_values(spot) for spot in clusterHotspots]}))
+    return row
+
+
+@rule('home', "Filesystem -\nHome directory")
+def check_home(context):
+    row = Row("Filesystem -\nHome directory")
+    for node in context.nodes:
+        fsHome = node.home
+        if fsHome is None:
+            row.panels.append(Panel(node_title(node), "No filesystem/home section in application.xml", "(?)", style='purple'))
+            continue
+        dirFreeSizeStr = fsHome['free-size'] + ' out of ' + fsHome['total-size']
+        row.panels.append(Panel(node_title(node), '* Name: '+fsHome['name']+'\n* Path: '+fsHome['path']+'\n* Type: '+fsHome['type']+'\n* Free space: '+dirFreeSizeStr,
+                                style='purple', values=dict(fsHome)))
+    return row
+
+
+@rule('shared-home', "Filesystem -\nShared Home directory")
+def check_shared_home(context):
+    #only need one
+    fsSharedHome = context.nodes[0].shared_home
+    if fsSharedHome is None:
+        return Row("Filesystem -\nShared Home directory", "No filesystem/shared-home section in application.xml", "(?)")
+    dirFreeSizeStr = fsSharedHome['free-size'] + ' out of ' + fsSharedHome['total-size']
+    return Row("Filesystem -\nShared Home directory", panels=[Panel("Shared Home", '* Name: '+fsSharedHome['name']+'\n* Path: '+fsSharedHome['path']
+                                                                    +'\n* Type: '+fsSharedHome['type']+'\n* Free space: '+dirFreeSizeStr, style='purple', values=dict(fsSharedHome))])
+
+
+@rule('capacity-trend', "Capacity Trend", needs=('application.xml', 'history'), default=False)
+def check_capacity_trend(context):
+    #the history has every node seen for this instance, including nodes without a support zip this time
+    trends = history.trend(context.series)
+    row = Row("Capacity Trend")
+    if not trends:
+        row.status, row.text = "(?)", "No metrics recorded for this instance yet; runs with --record add them"
+    for nodeName in context.series:
+        nodeTrends = [trend for trend in trends if trend.node == nodeName]
+        if nodeTrends:
+            row.panels.append(Panel(nodeName, format_trends(nodeTrends), worst_status([(trend.status, None) for trend in nodeTrends]),
+                                    values={'trends': [trend._asdict() for trend in nodeTrends]}))
+    return row
+
+
+@rule('elasticsearch', "Elasticsearch")
+def check_elasticsearch(context):
+    es=context.nodes[0].elasticsearch
+    if es is None:
+        return Row("Elasticsearch", "No Elasticsearch section in application.xml", "(?)")
+    return details_row("Elasticsearch", [('URL', es['base-url']), ('Status', es['connection-result'])])
+
+
+@rule('counts', "Project and Repository Count")
+def check_counts(context):
+    mynode = context.nodes[0]
+    rows = []
+    if mynode.product_version[0] == 7:
+
+        getprojects = mynode.projects_count
+        if getprojects is not None:
+            rows.append(Row("Project Count", "* "+getprojects, values={'count': getprojects}))
+
+        getrepos = mynode.repositories_count
+        if getrepos is not None:
+            rows.append(Row("Repository Count", "* "+getrepos, values={'count': getrepos}))
+    return rows
+
+
+#plugin_checker redirects stdout while it runs, so this check runs on its own whichever way plugins are checked
+@rule('plugins', "User-Installed Plugins", needs=('application.xml', 'marketplace', 'plugin-checker'), timeout=PLUGINS_TIMEOUT)
+def check_user_plugins(context):
+    options = context.options
+    nodes = context.nodes
+    if options.pluginchecker:
+        #Call to plugin_checker.py
+        #Method sig:
+        #   main(String pathToAppXml, Boolean jiraMarkdown, Boolean verbose, Boolean tableFormat)
+
+        #plugin_checker wants a path on disk, so only application.xml is pulled out of the zip for it
+        if options.pluginpanel:
+                pluginOutput, plugin_check_success = context.plugin_checker(context.sources[0], False, context.cache, context.node_keys[0])
+                return Block("\n"+pluginOutput)
+        else:
+                pluginOutput, plugin_check_success = context.plugin_checker(context.sources[0], True, context.cache, context.node_keys[0])
+                return Row("User-Installed Plugins", "{panel}"+pluginOutput+"{panel}")
+
+    #user installed plugins of every node, looked up in the local catalog and (unless --offline) Marketplace
+    catalogPath = options.plugincatalog or os.path.join(options.cachedir or default_cache_dir(), plugincatalog.CATALOG_FILE)
+    try:
+        catalog = plugincatalog.PluginCatalog(catalogPath, options.marketplaceurl, options.catalogttl*60*60, options.offline)
+    except sqlite3.Error as e:
+        #without a usable catalog file the lookups still work, they just aren't kept
+        logging.warning("Couldn't open the plugin catalog "+catalogPath+", it won't be updated: "+str(e))
+        catalog = plugincatalog.PluginCatalog(':memory:', options.marketplaceurl, options.catalogttl*60*60, options.offline)
+    try:
+        pluginChecks = plugincatalog.check(nodes, nodes[0].product_version, catalog)
+    finally:
+        catalog.close()
+    pluginStatus = worst_status([(check.status, None) for check in pluginChecks]) if pluginChecks else '(/)'
+    if catalog.failures and options.offline:
+        note = "(?) "+str(catalog.failures)+" lookup(s) aren't in the plugin catalog; rerun without --offline to fetch them\n"
+    elif catalog.failures:
+        note = "(?) "+str(catalog.failures)+" lookup(s) couldn't be answered by "+options.marketplaceurl+" or the plugin catalog\n"
+    else:
+        note = ""
+    summary = pluginStatus+" "+str(len(pluginChecks))+" user installed plugin version(s) on "+str(len(nodes))+(" of "+str(plugincatalog.cluster_size(nodes)) if plugincatalog.cluster_size(nodes) > len(nodes) else "")+" node(s)\n"+note
+    pluginValues = {'plugins': [check._asdict() for check in pluginChecks], 'unanswered': catalog.failures}
+    if options.pluginpanel:
+        return Block(panels=[Panel("User-Installed Plugins", summary+format_plugin_checks(pluginChecks, False), pluginStatus, values=pluginValues)])
+    return Row("User-Installed Plugins", "{panel}"+summary+format_plugin_checks(pluginChecks, True)+"{panel}", values=pluginValues)
+
+
+@rule('plugin-time', "Plugin Time (profiler logs)", needs=('application.xml', 'profiler-logs'))
+def check_plugin_time(context):
+    #Time the profiler logs attribute to each user installed plugin, on all nodes
+    pluginCosts = profiler.merge_plugins(node.profiler for node in context.nodes)
+    if not pluginCosts:
+        return None
+    costValues = {'plugins': [dict(zip(('key', 'name', 'version', 'calls', 'total_ms', 'p99_ms'), cost)) for cost in pluginCosts]}
+    if context.options.pluginpanel:
+        return Block(panels=[Panel("Plugin time in profiler logs", format_plugin_costs(pluginCosts), values=costValues)])
+    return Row("Plugin Time (profiler logs)", "{panel}"+format_plugin_costs(pluginCosts)+"{panel}", values=costValues)
@@ -0,0 +1,16 @@
+"""Defaults shared by health.py's options and the modules behind them.
+
+health.py parses its options before importing anything else from
+healthcheck, so that --help and small runs start quickly; this module
+imports nothing, so the option defaults can come from here and the
+modules using them at run time read the same values.
+"""
+
+#size limit of the analysis cache (healthcheck.cache)
+DEFAULT_CACHE_SIZE_MB = 256
+#seconds between polls of the drop folder in watch mode (healthcheck.batch)
+DEFAULT_WATCH_INTERVAL = 30
+#where plugins are looked up (healthcheck.plugincatalog)
+DEFAULT_MARKETPLACE_URL = 'https://marketplace.atlassian.com'
+#what healthcheck.report can render
+REPORT_FORMATS = ('jira', 'markdown', 'json', 'html')
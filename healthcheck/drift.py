@@ -0,0 +1,98 @@
+"""Configuration differences between the nodes of a cluster.
+
+Most of the report describes the first support zip only, so a node with a
+smaller heap, an older git or a different bitbucket.properties would go
+unnoticed. node_settings() flattens everything comparable about a node
+into {field: value}; find_drift() then compares those across all nodes
+and keeps the fields whose values differ. Each node is flattened once and
+each field compared once, so the cost grows linearly with the number of
+nodes.
+"""
+from collections import OrderedDict
+
+from healthcheck.jvmargs import parse_jvm_args
+from healthcheck.properties import parse_properties
+
+#values that change from minute to minute, or are about the node rather than its configuration
+OS_VOLATILE = ('free-physical-memory', 'free-swap-space', 'system-load-average', 'system-cpu-load', 'process-cpu-load',
+               'open-file-descriptor', 'committed-virtual-memory', 'uptime')
+JVM_VOLATILE = ('percent-heap-used', 'heap-used', 'heap-available', 'uptime', 'start-time', 'virtual-machine-arguments')
+FILESYSTEM_VOLATILE = ('free-size',)
+#bitbucket.properties keys that are expected to be different on every node
+NODE_SPECIFIC_PROPERTIES = ('hazelcast.local.public.address', 'hazelcast.local.public.port', 'server.address')
+#bitbucket.properties keys whose values shouldn't be printed
+SECRETS = ('password', 'secret', 'token')
+
+
+def _section(settings, prefix, values, volatile=()):
+    for key, value in (values or {}).items():
+        if key not in volatile:
+            settings[prefix + key] = value
+
+
+def node_settings(node):
+    """Every comparable setting of one node as {field: value}."""
+    settings = OrderedDict()
+    settings['Product version'] = node.product_version
+    settings['Base URL'] = node.base_url
+    settings['Git version'] = node.git_version
+    _section(settings, 'OS ', node.os, OS_VOLATILE)
+    _section(settings, 'Java ', node.jvm, JVM_VOLATILE)
+
+    #JVM arguments are compared one by one, with sizes in bytes so '-Xmx2048m' matches '-Xmx2g'
+    args = parse_jvm_args((node.jvm or {}).get('virtual-machine-arguments'))
+    settings['JVM -Xms'] = args.heap_min
+    settings['JVM -Xmx'] = args.heap_max
+    for name, enabled in args.flags.items():
+        settings['JVM -XX:'+name] = '+' if enabled else '-'
+    for name, value in args.options.items():
+        settings['JVM -XX:'+name] = value
+    for name, value in args.properties.items():
+        settings['JVM -D'+name] = value
+    for arg in args.other:
+        settings['JVM '+arg] = 'set'
+
+    _section(settings, 'Database ', node.database)
+    _section(settings, 'SCM cache ', node.scm_cache)
+    _section(settings, 'Elasticsearch ', node.elasticsearch)
+    _section(settings, 'Home ', node.home, FILESYSTEM_VOLATILE)
+    _section(settings, 'Shared home ', node.shared_home, FILESYSTEM_VOLATILE)
+    for plugin in node.plugins:
+        if plugin.get('key'):
+            settings['Plugin '+plugin['key']] = (plugin.get('version') or '?') + ' ' + (plugin.get('status') or '')
+
+    settings['bitbucket.properties'] = 'present' if node.properties is not None else 'missing'
+    for key, value in parse_properties(node.properties or '').items():
+        if key not in NODE_SPECIFIC_PROPERTIES:
+            settings['bitbucket.properties '+key] = value
+    return settings
+
+
+def is_secret(field):
+    return any(word in field.lower() for word in SECRETS)
+
+
+def find_drift(nodes):
+    """[(field, [value of each node])] for every field that isn't the same on all nodes, in first-seen order.
+
+    A node that doesn't have a field at all gets None.
+    """
+    perNode = [node_settings(node) for node in nodes]
+    fields = OrderedDict()
+    for settings in perNode:
+        for field in settings:
+            fields[field] = None
+    drift = []
+    for field in fields:
+        values = [settings.get(field) for settings in perNode]
+        if any(value != values[0] for value in values[1:]):
+            drift.append((field, values))
+    return drift
+
+
+def group_values(values, labels):
+    """[(value, [labels])] with the most common value first, for a compact per-node listing."""
+    groups = OrderedDict()
+    for value, label in zip(values, labels):
+        groups.setdefault(value, []).append(label)
+    return sorted(groups.items(), key=lambda item: -len(item[1]))
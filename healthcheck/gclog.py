@@ -0,0 +1,218 @@
+"""Pause times, allocation rate and live set from the GC logs in a support zip.
+
+Two formats are understood, one line at a time:
+
+JDK 9+ unified logging (-Xlog:gc), one line per pause:
+
+    [2021-02-03T10:00:01.123+0000][12.345s][info][gc] GC(12) Pause Young (Normal) (G1 Evacuation Pause) 512M->128M(2048M) 12.345ms
+
+JDK 8 (-XX:+PrintGCDetails), where G1 reports the heap on a later line:
+
+    12.345: [GC (Allocation Failure) [PSYoungGen: 512K->64K(1024K)] 1024K->576K(4096K), 0.0012345 secs] [Times: ...]
+    12.345: [GC pause (G1 Evacuation Pause) (young), 0.0123456 secs]
+       [Eden: 512.0M(512.0M)->0.0B(510.0M) Survivors: 0.0B->2048.0K Heap: 512.0M(2048.0M)->128.0M(2048.0M)]
+
+Every pause becomes a GcEvent. The post-GC heap over a window of time is
+the best estimate of the live set available from the logs, so the lowest
+post-GC heap of each window is kept to show how the live set moves.
+"""
+from array import array
+from collections import namedtuple
+from dataclasses import dataclass, field
+import datetime
+import re
+
+from healthcheck.accesslog import read_lines, percentile
+from healthcheck.supportzip import GC_LOGS
+from healthcheck.units import parse_size, format_size
+
+LIVE_SET_WINDOWS = 6
+LIVE_SET_WARNING = 0.7
+LIVE_SET_CRITICAL = 0.9
+LONG_PAUSE_MS = 1000
+GC_OVERHEAD_WARNING = 5.0
+
+#time is seconds (JVM uptime, or since the epoch if the log only has dates); sizes are bytes and may be None
+GcEvent = namedtuple('GcEvent', 'time full pause_ms before after capacity')
+
+_SIZE = r'([0-9.]+[BKMG]?)'
+_UNIFIED = re.compile(r'GC\(\d+\) Pause (.+?) ([0-9.]+)ms\s*$')
+_UNIFIED_HEAP = re.compile(_SIZE+'->'+_SIZE+r'\('+_SIZE+r'\)')
+_UNIFIED_UPTIME = re.compile(r'\[([0-9.]+)s\]')
+_JDK8 = re.compile(r'\[(Full GC|GC)\b(?! concurrent)')
+_JDK8_UPTIME = re.compile(r'(?:^|\s)([0-9]+\.[0-9]+): \[')
+_JDK8_SECS = re.compile(r'([0-9.]+) secs\]')
+#per generation details, e.g. [PSYoungGen: ...], [ParNew: ..., 0.01 secs], [Metaspace: ...], [Times: ...]
+_JDK8_DETAIL = re.compile(r'\[[A-Za-z ]+: [^\]]*\]')
+_JDK8_HEAP = re.compile(_SIZE+'->'+_SIZE+r'\('+_SIZE+r'\)')
+_G1_HEAP = re.compile(r'Heap: '+_SIZE+r'\('+_SIZE+r'\)->'+_SIZE+r'\('+_SIZE+r'\)')
+_DATE = re.compile(r'(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{3}[+-]\d{4})')
+
+
+@dataclass
+class GcStats:
+    files: int = 0
+    pauses: int = 0
+    full_gcs: int = 0
+    #seconds covered by the logs, summed over JVM restarts
+    span: float = 0.0
+    total_pause_ms: float = 0.0
+    p50: float = None
+    p95: float = None
+    p99: float = None
+    max_pause: float = None
+    #bytes per second
+    allocation_rate: float = None
+    capacity: int = None
+    #lowest post-GC heap in each of LIVE_SET_WINDOWS windows, in bytes
+    live_set: list = field(default_factory=list)
+
+    @property
+    def overhead(self):
+        """Percentage of the time the application was paused."""
+        if not self.span:
+            return None
+        return 100.0 * self.total_pause_ms / 1000.0 / self.span
+
+    @property
+    def peak_live_set(self):
+        return max(self.live_set) if self.live_set else None
+
+
+def _timestamp(line, uptime):
+    match = uptime.search(line)
+    if match is not None:
+        return float(match.group(1))
+    match = _DATE.search(line)
+    if match is not None:
+        try:
+            return datetime.datetime.strptime(match.group(1), '%Y-%m-%dT%H:%M:%S.%f%z').timestamp()
+        except ValueError:
+            pass
+    return None
+
+
+def _heap(match, before, after, capacity):
+    return parse_size(match.group(before)), parse_size(match.group(after)), parse_size(match.group(capacity))
+
+
+def parse(lines):
+    """Yield a GcEvent for every stop-the-world pause."""
+    #JDK 8 G1 pauses are held back until their Heap: line has been seen
+    pending = None
+    for line in lines:
+        match = _UNIFIED.search(line)
+        if match is not None:
+            heap = list(_UNIFIED_HEAP.finditer(match.group(1)))
+            sizes = _heap(heap[-1], 1, 2, 3) if heap else (None, None, None)
+            yield GcEvent(_timestamp(line, _UNIFIED_UPTIME), match.group(1).startswith('Full'), float(match.group(2)), *sizes)
+            continue
+        match = _JDK8.search(line)
+        if match is not None:
+            if pending is not None:
+                yield pending
+                pending = None
+            stripped = _JDK8_DETAIL.sub('', line)
+            secs = _JDK8_SECS.findall(stripped)
+            if not secs:
+                continue
+            heap = _JDK8_HEAP.search(stripped)
+            sizes = _heap(heap, 1, 2, 3) if heap else (None, None, None)
+            event = GcEvent(_timestamp(line, _JDK8_UPTIME), match.group(1) == 'Full GC', float(secs[-1]) * 1000, *sizes)
+            if heap is None:
+                pending = event
+            else:
+                yield event
+            continue
+        match = _G1_HEAP.search(line)
+        if match is not None and pending is not None:
+            yield pending._replace(**dict(zip(('before', 'after', 'capacity'), _heap(match, 1, 3, 4))))
+            pending = None
+    if pending is not None:
+        yield pending
+
+
+def analyse(events, files=0):
+    stats = GcStats(files=files)
+    pauses = array('d')
+    #elapsed time and post-GC heap of every pause, for the live set windows
+    times = array('d')
+    afters = array('d')
+    allocated = allocationSpan = 0.0
+    start = last = lastAfter = None
+    elapsed = 0.0
+
+    for event in events:
+        pauses.append(event.pause_ms)
+        stats.total_pause_ms += event.pause_ms
+        if event.full:
+            stats.full_gcs += 1
+        if event.capacity is not None:
+            stats.capacity = max(stats.capacity or 0, event.capacity)
+        if event.time is None:
+            continue
+        if last is None or event.time < last:
+            #first event, or the JVM restarted (uptime went backwards) or a rotated file is out of order
+            if last is not None:
+                elapsed += last - start
+            start = event.time
+            lastAfter = None
+        elif lastAfter is not None and event.before is not None and event.time > last:
+            allocated += max(event.before - lastAfter, 0)
+            allocationSpan += event.time - last
+        last = event.time
+        if event.after is not None:
+            lastAfter = event.after
+            times.append(elapsed + event.time - start)
+            afters.append(event.after)
+
+    stats.pauses = len(pauses)
+    if last is not None:
+        stats.span = elapsed + last - start
+    if allocationSpan:
+        stats.allocation_rate = allocated / allocationSpan
+    if pauses:
+        ordered = sorted(pauses)
+        stats.p50, stats.p95, stats.p99 = (percentile(ordered, pct) for pct in (50, 95, 99))
+        stats.max_pause = ordered[-1]
+    if times:
+        width = (times[-1] - times[0]) / LIVE_SET_WINDOWS or 1
+        windows = [None] * LIVE_SET_WINDOWS
+        for offset, after in zip(times, afters):
+            i = min(int((offset - times[0]) / width), LIVE_SET_WINDOWS - 1)
+            windows[i] = after if windows[i] is None else min(windows[i], after)
+        stats.live_set = [int(value) for value in windows if value is not None]
+    return stats
+
+
+def assess(stats, heapMax=None):
+    """(status, message) findings for one node's GC statistics; heapMax is -Xmx in bytes, if known."""
+    findings = []
+    heapMax = heapMax or stats.capacity
+    live = stats.peak_live_set
+    if live is not None and heapMax:
+        share = float(live) / heapMax
+        if share >= LIVE_SET_CRITICAL:
+            findings.append(('(x)', "The live set reaches "+format_size(live)+", "+format(100 * share, '.0f')+"% of the "+format_size(heapMax)
+                             +" heap. Raise {{-Xmx}}, or find out what is holding on to memory, before the node runs out of heap."))
+        elif share >= LIVE_SET_WARNING:
+            findings.append(('(!)', "The live set reaches "+format_size(live)+", "+format(100 * share, '.0f')+"% of the "+format_size(heapMax)
+                             +" heap. There is little headroom for load spikes; consider raising {{-Xmx}}."))
+    if stats.full_gcs:
+        findings.append(('(!)', str(stats.full_gcs)+" full GC(s), which stop the node for the whole collection"))
+    if stats.max_pause is not None and stats.max_pause >= LONG_PAUSE_MS:
+        findings.append(('(!)', "Longest pause was "+format(stats.max_pause / 1000, ',.1f')+"s, long enough for Hazelcast and clients to notice"))
+    overhead = stats.overhead
+    if overhead is not None and overhead >= GC_OVERHEAD_WARNING:
+        findings.append(('(!)', "The JVM spent "+format(overhead, '.1f')+"% of the time in GC pauses"))
+    if not findings and stats.pauses:
+        findings.append(('(/)', "GC pauses and live set look healthy"))
+    return findings
+
+
+def analyse_source(source):
+    """Analyse every GC log in a support zip; None if it has none."""
+    names = source.files(GC_LOGS)
+    if not names:
+        return None
+    return analyse(parse(read_lines(source, names)), files=len(names))
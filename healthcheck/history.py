@@ -0,0 +1,185 @@
+"""Per-node metrics of every run, kept so that runs can be compared over time.
+
+A support zip is a snapshot: load, heap usage, open files and free disk at
+the moment it was made. Each run records those numbers (plus the project
+and repository counts) in a SQLite store, one row per node, metric and
+support zip, under the instance's server ID and base URL. Recording the
+same zip again replaces its rows, so rerunning the health check doesn't
+skew the trends.
+
+trend() fits a straight line (least squares) through each node's samples
+of the metrics in TRENDS and, for those with a limit, projects when the
+limit will be reached at that rate: open files against max-file-descriptor, disk used
+against the total size of the home and shared home directories, and heap
+usage against HEAP_USED_CRITICAL.
+"""
+from collections import OrderedDict, namedtuple
+import datetime
+import os
+import re
+import sqlite3
+
+from healthcheck.jvmargs import HEAP_USED_CRITICAL, parse_jvm_args
+from healthcheck.units import parse_size
+
+HISTORY_FILE = 'history.sqlite'
+#bump whenever the table changes; older stores are then emptied rather than migrated
+SCHEMA_VERSION = 1
+#a limit reached sooner than this many days is an error, sooner than the warning a warning
+PROJECTION_CRITICAL_DAYS = 30
+PROJECTION_WARNING_DAYS = 90
+DAY = 24 * 60 * 60
+
+#(metric, what it is, metric holding its limit or a fixed limit, None if it has none)
+TRENDS = (
+    ('heap_used_pct', 'Heap used (%)', HEAP_USED_CRITICAL),
+    ('open_fds', 'Open files', 'max_fds'),
+    ('home_used', 'Home directory used', 'home_total'),
+    ('shared_home_used', 'Shared home used', 'shared_home_total'),
+    ('repositories', 'Repositories', None),
+    ('projects', 'Projects', None),
+)
+#metrics shown as sizes rather than plain numbers
+SIZE_METRICS = ('home_used', 'shared_home_used', 'free_memory', 'heap_max')
+
+#Bitbucket names its support zips after the time they were made, e.g. Bitbucket_support_2020-12-04T15_25_42.858Z.zip
+_ZIP_TIME = re.compile(r'(\d{4}-\d\d-\d\d)T(\d\d)[_:-](\d\d)[_:-](\d\d)')
+_NUMBER = re.compile(r'^\s*(-?[0-9]+(?:\.[0-9]+)?)')
+
+#change is per day; reaches is when limit will be reached at that rate (seconds since the epoch), None if it won't be
+Trend = namedtuple('Trend', 'node metric label samples first last change limit reaches status')
+
+
+def _number(text):
+    match = _NUMBER.match(str(text)) if text is not None else None
+    return float(match.group(1)) if match else None
+
+
+def _used(section):
+    total = parse_size((section or {}).get('total-size'))
+    free = parse_size((section or {}).get('free-size'))
+    return (total - free if total is not None and free is not None else None), total
+
+
+def node_metrics(node):
+    """{metric: value} of the numbers in one node's application.xml; metrics that are missing are left out."""
+    osInfo = node.os or {}
+    jvm = node.jvm or {}
+    homeUsed, homeTotal = _used(node.home)
+    sharedUsed, sharedTotal = _used(node.shared_home)
+    metrics = OrderedDict([
+        ('load_average', _number(osInfo.get('system-load-average'))),
+        ('cpu_load_pct', _number(osInfo.get('system-cpu-load'))),
+        ('free_memory', parse_size(osInfo.get('free-physical-memory'))),
+        ('open_fds', _number(osInfo.get('open-file-descriptor'))),
+        ('max_fds', _number(osInfo.get('max-file-descriptor'))),
+        ('heap_used_pct', _number(jvm.get('percent-heap-used'))),
+        ('heap_max', parse_jvm_args(jvm.get('virtual-machine-arguments')).heap_max),
+        ('home_used', homeUsed),
+        ('home_total', homeTotal),
+        ('shared_home_used', sharedUsed),
+        ('shared_home_total', sharedTotal),
+        ('projects', _number(node.projects_count)),
+        ('repositories', _number(node.repositories_count)),
+    ])
+    return OrderedDict((metric, float(value)) for metric, value in metrics.items() if value is not None)
+
+
+def sample_time(path):
+    """When a support zip was made, from its name, or else from its modification time."""
+    match = _ZIP_TIME.search(os.path.basename(path))
+    if match:
+        made = datetime.datetime.strptime(' '.join(match.groups()), '%Y-%m-%d %H %M %S')
+        return made.replace(tzinfo=datetime.timezone.utc).timestamp()
+    return os.path.getmtime(path)
+
+
+def node_name(node):
+    return node.local_id or node.local_address or node.label
+
+
+class MetricsStore:
+    """Metric samples in SQLite, one row per instance, node, support zip time and metric."""
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        if self.db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            self.db.execute('DROP TABLE IF EXISTS samples')
+            self.db.execute('PRAGMA user_version = ' + str(SCHEMA_VERSION))
+        self.db.execute('CREATE TABLE IF NOT EXISTS samples (server_id TEXT, base_url TEXT, node TEXT, taken REAL, source TEXT, '
+                        'metric TEXT, value REAL, PRIMARY KEY (server_id, base_url, node, taken, metric))')
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def record(self, serverId, baseUrl, node, taken, source, metrics):
+        self.db.executemany('INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            [(serverId or '', baseUrl or '', node, taken, source, metric, value) for metric, value in metrics.items()])
+        self.db.commit()
+
+    def series(self, serverId, baseUrl):
+        """{node: {metric: [(taken, value)]}} of one instance, oldest sample first."""
+        found = OrderedDict()
+        rows = self.db.execute('SELECT node, metric, taken, value FROM samples WHERE server_id = ? AND base_url = ? ORDER BY node, taken',
+                               (serverId or '', baseUrl or ''))
+        for node, metric, taken, value in rows:
+            found.setdefault(node, {}).setdefault(metric, []).append((taken, value))
+        return found
+
+
+def fit(points):
+    """(slope per second, intercept) of the least squares line through [(time, value)], or None for fewer than two times."""
+    if len(set(taken for taken, value in points)) < 2:
+        return None
+    count = float(len(points))
+    meanTime = sum(taken for taken, value in points) / count
+    meanValue = sum(value for taken, value in points) / count
+    slope = (sum((taken - meanTime) * (value - meanValue) for taken, value in points)
+             / sum((taken - meanTime) ** 2 for taken, value in points))
+    return slope, meanValue - slope * meanTime
+
+
+def project(points, limit):
+    """When the line through points reaches limit, counting from the last sample; None if it isn't growing towards it."""
+    line = fit(points)
+    if line is None or limit is None or line[0] <= 0:
+        return None
+    last, value = points[-1]
+    if value >= limit:
+        return last
+    return last + (limit - value) / line[0]
+
+
+def trend(series):
+    """A Trend for each node and tracked metric with at least one sample.
+
+    How soon a limit is reached is counted from the node's last support zip, not from today, as
+    older support zips are often analysed long after they were made.
+    """
+    trends = []
+    for node, metrics in series.items():
+        for metric, label, limitSource in TRENDS:
+            points = metrics.get(metric)
+            if not points:
+                continue
+            if isinstance(limitSource, str):
+                limit = metrics[limitSource][-1][1] if metrics.get(limitSource) else None
+            else:
+                limit = limitSource
+            line = fit(points)
+            reaches = project(points, limit)
+            if reaches is None:
+                status = '(/)' if line is not None else '(?)'
+            elif reaches - points[-1][0] < PROJECTION_CRITICAL_DAYS * DAY:
+                status = '(x)'
+            elif reaches - points[-1][0] < PROJECTION_WARNING_DAYS * DAY:
+                status = '(!)'
+            else:
+                status = '(/)'
+            trends.append(Trend(node, metric, label, len(points), points[0][1], points[-1][1],
+                                line[0] * DAY if line is not None else None, limit, reaches, status))
+    return trends
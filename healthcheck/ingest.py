@@ -0,0 +1,117 @@
+"""Turn support zips into node records, optionally across several processes.
+
+Each support zip is handled end to end by one worker: extraction (if
+asked for), locating the files inside it and parsing them. Only the
+resulting NodeRecord is sent back to the parent, and results are always
+returned in the order of the sources passed in, so the report doesn't
+depend on how many workers were used.
+
+Only the logs in logs are analysed, so a run whose checks don't read
+e.g. thread dumps doesn't pay for them. A node analysed with every log is
+cached under the zip's fingerprint and serves any later run; one missing
+some is cached under the fingerprint and the logs it has.
+"""
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+
+from healthcheck import accesslog, applog, gclog, profiler, threaddump
+from healthcheck.nodes import load_node
+from healthcheck.supportzip import APP_XML
+from healthcheck.timing import Timings
+
+#the logs ingest_source() can analyse, as named in healthcheck.rules.INPUTS
+ANALYSED_LOGS = ('access-logs', 'thread-dumps', 'gc-logs', 'profiler-logs', 'app-logs')
+
+#node is None (and error set) if the source couldn't be read, and both are None if it isn't a support zip;
+#timings are the PhaseTimings of this source when profiling
+Ingested = namedtuple('Ingested', 'source node error key memo cached timings')
+
+
+def ingest_source(source, rootPath, extract=False, cache=None, profile=False, logs=ANALYSED_LOGS):
+    """Load one support zip, from the cache if it has been seen before, analysing the logs named in logs."""
+    key = memo = None
+    timings = Timings(profile)
+    name = os.path.basename(source.path)
+    try:
+        if cache is not None:
+            with timings.phase('cache lookup', name):
+                fingerprint, memo = cache.fingerprint(source)
+                keys = [cache.key('node', fingerprint)]
+                if set(logs) != set(ANALYSED_LOGS):
+                    keys.append(cache.key('node', fingerprint, *sorted(logs)))
+                for key in keys:
+                    node = cache.load(key)
+                    if node is not None:
+                        break
+            if node is not None:
+                #the label depends on where the zip was found this time, not where it was cached from
+                node.label = os.path.relpath(os.path.join(source.path, node.label_member), rootPath)
+                return Ingested(source, node, None, key, memo, True, timings.finished())
+        if extract:
+            logging.debug("Extracting "+source.path)
+            with timings.phase('extract', name):
+                extracted = source.extract()
+            source.close()
+            source = extracted
+        with timings.phase('index', name):
+            found = source.find(APP_XML)
+        if found is None:
+            return Ingested(source, None, None, key, memo, False, timings.finished())
+        logging.debug("Files found in "+source.path+": "+source.index.summary())
+        label = os.path.relpath(source.display_name(APP_XML), rootPath)
+        with timings.phase('parse application.xml', name):
+            node = load_node(source, label)
+        node.label_member = found
+        if 'access-logs' in logs:
+            with timings.phase('access logs', name):
+                node.access = accesslog.analyse_source(source)
+        if 'thread-dumps' in logs:
+            with timings.phase('thread dumps', name):
+                node.threads = threaddump.analyse_source(source)
+        if 'gc-logs' in logs:
+            with timings.phase('GC logs', name):
+                node.gc = gclog.analyse_source(source)
+        if 'profiler-logs' in logs:
+            with timings.phase('profiler logs', name):
+                node.profiler = profiler.analyse_source(source, node.plugins)
+        if 'app-logs' in logs:
+            with timings.phase('application logs', name):
+                node.app_log = applog.analyse_source(source)
+        return Ingested(source, node, None, key, memo, False, timings.finished())
+    except Exception as e:
+        #exceptions don't always survive the trip back from a worker, so only the message is returned
+        return Ingested(source, None, str(e) or repr(e), key, memo, False, timings.finished())
+    finally:
+        source.close()
+
+
+def ingest(sources, rootPath, extract=False, jobs=1, cache=None, timings=None, logs=ANALYSED_LOGS):
+    """Load every source, using up to jobs worker processes. Per source timings are added to timings, if given."""
+    timings = timings or Timings()
+    jobs = min(jobs, len(sources))
+    if jobs <= 1:
+        results = [ingest_source(source, rootPath, extract, cache, timings.enabled, logs) for source in sources]
+    else:
+        logging.debug("Ingesting "+str(len(sources))+" support zips with "+str(jobs)+" worker processes")
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            #map keeps the results in the same order as the sources
+            results = list(pool.map(ingest_source, sources, [rootPath]*len(sources), [extract]*len(sources), [cache]*len(sources),
+                                    [timings.enabled]*len(sources), [logs]*len(sources)))
+    for result in results:
+        timings.extend(result.timings)
+    if cache is not None:
+        #only the parent writes to the cache, so workers never race on it
+        try:
+            with timings.phase('cache save'):
+                for result in results:
+                    cache.remember(result.memo)
+                    if result.cached:
+                        cache.touch(result.key)
+                    elif result.node is not None:
+                        cache.store(result.key, result.node)
+                cache.save()
+        except OSError as e:
+            logging.warning("Couldn't update the analysis cache in "+cache.path+": "+str(e))
+    return results
@@ -0,0 +1,169 @@
+"""Structured view of a node's JVM arguments, and checks on heap and GC settings.
+
+parse_jvm_args() turns the virtual-machine-arguments string from
+application.xml into a JvmArgs model with sizes in bytes, so '-Xms2048m'
+and '-Xmx2g' compare as equal. analyse_heap(), analyse_gc() and
+analyse_heap_usage() return (status, message) findings for the report,
+using the same icons as the rest of the health check.
+"""
+from dataclasses import dataclass, field
+
+from healthcheck.units import parse_size, format_size
+
+COLLECTORS = ('UseG1GC', 'UseParallelGC', 'UseParallelOldGC', 'UseConcMarkSweepGC', 'UseSerialGC', 'UseZGC', 'UseShenandoahGC')
+MIN_METASPACE = 256 * 1024**2
+MIN_CODE_CACHE = 240 * 1024**2
+#above this Bitbucket rarely benefits from more heap, as the git work happens outside the JVM
+LARGE_HEAP = 8 * 1024**3
+HEAP_USED_WARNING = 75
+HEAP_USED_CRITICAL = 90
+
+
+@dataclass
+class JvmArgs:
+    heap_min: int = None
+    heap_max: int = None
+    heap_min_text: str = None
+    heap_max_text: str = None
+    #-XX:+Flag / -XX:-Flag
+    flags: dict = field(default_factory=dict)
+    #-XX:Name=value
+    options: dict = field(default_factory=dict)
+    #-Dname=value
+    properties: dict = field(default_factory=dict)
+    other: list = field(default_factory=list)
+
+    def flag(self, name, default=False):
+        return self.flags.get(name, default)
+
+    def size_option(self, name):
+        return parse_size(self.options.get(name))
+
+    @property
+    def collector(self):
+        #the JVM uses the last collector switched on
+        chosen = [name for name, enabled in self.flags.items() if name in COLLECTORS and enabled]
+        return chosen[-1] if chosen else None
+
+
+def parse_jvm_args(text):
+    """Parse a space separated JVM argument string. Later arguments override earlier ones, as in the JVM."""
+    args = JvmArgs()
+    for arg in (text or '').split():
+        if arg.startswith('-Xms'):
+            args.heap_min_text = arg[4:]
+            args.heap_min = parse_size(arg[4:])
+        elif arg.startswith('-Xmx'):
+            args.heap_max_text = arg[4:]
+            args.heap_max = parse_size(arg[4:])
+        elif arg.startswith('-XX:+') or arg.startswith('-XX:-'):
+            #dict order follows the last time a flag was set
+            args.flags.pop(arg[5:], None)
+            args.flags[arg[5:]] = arg[4] == '+'
+        elif arg.startswith('-XX:') and '=' in arg:
+            name, value = arg[4:].split('=', 1)
+            args.options[name] = value
+        elif arg.startswith('-D'):
+            name, _, value = arg[2:].partition('=')
+            args.properties[name] = value
+        else:
+            args.other.append(arg)
+    return args
+
+
+def _java_major(javaVersion):
+    #'1.8.0_282' -> 8, '11.0.9+11' -> 11
+    try:
+        parts = javaVersion.split('.')
+        return int(parts[1]) if parts[0] == '1' else int(parts[0].split('+')[0].split('-')[0])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def analyse_heap(args, physicalMemory=None):
+    findings = []
+    if args.heap_min is None or args.heap_max is None:
+        findings.append(('(x)', "Both {{-Xms}} and {{-Xmx}} should be set, and to the same value"))
+    elif args.heap_min != args.heap_max:
+        findings.append(('(!)', "{{-Xms"+args.heap_min_text+"}} and {{-Xmx"+args.heap_max_text+"}} differ ("
+                         +format_size(args.heap_min)+" vs "+format_size(args.heap_max)+"). We recommend setting {{-Xms}} and {{-Xmx}} to the same value."))
+    else:
+        findings.append(('(/)', "{{-Xms}} and {{-Xmx}} are both "+format_size(args.heap_max)))
+
+    heap = args.heap_max
+    if heap is None and 'MaxRAMPercentage' in args.options and physicalMemory:
+        try:
+            heap = int(physicalMemory * float(args.options['MaxRAMPercentage']) / 100)
+        except ValueError:
+            pass
+    if heap is not None and physicalMemory:
+        share = 100.0 * heap / physicalMemory
+        if share > 75:
+            findings.append(('(x)', "The heap is "+format(share, '.0f')+"% of the "+format_size(physicalMemory)+" of physical memory. "
+                             "Git processes, the OS page cache and off-heap memory need the rest, so expect swapping or OOM kills."))
+        elif share > 50:
+            findings.append(('(!)', "The heap is "+format(share, '.0f')+"% of the "+format_size(physicalMemory)+" of physical memory. "
+                             "Git processes run outside the JVM and rely on the remaining memory and page cache."))
+    if heap is not None and heap > LARGE_HEAP:
+        findings.append(('(!)', "A "+format_size(heap)+" heap is larger than Bitbucket normally needs, and makes GC pauses longer; "
+                         "most of Bitbucket's work happens in git processes outside the heap."))
+    return findings
+
+
+def analyse_gc(args, javaVersion=None):
+    findings = []
+    major = _java_major(javaVersion)
+    collector = args.collector
+    if collector is None:
+        #no collector chosen: Java 8 defaults to the parallel collector, 9+ to G1
+        collector = 'UseParallelGC' if major is not None and major <= 8 else 'UseG1GC'
+        implied = " (JVM default)"
+    else:
+        implied = ""
+    name = {'UseG1GC': 'G1', 'UseParallelGC': 'Parallel', 'UseParallelOldGC': 'Parallel', 'UseConcMarkSweepGC': 'CMS',
+            'UseSerialGC': 'Serial', 'UseZGC': 'ZGC', 'UseShenandoahGC': 'Shenandoah'}[collector]
+    if collector == 'UseG1GC':
+        findings.append(('(/)', "Garbage collector: *"+name+"*"+implied))
+    elif collector == 'UseSerialGC':
+        findings.append(('(x)', "Garbage collector: *"+name+"*"+implied+". The serial collector stops the application on a single thread; use G1."))
+    elif collector == 'UseConcMarkSweepGC':
+        findings.append(('(!)', "Garbage collector: *"+name+"*"+implied+". CMS is deprecated (and removed in Java 14); we recommend G1."))
+    elif collector in ('UseParallelGC', 'UseParallelOldGC'):
+        findings.append(('(!)', "Garbage collector: *"+name+"*"+implied+". The parallel collector favours throughput over pause times; we recommend G1 ({{-XX:+UseG1GC}})."))
+    else:
+        findings.append(('(!)', "Garbage collector: *"+name+"*"+implied+". This collector isn't what Bitbucket is tested with; we recommend G1."))
+
+    if not args.flag('HeapDumpOnOutOfMemoryError'):
+        findings.append(('(!)', "{{-XX:+HeapDumpOnOutOfMemoryError}} isn't set, so there will be nothing to analyse if the node runs out of memory"))
+    elif 'HeapDumpPath' not in args.options:
+        findings.append(('(!)', "{{-XX:+HeapDumpOnOutOfMemoryError}} is set without {{-XX:HeapDumpPath}}, so heap dumps land in the working directory and can fill its disk"))
+    else:
+        findings.append(('(/)', "Heap dumps on OutOfMemoryError go to {{"+args.options['HeapDumpPath']+"}}"))
+
+    metaspace = args.size_option('MaxMetaspaceSize')
+    if metaspace is not None and metaspace < MIN_METASPACE:
+        findings.append(('(!)', "{{-XX:MaxMetaspaceSize="+args.options['MaxMetaspaceSize']+"}} is small; plugin heavy instances can hit OutOfMemoryError: Metaspace"))
+    codeCache = args.size_option('ReservedCodeCacheSize')
+    if codeCache is not None and codeCache < MIN_CODE_CACHE:
+        findings.append(('(!)', "{{-XX:ReservedCodeCacheSize="+args.options['ReservedCodeCacheSize']+"}} is below the 240 MB default; the JIT stops compiling once it is full"))
+    return findings
+
+
+def analyse_heap_usage(percentUsed):
+    try:
+        used = float(str(percentUsed).strip().rstrip('%'))
+    except ValueError:
+        return ('(?)', "Heap usage unknown")
+    if used >= HEAP_USED_CRITICAL:
+        return ('(x)', "Heap is "+format(used, 'g')+"% used")
+    if used >= HEAP_USED_WARNING:
+        return ('(!)', "Heap is "+format(used, 'g')+"% used")
+    return ('(/)', "Heap is "+format(used, 'g')+"% used")
+
+
+def worst_status(findings):
+    """The most severe icon among (status, message) findings."""
+    for icon in ('(x)', '(!)', '(?)'):
+        if any(status == icon for status, _ in findings):
+            return icon
+    return '(/)'
@@ -0,0 +1,119 @@
+"""Per-node model built from a single parse of each support zip.
+
+Every report section used to re-parse application.xml and walk the
+cluster-information block again to find the local node. load_node() does
+that work once per support zip and keeps just the values the report needs.
+"""
+from dataclasses import dataclass, field
+import xml.etree.ElementTree as ET
+
+from healthcheck.supportzip import APP_XML, BB_PROPERTIES
+
+
+def _text(root, path):
+    elem = root.find(path)
+    return elem.text if elem is not None else None
+
+
+def _children(root, path):
+    #flatten one level of an element into {tag: text}; None if the element is missing
+    elem = root.find(path)
+    if elem is None:
+        return None
+    return {child.tag: child.text for child in elem}
+
+
+@dataclass
+class NodeRecord:
+    label: str
+    label_member: str = None
+    local_id: str = None
+    local_address: str = None
+    clustered: bool = False
+    cluster_nodes: list = field(default_factory=list)
+    product_name: str = None
+    product_version: str = None
+    base_url: str = None
+    server_id: str = None
+    os: dict = None
+    jvm: dict = None
+    home: dict = None
+    shared_home: dict = None
+    database: dict = None
+    git_version: str = None
+    scm_cache: dict = None
+    elasticsearch: dict = None
+    projects_count: str = None
+    repositories_count: str = None
+    plugins: list = field(default_factory=list)
+    properties: str = None
+    #results of the log analysers, filled in by healthcheck.ingest
+    access: object = None
+    threads: object = None
+    gc: object = None
+    profiler: object = None
+    app_log: object = None
+
+
+def parse_node(root, label):
+    """Build a NodeRecord from the root element of an application.xml."""
+    node = NodeRecord(label=label)
+
+    node.clustered = _text(root, 'cluster-information/clustered') == 'true'
+    for getnode in root.findall('cluster-information/node'):
+        nodeId = _text(getnode, 'id')
+        nodeAddress = _text(getnode, 'address')
+        node.cluster_nodes.append((nodeId, nodeAddress))
+        if _text(getnode, 'local') == 'true':
+            node.local_id = nodeId
+            node.local_address = nodeAddress
+
+    prod = root.find('product')
+    if prod is not None:
+        node.product_name = prod.get('name')
+        node.product_version = prod.get('version')
+    node.base_url = _text(root, 'bitbucket-information/base-url')
+    node.server_id = _text(root, 'bitbucket-information/server-id')
+
+    node.os = _children(root, 'operating-system')
+    node.jvm = _children(root, 'java-runtime-environment')
+    node.home = _children(root, 'filesystem/home')
+    node.shared_home = _children(root, 'filesystem/shared-home')
+
+    # note: "database-info" element structure may be different between versions, so driver details are searched for anywhere below it
+    dbInfo = root.find('database-information')
+    if dbInfo is not None:
+        node.database = {
+            'database-name': _text(dbInfo, 'database-name'),
+            'version': _text(dbInfo, 'version'),
+            'support-level': _text(dbInfo, 'support-level'),
+            'connection-url': _text(dbInfo, 'connection-url'),
+            'driver-name': _text(dbInfo, './/driver-name'),
+            'driver-version': _text(dbInfo, './/driver-version'),
+        }
+
+    node.git_version = _text(root, 'git/version')
+    scm = root.find('scm-cache')
+    if scm is not None:
+        node.scm_cache = {
+            'http-enabled': _text(scm, 'http-enabled'),
+            'ssh-enabled': _text(scm, 'ssh-enabled'),
+            'refs-advertisement': _text(scm, 'refs-advertisement/enabled'),
+        }
+    node.elasticsearch = _children(root, 'Elasticsearch')
+    node.projects_count = _text(root, 'projects/count')
+    node.repositories_count = _text(root, 'repositories/count')
+
+    for plugin in root.findall('plugins/plugin'):
+        node.plugins.append({child.tag: child.text for child in plugin})
+    return node
+
+
+def load_node(source, label):
+    """Parse the application.xml (and bitbucket.properties, if any) of one support zip."""
+    with source.open(APP_XML) as f:
+        node = parse_node(ET.parse(f).getroot(), label)
+    if source.find(BB_PROPERTIES) is not None:
+        with source.open(BB_PROPERTIES) as f:
+            node.properties = f.read().decode('utf-8', 'replace')
+    return node
@@ -0,0 +1,242 @@
+"""Plugin compatibility from a local catalog of Marketplace answers.
+
+plugin_checker asks Marketplace about one plugin at a time on every run,
+which takes minutes for a customer with a hundred or more plugins and
+fails on analysis hosts without network access. Here every Marketplace
+answer is kept in a SQLite catalog, keyed by the request path, with the
+time it was fetched:
+
+  * entries younger than the TTL are used as they are,
+  * older and missing entries are fetched again, all at once, from a
+    pool of threads sharing one HTTP session (so connections are reused),
+  * offline, or when Marketplace can't be reached, whatever the catalog
+    has is used, however old.
+
+'Not found' answers are stored too, so in-house plugins that aren't on
+Marketplace cost one request per TTL rather than one per run. The base
+URL is configurable, so a local stand-in server serving the same paths
+can be used for testing or air-gapped installs.
+
+The user installed plugins of every node are checked, not just those of
+the first one, so a plugin that was only upgraded on some nodes shows up.
+"""
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import sqlite3
+import time
+from urllib.parse import quote
+
+from packaging import version
+
+from healthcheck.defaults import DEFAULT_MARKETPLACE_URL
+
+CATALOG_FILE = 'plugin-catalog.sqlite'
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_WORKERS = 8
+REQUEST_TIMEOUT = 20
+#bump whenever the table changes; older catalogs are then emptied rather than migrated
+SCHEMA_VERSION = 1
+
+#status is the HTTP status (200 or 404), data the decoded JSON body, and stale is True if it is older than the TTL
+Answer = namedtuple('Answer', 'status data fetched stale')
+#supported is the (min, max) Bitbucket version range of the installed version, latest the newest version compatible with this Bitbucket
+PluginCheck = namedtuple('PluginCheck', 'key name vendor version nodes status supported latest message')
+
+
+class PluginCatalog:
+    """Marketplace answers stored in SQLite, refreshed once they are older than ttl seconds."""
+
+    def __init__(self, path, baseUrl=DEFAULT_MARKETPLACE_URL, ttl=DEFAULT_TTL, offline=False, workers=DEFAULT_WORKERS):
+        self.path = path
+        self.baseUrl = baseUrl.rstrip('/')
+        self.ttl = ttl
+        self.offline = offline
+        self.workers = workers
+        #lookups that couldn't be answered from the catalog or Marketplace, for the report
+        self.failures = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        if self.db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            self.db.execute('DROP TABLE IF EXISTS answers')
+            self.db.execute('PRAGMA user_version = ' + str(SCHEMA_VERSION))
+        #answers are per Marketplace, so a stand-in server's answers never mix with the real ones
+        self.db.execute('CREATE TABLE IF NOT EXISTS answers (base_url TEXT, path TEXT, status INTEGER, body TEXT, fetched REAL, '
+                        'PRIMARY KEY (base_url, path))')
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def _cached(self, path):
+        row = self.db.execute('SELECT status, body, fetched FROM answers WHERE base_url = ? AND path = ?', (self.baseUrl, path)).fetchone()
+        if row is None:
+            return None
+        status, body, fetched = row
+        return Answer(status, json.loads(body) if body else None, fetched, time.time() - fetched >= self.ttl)
+
+    def _fetch(self, session, path):
+        response = session.get(self.baseUrl + path, timeout=REQUEST_TIMEOUT, headers={'Accept': 'application/json'})
+        if response.status_code not in (200, 404):
+            raise IOError("HTTP " + str(response.status_code))
+        return response.status_code, response.text if response.status_code == 200 else None
+
+    def _session(self):
+        try:
+            import requests
+        except ImportError:
+            logging.warning("requests isn't installed, so only the plugin catalog is used")
+            return None
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def lookup(self, paths):
+        """{path: Answer or None} for each Marketplace path, fetching what the catalog doesn't have fresh."""
+        answers = OrderedDict((path, self._cached(path)) for path in OrderedDict.fromkeys(paths))
+        missing = [path for path, answer in answers.items() if answer is None or answer.stale]
+        session = self._session() if missing and not self.offline else None
+        if session is not None:
+            def fetch(path):
+                try:
+                    return self._fetch(session, path)
+                except Exception as e:
+                    return e
+            logging.debug("Fetching "+str(len(missing))+" plugin answer(s) from "+self.baseUrl)
+            #the threads only do HTTP; the catalog is read and written from this thread alone
+            with ThreadPoolExecutor(max_workers=self.workers) as pool, session:
+                results = list(pool.map(fetch, missing))
+            errors = 0
+            for path, result in zip(missing, results):
+                if isinstance(result, Exception):
+                    errors += 1
+                    logging.debug("Marketplace lookup of "+path+" failed: "+str(result))
+                    continue
+                status, body = result
+                try:
+                    data = json.loads(body) if body else None
+                except ValueError:
+                    errors += 1
+                    continue
+                fetched = time.time()
+                self.db.execute('INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)', (self.baseUrl, path, status, body, fetched))
+                answers[path] = Answer(status, data, fetched, False)
+            self.db.commit()
+            if errors:
+                logging.warning(str(errors)+" of "+str(len(missing))+" Marketplace lookup(s) failed, older catalog entries are used where there are any")
+        self.failures += sum(1 for answer in answers.values() if answer is None)
+        return answers
+
+
+def installed_plugins(nodes):
+    """{(key, version): plugin dict plus 'nodes': [labels]} of the user installed plugins on every node."""
+    plugins = OrderedDict()
+    for node in nodes:
+        for plugin in node.plugins:
+            if plugin.get('user-installed') != 'true' or not plugin.get('key'):
+                continue
+            entry = plugins.setdefault((plugin['key'], plugin.get('version') or '?'), dict(plugin, nodes=[]))
+            entry['nodes'].append(node.label)
+    return plugins
+
+
+def version_path(key, pluginVersion):
+    return '/rest/2/addons/' + quote(key, safe='') + '/versions/name/' + quote(pluginVersion, safe='')
+
+
+def latest_path(key, build, hosting):
+    return '/rest/2/addons/' + quote(key, safe='') + '/versions/latest?application=bitbucket&applicationBuild=' + str(build) + '&hosting=' + hosting
+
+
+def build_path(productVersion):
+    return '/rest/2/applications/bitbucket/versions/name/' + quote(productVersion, safe='')
+
+
+def supported_range(details, hosting):
+    """(min, max) Bitbucket versions a plugin version supports for the hosting type, or None."""
+    for compatibility in (details or {}).get('compatibilities') or []:
+        if compatibility.get('application') != 'bitbucket':
+            continue
+        hostings = compatibility.get('hosting') or {}
+        #Marketplace has separate ranges for Server and Data Center; use the other if the one asked for is missing
+        found = hostings.get(hosting) or hostings.get('server' if hosting == 'dataCenter' else 'dataCenter')
+        if found:
+            return (found.get('min') or {}).get('version'), (found.get('max') or {}).get('version')
+    return None
+
+
+def _is_compatible(productVersion, supported):
+    low, high = supported
+    try:
+        parsed = version.parse(productVersion)
+        return (low is None or version.parse(low) <= parsed) and (high is None or parsed <= version.parse(high))
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_newer(latest, current):
+    try:
+        return version.parse(latest) > version.parse(current)
+    except (TypeError, ValueError):
+        return latest != current
+
+
+def cluster_size(nodes):
+    """Nodes in the cluster by its membership, which counts nodes whose support zip is missing."""
+    return max([len(nodes)] + [len(node.cluster_nodes) for node in nodes if node.clustered])
+
+
+def check(nodes, productVersion, catalog):
+    """A PluginCheck for each user installed plugin version found on any node, in the order they were found."""
+    plugins = installed_plugins(nodes)
+    if not plugins:
+        return []
+    hosting = 'dataCenter' if any(node.clustered for node in nodes) else 'server'
+    buildAnswer = catalog.lookup([build_path(productVersion)])[build_path(productVersion)] if productVersion else None
+    build = buildAnswer.data.get('buildNumber') if buildAnswer is not None and buildAnswer.data else None
+
+    paths = []
+    for key, pluginVersion in plugins:
+        paths.append(version_path(key, pluginVersion))
+        if build is not None:
+            paths.append(latest_path(key, build, hosting))
+    answers = catalog.lookup(paths)
+
+    checks = []
+    allNodes = cluster_size(nodes)
+    for (key, pluginVersion), plugin in plugins.items():
+        details = answers[version_path(key, pluginVersion)]
+        latestAnswer = answers.get(latest_path(key, build, hosting)) if build is not None else None
+        latest = latestAnswer.data.get('name') if latestAnswer is not None and latestAnswer.data else None
+        supported = supported_range(details.data, hosting) if details is not None else None
+        if len(plugin['nodes']) >= allNodes:
+            onNodes = ['all nodes']
+        elif len(plugin['nodes']) == len(nodes):
+            onNodes = [str(len(nodes))+' of '+str(allNodes)+' nodes, the others have no support zip']
+        else:
+            onNodes = plugin['nodes']
+        if details is None:
+            status, message = '(?)', "Not in the plugin catalog" + ("" if catalog.offline else " and Marketplace couldn't be reached")
+        elif details.status == 404:
+            status, message = '(?)', "Not listed on Marketplace (in-house, private or removed), check compatibility with the vendor"
+        elif supported is None:
+            status, message = '(?)', "Marketplace doesn't list Bitbucket compatibility for this version"
+        elif _is_compatible(productVersion, supported) is False:
+            status, message = '(x)', "Not compatible with Bitbucket "+productVersion
+            if latest:
+                message += ", upgrade to "+latest
+            elif latestAnswer is not None:
+                message += ", and Marketplace lists no version that is"
+        elif latest and _is_newer(latest, pluginVersion):
+            status, message = '(!)', "Compatible, "+latest+" is available"
+        else:
+            status, message = '(/)', "Compatible"
+        if details is not None and details.stale:
+            message += " (catalog entry from "+time.strftime('%Y-%m-%d', time.localtime(details.fetched))+")"
+        checks.append(PluginCheck(key, plugin.get('name') or key, plugin.get('vendor'), pluginVersion, onNodes, status, supported, latest, message))
+    return checks
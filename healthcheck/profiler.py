@@ -0,0 +1,168 @@
+"""Slow requests and operations from atlassian-bitbucket-profiler.log*.
+
+Each profiled request is a header line followed by a timing tree, one
+node per line, indented two spaces per level:
+
+    2021-02-03 10:00:01,123 | http-nio-7990-exec-1 | 600x1x1 | admin | 1a2b3c
+    [1.2s] - "GET /projects/PROJ/repos/repo/browse HTTP/1.1"
+      [1.1s] - com.atlassian.bitbucket.scm.CommandBuilder.build
+        [800ms] - git rev-list --format=%H refs/heads/master
+      [90ms] - com.example.hooks.RepositoryHook.onEvent
+
+The trees are rebuilt with a stack while streaming, so only the current
+branch of one tree is held in memory. The root of each tree is the
+request type; every node below it is an operation. Operations are
+attributed to a plugin when they are in a user installed plugin's
+package, so plugin costs can be read against the plugin table.
+"""
+from array import array
+from dataclasses import dataclass, field
+import re
+
+from healthcheck.accesslog import read_lines, percentile, normalise_endpoint
+from healthcheck.supportzip import PROFILER_LOGS
+
+TOP_REQUESTS = 5
+TOP_OPERATIONS = 5
+#longer operation names (SQL, command lines) are cut to keep them readable
+MAX_NAME_LENGTH = 100
+
+_NODE = re.compile(r'^(\s*)\[([0-9.]+)\s*(ms|s|us|µs)\]\s+-\s+(.*?)\s*$')
+_HEADER = re.compile(r'^\d{4}-\d\d-\d\d[ T]\d\d:\d\d:\d\d')
+_SQL_LITERAL = re.compile(r"'[^']*'|\b\d+\b")
+_UNITS = {'ms': 1.0, 's': 1000.0, 'us': 0.001, 'µs': 0.001}
+
+
+@dataclass
+class ProfilerStats:
+    files: int = 0
+    requests: int = 0
+    #[(request type, count, total ms, p99 ms, max ms)], by total time
+    slow_requests: list = field(default_factory=list)
+    #[(operation, count, total ms, p99 ms)], by total time
+    operations: list = field(default_factory=list)
+    #[(plugin key, plugin name, plugin version, count, total ms, p99 ms)], by total time
+    plugins: list = field(default_factory=list)
+
+
+def operation_name(name):
+    """Collapse an operation so that repeated calls group together, e.g. 'git rev-list' or SQL without its literals."""
+    if name.startswith('"') or name.startswith('SSH '):
+        return normalise_endpoint(name)
+    words = name.split()
+    if words and words[0].rsplit('/', 1)[-1] == 'git':
+        return 'git ' + next((word for word in words[1:] if not word.startswith('-')), '')
+    if words and words[0].lower() in ('select', 'insert', 'update', 'delete'):
+        name = _SQL_LITERAL.sub('?', name)
+    else:
+        name = name.split('(', 1)[0]
+    return name[:MAX_NAME_LENGTH]
+
+
+def parse(lines):
+    """Yield (depth, name, duration ms, ancestor names) for every node of every timing tree, parents first."""
+    #[(indent, operation name)] of the current branch
+    stack = []
+    for line in lines:
+        if _HEADER.match(line):
+            stack = []
+            #some versions put the root of the tree at the end of the header line
+            match = _NODE.match(line.rsplit(' | ', 1)[-1])
+            if match is None:
+                continue
+            indent = -1
+        else:
+            match = _NODE.match(line)
+            if match is None:
+                continue
+            indent = len(match.group(1))
+        while stack and stack[-1][0] >= indent:
+            stack.pop()
+        name = operation_name(match.group(4))
+        yield len(stack), name, float(match.group(2)) * _UNITS[match.group(3)], [ancestor for _, ancestor in stack]
+        stack.append((indent, name))
+
+
+def plugin_prefixes(plugins):
+    """(package prefix, plugin) for the user installed plugins, longest prefix first."""
+    prefixes = []
+    for plugin in plugins or []:
+        key = plugin.get('key')
+        if not key or plugin.get('user-installed') != 'true':
+            continue
+        prefixes.append((key + '.', plugin))
+        #plugin keys are usually groupId.artifactId, and classes often live under the groupId; too short a
+        #groupId (or Atlassian's own) would claim classes that aren't the plugin's
+        group = key.rsplit('.', 1)[0]
+        if group.count('.') >= 2 and not group.startswith('com.atlassian.'):
+            prefixes.append((group + '.', plugin))
+    prefixes.sort(key=lambda item: -len(item[0]))
+    return prefixes
+
+
+def _plugin_for(name, prefixes):
+    for prefix, plugin in prefixes:
+        if name.startswith(prefix):
+            return plugin
+    return None
+
+
+def _ranked(durations, top):
+    ranked = []
+    for name, values in durations.items():
+        ordered = sorted(values)
+        ranked.append((name, len(values), sum(values), percentile(ordered, 99), ordered[-1]))
+    ranked.sort(key=lambda item: (-item[2], item[0]))
+    return ranked[:top]
+
+
+def analyse(nodes, plugins=None, files=0):
+    stats = ProfilerStats(files=files)
+    prefixes = plugin_prefixes(plugins)
+    requests = {}
+    operations = {}
+    pluginTimes = {}
+    pluginInfo = {}
+
+    for depth, name, duration, ancestors in nodes:
+        if depth == 0:
+            stats.requests += 1
+            requests.setdefault(name, array('d')).append(duration)
+            continue
+        #recursive calls would otherwise be counted once per level
+        if name not in ancestors:
+            operations.setdefault(name, array('d')).append(duration)
+        plugin = _plugin_for(name, prefixes)
+        #only the outermost call into a plugin is its cost; deeper calls are already inside it
+        if plugin is not None and not any(_plugin_for(ancestor, prefixes) is plugin for ancestor in ancestors):
+            pluginTimes.setdefault(plugin['key'], array('d')).append(duration)
+            pluginInfo[plugin['key']] = plugin
+
+    stats.slow_requests = _ranked(requests, TOP_REQUESTS)
+    stats.operations = [item[:4] for item in _ranked(operations, TOP_OPERATIONS)]
+    stats.plugins = [(key, pluginInfo[key].get('name'), pluginInfo[key].get('version'), count, total, p99)
+                     for key, count, total, p99, _ in _ranked(pluginTimes, len(pluginTimes))]
+    return stats
+
+
+def merge_plugins(statsList):
+    """Plugin costs summed over every node: [(key, name, version, count, total ms, worst node p99 ms)]."""
+    merged = {}
+    for stats in statsList:
+        if stats is None:
+            continue
+        for key, name, pluginVersion, count, total, p99 in stats.plugins:
+            if key in merged:
+                _, _, _, seen, spent, worst = merged[key]
+                merged[key] = (key, name, pluginVersion, seen + count, spent + total, max(worst, p99))
+            else:
+                merged[key] = (key, name, pluginVersion, count, total, p99)
+    return sorted(merged.values(), key=lambda item: (-item[4], item[0]))
+
+
+def analyse_source(source, plugins=None):
+    """Analyse every profiler log in a support zip; None if it has none."""
+    names = source.files(PROFILER_LOGS)
+    if not names:
+        return None
+    return analyse(parse(read_lines(source, names)), plugins, files=len(names))
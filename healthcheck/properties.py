@@ -0,0 +1,258 @@
+"""bitbucket.properties parsing and hosting ticket / connection pool sizing.
+
+parse_properties() reads the Java properties format (comments, line
+continuations, ':' or '=' separators and escapes). BitbucketProperties
+wraps the result with Bitbucket's defaults and typed accessors, including
+the 'cpu' expressions Bitbucket accepts for counts (e.g. '12*cpu').
+
+size_node() checks a node's throttling, executor and database pool
+settings against its processors and physical memory, and returns the
+findings for the report.
+"""
+from dataclasses import dataclass, field
+import re
+
+from healthcheck.jvmargs import parse_jvm_args, worst_status
+from healthcheck.units import parse_size, format_size
+
+#Bitbucket's defaults for the settings checked here
+DEFAULTS = {
+    'throttle.resource.scm-hosting.strategy': 'adaptive',
+    'throttle.resource.scm-hosting.adaptive.limit.min': '1*cpu',
+    'throttle.resource.scm-hosting.adaptive.limit.max': '12*cpu',
+    'throttle.resource.scm-hosting.fixed.limit': '1.5*cpu',
+    'throttle.resource.scm-hosting.timeout': '300',
+    'scaling.concurrency': 'cpu',
+    'executor.max.threads': '${scaling.concurrency}',
+    'db.pool.size.max': '80',
+    'hazelcast.network.multicast': 'false',
+    'hazelcast.network.tcpip': 'false',
+}
+
+#rough memory needed by one git process serving a clone or fetch, and what's left aside for the OS
+MEMORY_PER_GIT_PROCESS = 256 * 1024**2
+OS_RESERVED_MEMORY = 1024**3
+
+_COUNT = re.compile(r'^\s*(?:([0-9.]+)\s*\*\s*)?cpu(?:\s*\*\s*([0-9.]+))?\s*$|^\s*([0-9.]+)\s*$', re.IGNORECASE)
+_REFERENCE = re.compile(r'\$\{([^}]+)\}')
+
+
+def _unescape(text):
+    out = []
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == '\\' and i + 1 < len(text):
+            nxt = text[i + 1]
+            if nxt == 'u' and i + 6 <= len(text):
+                try:
+                    out.append(chr(int(text[i + 2:i + 6], 16)))
+                    i += 6
+                    continue
+                except ValueError:
+                    pass
+            out.append({'t': '\t', 'n': '\n', 'r': '\r', 'f': '\f'}.get(nxt, nxt))
+            i += 2
+            continue
+        out.append(char)
+        i += 1
+    return ''.join(out)
+
+
+def _logical_lines(text):
+    #a line ending in an odd number of backslashes continues on the next one
+    pending = ''
+    for line in text.splitlines():
+        line = line.lstrip()
+        if not pending and (not line or line[0] in '#!'):
+            continue
+        trailing = len(line) - len(line.rstrip('\\'))
+        if trailing % 2 == 1:
+            pending += line[:-1]
+            continue
+        yield pending + line
+        pending = ''
+    if pending:
+        yield pending
+
+
+def parse_properties(text):
+    """Parse Java properties text into an ordered {key: value} dict of strings."""
+    values = {}
+    for line in _logical_lines(text):
+        #the key ends at the first unescaped '=', ':' or whitespace
+        i = 0
+        while i < len(line):
+            if line[i] == '\\':
+                i += 2
+                continue
+            if line[i] in '=: \t\f':
+                break
+            i += 1
+        key = line[:i]
+        rest = line[i:].lstrip(' \t\f')
+        if rest[:1] in ('=', ':'):
+            rest = rest[1:].lstrip(' \t\f')
+        values[_unescape(key)] = _unescape(rest)
+    return values
+
+
+def typed_value(text):
+    """Convert a property value to bool, int or float where it clearly is one."""
+    lowered = text.strip().lower()
+    if lowered in ('true', 'false'):
+        return lowered == 'true'
+    for convert in (int, float):
+        try:
+            return convert(lowered)
+        except ValueError:
+            pass
+    return text.strip()
+
+
+def resolve_count(text, cpus):
+    """Evaluate a count such as '80', 'cpu', '1.5*cpu' or '12*cpu' for a node with the given processors."""
+    if text is None:
+        return None
+    match = _COUNT.match(text)
+    if match is None:
+        return None
+    if match.group(3) is not None:
+        return int(float(match.group(3)))
+    factor = float(match.group(1) or match.group(2) or 1)
+    return max(1, int(factor * cpus))
+
+
+class BitbucketProperties:
+    """One node's bitbucket.properties, falling back to Bitbucket's defaults."""
+
+    def __init__(self, values=None):
+        self.values = dict(values or {})
+
+    @classmethod
+    def from_text(cls, text):
+        return cls(parse_properties(text) if text else {})
+
+    def is_set(self, key):
+        return key in self.values
+
+    def get(self, key):
+        value = self.values.get(key, DEFAULTS.get(key))
+        #resolve ${other.key} references, as Bitbucket does
+        for _ in range(5):
+            if value is None or '${' not in value:
+                break
+            value = _REFERENCE.sub(lambda match: self.values.get(match.group(1), DEFAULTS.get(match.group(1), '')), value)
+        return value
+
+    def boolean(self, key):
+        return str(self.get(key)).strip().lower() == 'true'
+
+    def count(self, key, cpus):
+        return resolve_count(self.get(key), cpus)
+
+    def typed(self):
+        return {key: typed_value(value) for key, value in self.values.items()}
+
+
+@dataclass
+class Sizing:
+    #[(label, value)] describing the effective settings
+    summary: list = field(default_factory=list)
+    #[(status, message)] where status is one of the report icons, e.g. '(!)'
+    findings: list = field(default_factory=list)
+
+    @property
+    def status(self):
+        return worst_status(self.findings)
+
+
+def _setting(props, key, value):
+    return str(value) + ('' if props.is_set(key) else ' (default)')
+
+
+def size_node(node):
+    """Check one node's throttling and pool settings against its hardware."""
+    props = BitbucketProperties.from_text(node.properties)
+    sizing = Sizing()
+    if node.properties is None:
+        sizing.summary.append(('bitbucket.properties', 'not in support zip, defaults assumed'))
+    try:
+        cpus = int(node.os['available-processors'])
+    except (TypeError, KeyError, ValueError):
+        sizing.findings.append(('(?)', "Couldn't read the number of processors from application.xml"))
+        return sizing
+    memory = parse_size((node.os or {}).get('total-physical-memory'))
+    heap = parse_jvm_args((node.jvm or {}).get('virtual-machine-arguments')).heap_max
+    sizing.summary.append(('Processors / Memory / Max heap', str(cpus)+' / '+format_size(memory)+' / '+format_size(heap)))
+
+    #SCM hosting tickets: one per concurrent clone, fetch or push
+    fixed = props.get('throttle.resource.scm-hosting.strategy').strip().lower() == 'fixed' or props.is_set('throttle.resource.scm-hosting')
+    if fixed:
+        key = 'throttle.resource.scm-hosting' if props.is_set('throttle.resource.scm-hosting') else 'throttle.resource.scm-hosting.fixed.limit'
+        tickets = props.count(key, cpus)
+        sizing.summary.append(('SCM hosting tickets', 'fixed, '+_setting(props, key, tickets)))
+        if tickets is None:
+            sizing.findings.append(('(?)', "Couldn't interpret "+key+"="+str(props.get(key))))
+            return sizing
+        if tickets < cpus:
+            sizing.findings.append(('(!)', "Only "+str(tickets)+" SCM hosting tickets for "+str(cpus)+" processors. Clones and fetches will queue under load, "
+                                    "and are rejected after throttle.resource.scm-hosting.timeout. Consider the adaptive strategy."))
+        peak = tickets
+    else:
+        low = props.count('throttle.resource.scm-hosting.adaptive.limit.min', cpus)
+        high = props.count('throttle.resource.scm-hosting.adaptive.limit.max', cpus)
+        sizing.summary.append(('SCM hosting tickets', 'adaptive, '+_setting(props, 'throttle.resource.scm-hosting.adaptive.limit.min', low)
+                               +' to '+_setting(props, 'throttle.resource.scm-hosting.adaptive.limit.max', high)))
+        if low is None or high is None:
+            sizing.findings.append(('(?)', "Couldn't interpret the adaptive throttling limits"))
+            return sizing
+        if low > high:
+            sizing.findings.append(('(x)', "throttle.resource.scm-hosting.adaptive.limit.min ("+str(low)+") is above limit.max ("+str(high)+")"))
+        if high < cpus:
+            sizing.findings.append(('(!)', "The adaptive throttle can't go above "+str(high)+" SCM hosting tickets on "+str(cpus)+" processors, so SCM operations will queue under load"))
+        #the adaptive throttle only hands out tickets above limit.min while the node has CPU and memory to spare,
+        #so limit.min is what the node has to cope with; limit.max is its ceiling, not a load it will take regardless
+        peak = low
+
+    if memory is not None and peak:
+        spare = memory - (heap or 0) - OS_RESERVED_MEMORY
+        needed = peak * MEMORY_PER_GIT_PROCESS
+        if not fixed and high * MEMORY_PER_GIT_PROCESS > spare:
+            sizing.summary.append(('Git memory at limit.max', format_size(high * MEMORY_PER_GIT_PROCESS)+' for '+str(high)
+                                   +' git processes, more than the '+format_size(max(spare, 0))+' left; the adaptive throttle holds tickets back before then'))
+        if needed > spare:
+            sizing.findings.append(('(x)' if fixed else '(!)', str(peak)+" concurrent git processes could need around "+format_size(needed)
+                                    +", but only "+format_size(max(spare, 0))+" is left after the heap and the OS. Expect swapping or out of memory errors at peak load."))
+
+    timeout = props.count('throttle.resource.scm-hosting.timeout', cpus)
+    if timeout is not None and timeout < 60:
+        sizing.findings.append(('(!)', "throttle.resource.scm-hosting.timeout is "+str(timeout)+"s; queued clones and fetches will be rejected quickly when all tickets are in use"))
+
+    #every SCM operation and executor thread can hold a database connection at the same time
+    executor = props.count('executor.max.threads', cpus) or 0
+    pool = props.count('db.pool.size.max', cpus)
+    sizing.summary.append(('Executor threads', _setting(props, 'executor.max.threads', executor)))
+    sizing.summary.append(('DB pool size', _setting(props, 'db.pool.size.max', pool)))
+    if pool is not None and pool < peak + executor:
+        sizing.findings.append(('(!)', "db.pool.size.max is "+str(pool)+" but up to "+str(peak)+" SCM operations and "+str(executor)
+                                +" executor threads can need a connection at once. Requests will wait for database connections under load."))
+
+    concurrency = props.count('scaling.concurrency', cpus)
+    if concurrency is not None and concurrency > 4 * cpus:
+        sizing.findings.append(('(!)', "scaling.concurrency is "+str(concurrency)+" on "+str(cpus)+" processors, which oversubscribes the CPUs"))
+
+    #containerised nodes are often configured through the environment instead, so only check what the file says
+    if node.clustered and node.properties is not None:
+        if props.boolean('hazelcast.network.multicast'):
+            sizing.findings.append(('(!)', "Hazelcast uses multicast discovery; TCP/IP (hazelcast.network.tcpip) is recommended for production clusters"))
+        elif props.boolean('hazelcast.network.tcpip'):
+            members = [member for member in (props.get('hazelcast.network.tcpip.members') or '').split(',') if member.strip()]
+            if len(members) < len(node.cluster_nodes):
+                sizing.findings.append(('(!)', "hazelcast.network.tcpip.members lists "+str(len(members))+" members but the cluster has "+str(len(node.cluster_nodes))+" nodes"))
+        if not props.is_set('hazelcast.group.name'):
+            sizing.findings.append(('(?)', "hazelcast.group.name isn't set in bitbucket.properties"))
+
+    if not sizing.findings:
+        sizing.findings.append(('(/)', "Hosting tickets and connection pool are sized appropriately for "+str(cpus)+" processors"))
+    return sizing
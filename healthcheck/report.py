@@ -0,0 +1,380 @@
+"""The health check report as data, and renderers for it.
+
+Each check (healthcheck.checks) gives Rows for the Report: a label, status icon, the
+text of the value cell, any per-node Panels, and the values behind them
+(values) for anything reading the report as JSON. Text is written in Jira
+wiki markup, as the report always has been; the Markdown and HTML
+renderers translate the small part of it the checks use (bold, {{code}},
+links, lists, tables, {code} blocks and headings).
+
+Each renderer returns the whole document as a list of strings, which
+write_report() writes in one go, so rendering a cached analysis in
+another format only takes the time to build the strings.
+"""
+from dataclasses import dataclass, field, asdict
+import html
+import json
+import re
+
+from healthcheck.defaults import REPORT_FORMATS
+
+FORMATS = REPORT_FORMATS
+#file extension of each format, for reports written to disk
+EXTENSIONS = {'jira': 'txt', 'markdown': 'md', 'json': 'json', 'html': 'html'}
+
+PANEL_STYLES = {
+    'blue': 'borderStyle=dashed|borderColor=#3C78B5|titleBGColor=#3C78B5|bgColor=#E7F4FA',
+    'green': 'borderStyle=dashed|borderColor=#3cb579|titleBGColor=#3cabb5|bgColor=#ccffcc',
+    'purple': 'borderStyle=dashed|borderColor=#3C78B5|titleBGColor=#8587FB|bgColor=#E3E4FF',
+    'important': 'borderStyle=solid|borderColor=#FF0000|titleBGColor=#FF0000|titleColor=#FFFF00|bgColor=#E7F4FA',
+}
+STATUS_NAMES = {'(/)': 'ok', '(!)': 'warning', '(x)': 'error', '(?)': 'unknown'}
+STATUS_EMOJI = {'(/)': '\u2705', '(!)': '\u26a0\ufe0f', '(x)': '\u274c', '(?)': '\u2753'}
+
+
+@dataclass
+class Panel:
+    title: str
+    text: str = ''
+    status: str = None
+    style: str = 'blue'
+    values: dict = field(default_factory=dict)
+
+
+@dataclass
+class Row:
+    label: str
+    text: str = ''
+    status: str = None
+    panels: list = field(default_factory=list)
+    #lines listed under the label, e.g. the names of the fields in the value cell
+    sublabels: list = field(default_factory=list)
+    values: dict = field(default_factory=dict)
+    #set by details_row(): the text lists one value for each sublabel
+    details: bool = False
+
+
+@dataclass
+class Block:
+    """Markup outside the table, e.g. the plugin panels of -p."""
+    text: str = ''
+    panels: list = field(default_factory=list)
+
+
+@dataclass
+class Report:
+    title: str = 'Health Check'
+    disclaimer: str = ''
+    #[(status, meaning)]
+    legend: list = field(default_factory=list)
+    items: list = field(default_factory=list)
+
+    def add(self, item):
+        self.items.append(item)
+        return item
+
+
+_JIRA_SPECIAL = re.compile(r'[|*{}\[\]]')
+
+
+def escape_jira(text):
+    """text with the characters Jira reads as markup (tables, bold, macros and links) escaped."""
+    return _JIRA_SPECIAL.sub(r'\\\g<0>', str(text))
+
+
+def details_row(label, details, values=None):
+    """A Row listing (name, value) pairs, names under the label and values in the cell."""
+    return Row(label, "*Values*" + "".join("\n* " + str(value) for name, value in details),
+               sublabels=[name for name, value in details], values=values if values is not None else dict(details), details=True)
+
+
+#### Jira
+
+def _jira_panel(panel):
+    title = (panel.status + " " if panel.status else "") + panel.title
+    text = panel.text if panel.text.endswith("\n") or not panel.text else panel.text + "\n"
+    return "{panel:title=" + title + "|" + PANEL_STYLES[panel.style] + "}\n" + text + "{panel}\n"
+
+
+def render_jira(report):
+    out = [_jira_panel(Panel("(!) Important:", report.disclaimer, style='important')),
+           "h6.\n----\nh2. " + report.title + "\n"]
+    out.extend(status + " " + meaning + "\n" for status, meaning in report.legend)
+    out.append("h6.\n||Configurations & Settings||Values||\n")
+    for item in report.items:
+        if isinstance(item, Row):
+            label = "\n".join("*" + line + "*" for line in item.label.split("\n")) + "".join("\n* " + line for line in item.sublabels)
+            out.append("|" + label + "|" + (item.status + " " if item.status else "") + item.text)
+            out.extend(_jira_panel(panel) for panel in item.panels)
+            out.append("|\n")
+        else:
+            out.append("\n" + item.text)
+            out.extend(_jira_panel(panel) for panel in item.panels)
+    return out
+
+
+#### Jira markup to Markdown and HTML
+
+_CODE = re.compile(r'\{code\}(.*?)\{code\}', re.DOTALL)
+_LIST = re.compile(r'^([*#]+) (.*)$')
+_HEADING = re.compile(r'^h([1-6])\.\s*(.*)$')
+_ESCAPED = re.compile(r'\\([|*{}_\[\]])')
+_MONOSPACE = re.compile(r'\{\{(.+?)\}\}')
+_LINK = re.compile(r'\[([^\]|]+)\|([^\]]+)\]')
+_BOLD = re.compile(r'(?<![\w*])\*(?=\S)([^*\n]+?)(?<=\S)\*(?![\w*])')
+_ITALIC = re.compile(r'(?<![\w_])_(?=\S)([^_\n]+?)(?<=\S)_(?![\w_])')
+_ICON = re.compile(r'\((?:/|!|x|\?)\)')
+#escaped characters are swapped for private use characters while the markup is translated
+_PLACEHOLDER = 0xE000
+
+
+def _split_cells(line):
+    """The cells of a Jira table row, ignoring | in links and escaped \\|."""
+    cells, current, depth, i = [], '', 0, 0
+    while i < len(line):
+        char = line[i]
+        if char == '\\' and i + 1 < len(line):
+            current += line[i:i + 2]
+            i += 2
+            continue
+        if char == '[':
+            depth += 1
+        elif char == ']' and depth:
+            depth -= 1
+        elif char == '|' and depth == 0:
+            cells.append(current)
+            current = ''
+            i += 1
+            continue
+        current += char
+        i += 1
+    cells.append(current)
+    return [cell.strip() for cell in cells if cell.strip() != ''] if line.startswith('||') else [cell.strip() for cell in cells[1:-1]]
+
+
+def parse_markup(text):
+    """The blocks of some Jira markup: ('heading', level, text), ('rule',), ('code', text),
+    ('list', [(depth, ordered, text)]), ('table', [[header cells], [cells], ...]) and ('text', [lines])."""
+    blocks = []
+    #untitled {panel} wrappers (around plugin tables) only matter in Jira
+    for index, part in enumerate(_CODE.split(text.replace('{panel}', '\n'))):
+        if index % 2:
+            blocks.append(('code', part.strip('\n')))
+            continue
+        for line in part.split('\n'):
+            line = line.rstrip()
+            heading = _HEADING.match(line)
+            listed = _LIST.match(line)
+            last = blocks[-1] if blocks else None
+            if not line.strip():
+                blocks.append(('break',))
+            elif heading:
+                if heading.group(2):
+                    blocks.append(('heading', int(heading.group(1)), heading.group(2)))
+            elif line.strip() == '----':
+                blocks.append(('rule',))
+            elif listed:
+                entry = (len(listed.group(1)), listed.group(1)[-1] == '#', listed.group(2))
+                if last and last[0] == 'list':
+                    last[1].append(entry)
+                else:
+                    blocks.append(('list', [entry]))
+            elif line.startswith('|') and line.endswith('|') and len(line) > 1:
+                cells = _split_cells(line)
+                if last and last[0] == 'table' and not line.startswith('||'):
+                    last[1].append(cells)
+                elif line.startswith('||'):
+                    blocks.append(('table', [cells]))
+                else:
+                    blocks.append(('table', [[''] * len(cells), cells]))
+            elif last and last[0] == 'text':
+                last[1].append(line)
+            else:
+                blocks.append(('text', [line]))
+    return [block for block in blocks if block[0] != 'break']
+
+
+def _protect(text):
+    return _ESCAPED.sub(lambda match: chr(_PLACEHOLDER + ord(match.group(1))), text)
+
+
+def _restore(text, escape):
+    return re.sub('[\ue000-\ue0ff]', lambda match: escape(chr(ord(match.group(0)) - _PLACEHOLDER)), text)
+
+
+def inline_markdown(text):
+    text = _protect(text)
+    text = _MONOSPACE.sub(lambda match: '`' + match.group(1) + '`', text)
+    text = _LINK.sub(r'[\1](\2)', text)
+    text = _BOLD.sub(r'**\1**', text)
+    text = _ICON.sub(lambda match: STATUS_EMOJI[match.group(0)], text)
+    return _restore(text, lambda char: '\\' + char)
+
+
+def inline_html(text):
+    text = html.escape(_protect(text), quote=False)
+    text = _MONOSPACE.sub(r'<code>\1</code>', text)
+    #the whole text is escaped already, and quote=False leaves the href's quotes alone
+    text = _LINK.sub(lambda match: '<a href="' + match.group(2).replace('"', '&quot;') + '">' + match.group(1) + '</a>', text)
+    text = _BOLD.sub(r'<b>\1</b>', text)
+    text = _ITALIC.sub(r'<i>\1</i>', text)
+    text = _ICON.sub(lambda match: '<span class="status ' + STATUS_NAMES[match.group(0)] + '">' + STATUS_EMOJI[match.group(0)] + '</span>', text)
+    return _restore(text, html.escape)
+
+
+def markup_markdown(text):
+    out = []
+    for block in parse_markup(text):
+        kind = block[0]
+        if kind == 'heading':
+            out.append('#' * block[1] + ' ' + inline_markdown(block[2]))
+        elif kind == 'rule':
+            out.append('---')
+        elif kind == 'code':
+            out.append('```\n' + block[1] + '\n```')
+        elif kind == 'list':
+            out.append('\n'.join('  ' * (depth - 1) + ('1. ' if ordered else '- ') + inline_markdown(item) for depth, ordered, item in block[1]))
+        elif kind == 'table':
+            rows = [[inline_markdown(cell).replace('|', '\\|') for cell in cells] for cells in block[1]]
+            width = max(len(cells) for cells in rows)
+            rows = [cells + [''] * (width - len(cells)) for cells in rows]
+            lines = ['| ' + ' | '.join(rows[0]) + ' |', '|' + '---|' * width]
+            out.append('\n'.join(lines + ['| ' + ' | '.join(cells) + ' |' for cells in rows[1:]]))
+        else:
+            out.append('  \n'.join(inline_markdown(line) for line in block[1]))
+    return '\n\n'.join(out) + '\n' if out else ''
+
+
+def markup_html(text):
+    out = []
+    for block in parse_markup(text):
+        kind = block[0]
+        if kind == 'heading':
+            out.append('<h%d>%s</h%d>' % (block[1], inline_html(block[2]), block[1]))
+        elif kind == 'rule':
+            out.append('<hr>')
+        elif kind == 'code':
+            out.append('<pre>' + html.escape(block[1]) + '</pre>')
+        elif kind == 'list':
+            #nested lists are opened and closed as the depth changes
+            stack = []
+            for depth, ordered, item in block[1]:
+                while len(stack) > depth:
+                    out.append('</li></' + stack.pop() + '>')
+                if len(stack) == depth:
+                    out.append('</li>')
+                while len(stack) < depth:
+                    stack.append('ol' if ordered else 'ul')
+                    out.append('<' + stack[-1] + '>')
+                out.append('<li>' + inline_html(item))
+            while stack:
+                out.append('</li></' + stack.pop() + '>')
+        elif kind == 'table':
+            header, rows = block[1][0], block[1][1:]
+            out.append('<table>' + ('<tr>' + ''.join('<th>' + inline_html(cell) + '</th>' for cell in header) + '</tr>' if any(header) else '')
+                       + ''.join('<tr>' + ''.join('<td>' + inline_html(cell) + '</td>' for cell in cells) + '</tr>' for cells in rows) + '</table>')
+        else:
+            out.append('<p>' + '<br>\n'.join(inline_html(line) for line in block[1]) + '</p>')
+    return '\n'.join(out)
+
+
+#### Markdown
+
+def _plain_label(item):
+    label = ' '.join(line.strip() for line in item.label.split('\n'))
+    #the sublabels of a details row name its table rows, any others go with the label
+    return label + (' (' + ', '.join(item.sublabels) + ')' if item.sublabels and not item.details else '')
+
+
+def _markdown_panel(panel, level):
+    title = (STATUS_EMOJI[panel.status] + ' ' if panel.status in STATUS_EMOJI else '') + inline_markdown(panel.title)
+    return '#' * level + ' ' + title + '\n\n' + markup_markdown(panel.text) + '\n'
+
+
+def render_markdown(report):
+    out = ['# ' + report.title + '\n\n', '> ' + report.disclaimer + '\n\n']
+    out.extend('- ' + STATUS_EMOJI[status] + ' ' + meaning + '\n' for status, meaning in report.legend)
+    out.append('\n')
+    for item in report.items:
+        if isinstance(item, Row):
+            out.append('## ' + (STATUS_EMOJI[item.status] + ' ' if item.status in STATUS_EMOJI else '') + inline_markdown(_plain_label(item)) + '\n\n')
+            if item.details:
+                #a details row reads better as a two column table
+                values = item.text.split('\n* ')[1:]
+                out.append('| | |\n|---|---|\n' + ''.join('| ' + name + ' | ' + inline_markdown(value).replace('|', '\\|') + ' |\n'
+                                                        for name, value in zip(item.sublabels, values)) + '\n')
+            elif item.text.strip():
+                out.append(markup_markdown(item.text) + '\n')
+            out.extend(_markdown_panel(panel, 3) for panel in item.panels)
+        else:
+            if item.text.strip():
+                out.append(markup_markdown(item.text) + '\n')
+            out.extend(_markdown_panel(panel, 2) for panel in item.panels)
+    return out
+
+
+#### HTML
+
+_HTML_STYLE = """body { font-family: sans-serif; max-width: 70em; margin: 2em auto; color: #172b4d; }
+section { border-top: 1px solid #dfe1e6; padding: 0.5em 0; }
+.panel { border: 1px dashed #3C78B5; background: #E7F4FA; margin: 0.5em 0; padding: 0 0.8em 0.5em; }
+.panel.green { border-color: #3cb579; background: #ccffcc; }
+.panel.purple { background: #E3E4FF; }
+.panel.important { border: 1px solid #FF0000; }
+.panel h4 { margin: 0.5em 0; }
+table { border-collapse: collapse; }
+td, th { border: 1px solid #c1c7d0; padding: 0.2em 0.5em; text-align: left; vertical-align: top; }
+pre { background: #f4f5f7; padding: 0.5em; overflow-x: auto; }
+"""
+
+
+def _html_panel(panel):
+    title = (inline_html(panel.status) + ' ' if panel.status else '') + inline_html(panel.title)
+    return '<div class="panel ' + panel.style + '"><h4>' + title + '</h4>\n' + markup_html(panel.text) + '</div>\n'
+
+
+def render_html(report):
+    out = ['<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>' + html.escape(report.title) + '</title>\n<style>\n' + _HTML_STYLE + '</style></head><body>\n',
+           '<h1>' + html.escape(report.title) + '</h1>\n', _html_panel(Panel("(!) Important:", report.disclaimer, style='important')),
+           '<ul>' + ''.join('<li>' + inline_html(status) + ' ' + html.escape(meaning) + '</li>' for status, meaning in report.legend) + '</ul>\n']
+    for item in report.items:
+        out.append('<section>\n')
+        if isinstance(item, Row):
+            out.append('<h3>' + (inline_html(item.status) + ' ' if item.status else '') + inline_html(_plain_label(item)) + '</h3>\n')
+            if item.details:
+                values = item.text.split('\n* ')[1:]
+                out.append('<table>' + ''.join('<tr><th>' + html.escape(name) + '</th><td>' + inline_html(value) + '</td></tr>'
+                                               for name, value in zip(item.sublabels, values)) + '</table>\n')
+            elif item.text.strip():
+                out.append(markup_html(item.text) + '\n')
+        elif item.text.strip():
+            out.append(markup_html(item.text) + '\n')
+        out.extend(_html_panel(panel) for panel in item.panels)
+        out.append('</section>\n')
+    out.append('</body></html>\n')
+    return out
+
+
+#### JSON
+
+def _plain(item):
+    data = asdict(item)
+    data['type'] = type(item).__name__.lower()
+    if getattr(item, 'status', None):
+        data['status_name'] = STATUS_NAMES.get(item.status)
+    return data
+
+
+def render_json(report):
+    data = {'title': report.title, 'disclaimer': report.disclaimer, 'legend': [{'status': status, 'meaning': meaning} for status, meaning in report.legend],
+            'items': [_plain(item) for item in report.items]}
+    return [json.dumps(data, indent=2, default=str), '\n']
+
+
+RENDERERS = {'jira': render_jira, 'markdown': render_markdown, 'json': render_json, 'html': render_html}
+
+
+def write_report(report, out, format='jira'):
+    """Render the report and write it to out with a single write."""
+    out.write(''.join(RENDERERS[format](report)))
+    out.flush()
@@ -0,0 +1,176 @@
+"""Registered checks, the inputs they read, and running them.
+
+Every check of the report is a function registered with @rule under a
+name (for --only and --skip), a label (for the report row if it fails)
+and the inputs it reads, from INPUTS. Only the inputs of the checks that
+run are loaded: --only git, say, skips every log analyser, the metrics
+history and Marketplace. application.xml and bitbucket.properties are
+small and always read.
+
+run_rules() runs the checks in threads, one per check. The nodes are
+only read, so checks share them freely; an input in EXCLUSIVE_INPUTS
+changes process wide state (plugin_checker redirects stdout), so checks
+needing one run one at a time. Each check has a time limit. A check that
+raises, or takes longer than its limit, becomes a (?) row saying so
+rather than ending the run; one that overran is left to finish in the
+background, as threads can't be stopped, and whatever it returns is
+dropped. Outcomes are returned in the order the checks were given, so
+the report doesn't depend on which one finished first.
+"""
+from collections import OrderedDict, namedtuple
+import contextlib
+from dataclasses import dataclass, field
+import logging
+import queue
+import threading
+import time
+
+from healthcheck.ingest import ANALYSED_LOGS
+from healthcheck.report import Row, escape_jira
+from healthcheck.timing import Timings
+
+INPUTS = OrderedDict([
+    ('application.xml', "each support zip's application.xml"),
+    ('properties', "each support zip's bitbucket.properties"),
+    ('access-logs', 'access logs'),
+    ('thread-dumps', 'thread dumps'),
+    ('gc-logs', 'GC logs'),
+    ('profiler-logs', 'profiler logs'),
+    ('app-logs', 'application logs (atlassian-bitbucket.log*)'),
+    ('history', 'the metrics history of earlier runs'),
+    ('marketplace', 'the plugin catalog and Marketplace'),
+    ('plugin-checker', 'the plugin_checker submodule'),
+])
+#checks needing one of these never run at the same time
+EXCLUSIVE_INPUTS = ('plugin-checker',)
+#seconds a check may take unless it says otherwise
+DEFAULT_TIMEOUT = 60
+
+#default is False for checks that only run when asked for, by name or with their own option
+Rule = namedtuple('Rule', 'name label needs check timeout default')
+#items are the report items of the check (a (?) row if it failed), error why it failed, if it did, and timings its PhaseTimings when profiling
+Outcome = namedtuple('Outcome', 'rule items error timings')
+
+RULES = OrderedDict()
+
+
+@dataclass
+class CheckContext:
+    """What the checks read. The first node stands for the cluster where a setting is cluster wide."""
+    nodes: list
+    sources: list = field(default_factory=list)
+    #analysis cache key of each node, for checks that cache their own results
+    node_keys: list = field(default_factory=list)
+    options: object = None
+    cache: object = None
+    #{node: {metric: [(taken, value)]}} from the metrics history, if it was read
+    series: dict = field(default_factory=dict)
+    #check_plugins() of health.py, as the plugin_checker submodule lives next to it
+    plugin_checker: object = None
+
+
+def rule(name, label, needs=('application.xml',), timeout=DEFAULT_TIMEOUT, default=True):
+    """Register the decorated function(context) as a check. It returns a report item, a list of them, or None."""
+    unknown = [need for need in needs if need not in INPUTS]
+    if unknown:
+        raise ValueError("Unknown input(s) for check "+name+": "+", ".join(unknown))
+
+    def register(check):
+        RULES[name] = Rule(name, label, tuple(needs), check, timeout, default)
+        return check
+    return register
+
+
+def select(only=None, skip=None, extra=()):
+    """The checks to run, in registration order: those in only (or every default one) and extra, less those in skip.
+
+    Raises ValueError naming any check that isn't registered.
+    """
+    unknown = [name for name in list(only or []) + list(skip or []) + list(extra) if name not in RULES]
+    if unknown:
+        raise ValueError("Unknown check(s): "+", ".join(unknown)+". Checks are: "+", ".join(RULES))
+    chosen = set(only) if only else set(name for name, found in RULES.items() if found.default)
+    chosen = (chosen | set(extra)) - set(skip or [])
+    return [found for name, found in RULES.items() if name in chosen]
+
+
+def needed_inputs(rules):
+    return set(need for found in rules for need in found.needs)
+
+
+def wanted_logs(rules):
+    """The log analysers ingest should run for these checks."""
+    needed = needed_inputs(rules)
+    return tuple(name for name in ANALYSED_LOGS if name in needed)
+
+
+def describe():
+    """Every registered check and what it reads, for --list-checks."""
+    width = max(len(name) for name in RULES)
+    return "\n".join(name.ljust(width)+"  "+found.label.replace('\n', ' ')+" ("+", ".join(found.needs)+")"+("" if found.default else ", only when asked for")
+                     for name, found in RULES.items())
+
+
+def _items(result):
+    if result is None:
+        return []
+    return list(result) if isinstance(result, (list, tuple)) else [result]
+
+
+def failed_row(found, error):
+    #for checks that raised or timed out; checks report a missing section of application.xml themselves
+    return Row(found.label, "Couldn't be checked: "+escape_jira(error), "(?)", values={'check': found.name, 'error': error})
+
+
+def run_rules(rules, context, timeout=None, profile=False):
+    """An Outcome for each rule, in the order given. timeout, if given, replaces each rule's own limit (in seconds)."""
+    locks = {name: threading.Lock() for name in EXCLUSIVE_INPUTS}
+    finished = queue.Queue()
+    #when each check got its exclusive inputs and started; its time limit counts from then
+    started = {}
+    limit = lambda found: timeout if timeout is not None else found.timeout
+
+    def work(found):
+        timings = Timings(profile)
+        try:
+            with contextlib.ExitStack() as held:
+                for name in sorted(set(found.needs) & set(locks)):
+                    if not locks[name].acquire(timeout=limit(found)):
+                        raise TimeoutError("waited more than "+str(limit(found))+" s for "+INPUTS[name])
+                    held.callback(locks[name].release)
+                started[found.name] = time.monotonic()
+                with timings.phase('check: '+found.name):
+                    items = _items(found.check(context))
+            finished.put((found.name, items, None, timings.finished()))
+        except Exception as e:
+            logging.debug("Check "+found.name+" failed", exc_info=True)
+            finished.put((found.name, None, str(e) or repr(e), timings.finished()))
+
+    for found in rules:
+        #daemon threads, so a check that never returns doesn't keep the process alive
+        threading.Thread(target=work, args=(found,), name='check-'+found.name, daemon=True).start()
+
+    pending = OrderedDict((found.name, found) for found in rules)
+    outcomes = {}
+    while pending:
+        now = time.monotonic()
+        for name, found in list(pending.items()):
+            if name in started and now - started[name] >= limit(found):
+                logging.warning("Check "+name+" took longer than "+str(limit(found))+" s, it is left out of the report")
+                outcomes[name] = Outcome(found, None, "took longer than "+str(limit(found))+" s", [])
+                del pending[name]
+        if not pending:
+            break
+        #checks that haven't started yet can't time out before their whole limit has passed
+        wait = min(started[name] + limit(found) if name in started else now + limit(found) for name, found in pending.items()) - now
+        try:
+            name, items, error, records = finished.get(timeout=max(wait, 0.01))
+        except queue.Empty:
+            continue
+        if name in pending:
+            if error is not None:
+                logging.warning("Check "+name+" failed: "+error)
+            outcomes[name] = Outcome(pending.pop(name), items, error, records)
+
+    return [outcome._replace(items=[failed_row(outcome.rule, outcome.error)]) if outcome.error is not None else outcome
+            for outcome in (outcomes[found.name] for found in rules)]
@@ -0,0 +1,260 @@
+"""Read-only access to Bitbucket support zips.
+
+A support zip can either be read in place, straight from the archive's
+central directory, or from a folder it was already extracted to. Both
+kinds of source expose the same small API (find/files/open/display_name)
+so the rest of the healthcheck does not need to know which one it is
+reading.
+
+Every source carries a FileIndex of the files the healthcheck cares about,
+built in a single pass: from the zip's member list, or from the same
+scandir traversal that found the extracted folder in the first place.
+"""
+import fnmatch
+import logging
+import os
+import shutil
+import zipfile
+
+APP_XML = 'application-properties/application.xml'
+BB_PROPERTIES = 'application-config/bitbucket.properties'
+
+#categories of files recorded in a FileIndex
+APP_XML_FILES = 'app_xml'
+PROPERTIES_FILES = 'properties'
+APP_LOGS = 'app_log'
+ACCESS_LOGS = 'access_log'
+PROFILER_LOGS = 'profiler_log'
+GC_LOGS = 'gc_log'
+THREAD_DUMPS = 'thread_dump'
+
+GC_LOG_PATTERNS = ('gc-*.log*', 'gc.log*', 'gc_*.log*', 'atlassian-bitbucket-gc*')
+
+
+def _matches(name, member):
+    #support zips are sometimes re-zipped inside a top level folder, so match on the tail of the path
+    return name == member or name.endswith('/' + member)
+
+
+def classify(name):
+    """Return the FileIndex category of a '/' separated path, or None if it isn't of interest."""
+    if _matches(name, APP_XML):
+        return APP_XML_FILES
+    if _matches(name, BB_PROPERTIES):
+        return PROPERTIES_FILES
+    lowername = name.lower()
+    basename = lowername.rsplit('/', 1)[-1]
+    if not basename:
+        return None
+    if 'threaddump' in lowername or 'thread-dump' in lowername or 'thread_dump' in lowername:
+        return THREAD_DUMPS
+    if basename.startswith('atlassian-bitbucket-access'):
+        return ACCESS_LOGS
+    if basename.startswith('atlassian-bitbucket-profiler'):
+        return PROFILER_LOGS
+    for pattern in GC_LOG_PATTERNS:
+        if fnmatch.fnmatch(basename, pattern):
+            return GC_LOGS
+    if basename.startswith('atlassian-bitbucket.log'):
+        return APP_LOGS
+    return None
+
+
+class FileIndex:
+    """The files of interest inside one support zip, grouped by category."""
+
+    def __init__(self, names=()):
+        self.files = {}
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        category = classify(name)
+        if category is not None:
+            self.files.setdefault(category, []).append(name)
+
+    def get(self, category):
+        return sorted(self.files.get(category, ()))
+
+    def find(self, member):
+        for name in self.files.get(classify(member), ()):
+            if _matches(name, member):
+                return name
+        return None
+
+    def summary(self):
+        return ', '.join(category+': '+str(len(names)) for category, names in sorted(self.files.items()))
+
+
+def index_tree(path):
+    """Index every file below path with one scandir traversal."""
+    index = FileIndex()
+    stack = [(path, '')]
+    while stack:
+        dirpath, rel = stack.pop()
+        try:
+            with os.scandir(dirpath) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append((entry.path, rel + entry.name + '/'))
+                    else:
+                        index.add(rel + entry.name)
+        except OSError as e:
+            logging.warning("Couldn't read "+dirpath+": "+str(e))
+    return index
+
+
+class ZipSource:
+    """A support zip that is read without extracting it."""
+
+    def __init__(self, path):
+        self.path = path
+        self._zip = None
+        self._index = None
+
+    def __repr__(self):
+        return 'ZipSource(%r)' % self.path
+
+    def __getstate__(self):
+        #open archive handles can't be pickled, and the index can be big, so both are rebuilt lazily on first use
+        state = self.__dict__.copy()
+        state['_zip'] = None
+        state['_index'] = None
+        return state
+
+    def _archive(self):
+        if self._zip is None:
+            self._zip = zipfile.ZipFile(self.path)
+        return self._zip
+
+    @property
+    def index(self):
+        if self._index is None:
+            #namelist() comes from the central directory ZipFile has already read, so this is a single pass over it
+            self._index = FileIndex(self._archive().namelist())
+        return self._index
+
+    def find(self, member):
+        return self.index.find(member)
+
+    def files(self, category):
+        return self.index.get(category)
+
+    def open(self, member):
+        name = self.find(member)
+        if name is None and member in self._archive().NameToInfo:
+            name = member
+        if name is None:
+            raise FileNotFoundError(member+" not found in "+self.path)
+        #ZipFile.open streams the member in chunks, so memory use doesn't depend on the size of the archive
+        return self._archive().open(name)
+
+    def size(self, member):
+        return self._archive().getinfo(member).file_size
+
+    def display_name(self, member):
+        return os.path.join(self.path, self.find(member) or member)
+
+    def extract_member(self, member, dest):
+        name = self.find(member)
+        if name is None:
+            raise FileNotFoundError(member+" not found in "+self.path)
+        target = os.path.join(dest, os.path.basename(name))
+        with self._archive().open(name) as src, open(target, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        return target
+
+    def extract(self, dest=None):
+        if dest is None:
+            dest = os.path.splitext(self.path)[0]
+        self._archive().extractall(dest)
+        #the folder holds exactly what the archive did, so the index is reused rather than walking it again
+        return DirectorySource(dest, self.index)
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+
+
+class DirectorySource:
+    """A support zip that has already been extracted to a folder."""
+
+    def __init__(self, path, index=None):
+        self.path = path
+        self._index = index
+
+    def __repr__(self):
+        return 'DirectorySource(%r)' % self.path
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = index_tree(self.path)
+        return self._index
+
+    def find(self, member):
+        return self.index.find(member)
+
+    def files(self, category):
+        return self.index.get(category)
+
+    def local_path(self, member):
+        return os.path.join(self.path, *member.split('/'))
+
+    def open(self, member):
+        return open(self.local_path(self.find(member) or member), 'rb')
+
+    def size(self, member):
+        return os.path.getsize(self.local_path(member))
+
+    def display_name(self, member):
+        return os.path.join(self.path, self.find(member) or member)
+
+    def extract_member(self, member, dest):
+        return self.local_path(self.find(member) or member)
+
+    def extract(self, dest=None):
+        return self
+
+    def close(self):
+        pass
+
+
+def find_sources(rootPath):
+    """Find every support zip under rootPath, in a stable order.
+
+    This is the only traversal of rootPath: once a folder turns out to be an
+    extracted support zip, the rest of it is walked to build its FileIndex
+    rather than being searched again later. The matching zip, if it's still
+    there, is skipped so a node isn't counted twice. Zips aren't opened here,
+    so a zip that isn't a support zip is only weeded out when it is ingested.
+    """
+    sources = []
+    stack = [rootPath]
+    while stack:
+        root = stack.pop()
+        try:
+            with os.scandir(root) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            logging.warning("Couldn't read "+root+": "+str(e))
+            continue
+        dirs = [entry for entry in entries if entry.is_dir()]
+        if any(entry.name == 'application-properties' for entry in dirs) and os.path.isfile(os.path.join(root, APP_XML)):
+            logging.debug("Extracted support zip found: "+root)
+            sources.append(DirectorySource(root, index_tree(root)))
+            continue
+        dirnames = set(entry.name for entry in dirs)
+        for entry in entries:
+            if entry.is_file() and fnmatch.fnmatch(entry.name, '*.zip'):
+                logging.debug("Zip found: "+entry.path)
+                # Check if the filename of the zip file exists in the list of directories.
+                if os.path.splitext(entry.name)[0] in dirnames:
+                    logging.debug("Skipping "+entry.path+", it has already been extracted")
+                    continue
+                #the zip is only opened later, by whichever worker ingests it
+                sources.append(ZipSource(entry.path))
+        #pushed in reverse so sub folders are popped, and so reported, in name order
+        stack.extend(entry.path for entry in reversed(dirs))
+    return sources
@@ -0,0 +1,197 @@
+"""Hotspots in the thread dumps of a support zip.
+
+Thread dumps are in the jstack format: a quoted thread header line,
+an optional 'java.lang.Thread.State:' line and then the stack, top
+frame first:
+
+    "http-nio-7990-exec-3" #45 daemon prio=5 os_prio=0 tid=0x... nid=0x... waiting on condition [0x...]
+       java.lang.Thread.State: WAITING (parking)
+            at sun.misc.Unsafe.park(Native Method)
+            - parking to wait for  <0x...> (a java.util.concurrent.locks.AbstractQueuedSynchronizer$ConditionObject)
+            at com.zaxxer.hikari.util.ConcurrentBag.borrow(ConcurrentBag.java:151)
+
+The dumps are streamed one line at a time and only the top TOP_FRAMES
+frames of the current thread are kept, so hundreds of dumps can be read
+with little memory. Threads are grouped by state and top frames; a group
+is a hotspot when it shows up in many dumps, and a thread is stuck when
+it is in the same place in consecutive dumps. Idle pool threads are left
+out.
+"""
+from collections import Counter
+from dataclasses import dataclass, field
+import gzip
+import io
+
+from healthcheck.supportzip import THREAD_DUMPS
+
+TOP_FRAMES = 3
+TOP_HOTSPOTS = 5
+#hotspots kept per node, so that the cluster-wide ranking can find places that are hot on every node but top of none
+KEEP_HOTSPOTS = 25
+
+#(category, substrings of any top frame), checked in order
+CATEGORIES = (
+    ('Git process', ('java.lang.UNIXProcess', 'java.lang.ProcessImpl', 'java.lang.ProcessHandleImpl', 'com.zaxxer.nuprocess', 'com.atlassian.bitbucket.internal.process', 'com.atlassian.bitbucket.scm.git')),
+    ('DB pool wait', ('com.zaxxer.hikari', 'org.apache.commons.dbcp', 'com.jolbox.bonecp', 'com.mchange.v2.c3p0')),
+    ('DB query', ('org.postgresql', 'com.mysql', 'oracle.jdbc', 'com.microsoft.sqlserver', 'org.h2.')),
+    ('Hazelcast', ('com.hazelcast',)),
+    ('Elasticsearch', ('org.elasticsearch', 'com.atlassian.bitbucket.internal.search')),
+    ('Lock wait', ('java.util.concurrent.locks',)),
+    ('Network I/O', ('java.net.SocketInputStream', 'sun.nio.ch.SocketDispatcher', 'sun.nio.ch.NioSocketImpl', 'javax.net.ssl')),
+)
+#frames that mean a thread is parked waiting for work
+IDLE_FRAMES = ('ThreadPoolExecutor.getTask', 'ScheduledThreadPoolExecutor$DelayedWorkQueue.take', 'ForkJoinPool.awaitWork',
+               'sun.nio.ch.EPoll', 'sun.nio.ch.KQueue', 'sun.nio.ch.WindowsSelectorImpl', 'java.lang.ref.Reference', 'java.lang.ref.ReferenceQueue',
+               'org.apache.tomcat.util.net.NioEndpoint$Poller', 'Acceptor.run', 'io.netty.channel.nio.NioEventLoop.select')
+
+
+@dataclass
+class Hotspot:
+    category: str
+    state: str
+    frames: tuple
+    #thread samples across all dumps
+    samples: int = 0
+    #dumps the hotspot appeared in
+    dumps: int = 0
+    #threads seen in this same place in consecutive dumps
+    stuck: int = 0
+    #nodes the hotspot appeared on, only used for cluster-wide rankings
+    nodes: int = 1
+
+
+@dataclass
+class ThreadDumpStats:
+    files: int = 0
+    dumps: int = 0
+    threads: int = 0
+    states: dict = field(default_factory=dict)
+    #Hotspots, most significant first (up to KEEP_HOTSPOTS)
+    hotspots: list = field(default_factory=list)
+
+
+def categorise(frames):
+    for category, markers in CATEGORIES:
+        if any(marker in frame for frame in frames for marker in markers):
+            return category
+    return 'Other'
+
+
+def read_lines(source, names):
+    """Yield (file number, line) for every line of the thread dumps, decompressing .gz files on the fly."""
+    for number, name in enumerate(names):
+        with source.open(name) as raw:
+            stream = gzip.GzipFile(fileobj=raw) if name.endswith('.gz') else raw
+            for line in io.TextIOWrapper(stream, encoding='utf-8', errors='replace'):
+                yield number, line
+
+
+def parse(lines):
+    """Yield (dump number, thread name, state, top frames) for every thread.
+
+    A dump starts at every new file and at every 'Full thread dump' header,
+    so files holding several dumps (e.g. a captured stdout) work too.
+    """
+    dump = -1
+    lastFile = None
+    thread = None
+    #whether the current dump has any threads yet, so a header at the top of a file doesn't start a second dump
+    started = False
+    for number, line in lines:
+        header = line.startswith('Full thread dump')
+        if number != lastFile or (header and started):
+            if thread is not None:
+                yield thread
+                thread = None
+            dump += 1
+            lastFile = number
+            started = False
+        if header:
+            continue
+        if line.startswith('"'):
+            if thread is not None:
+                yield thread
+            end = line.find('"', 1)
+            thread = (dump, line[1:end] if end > 0 else line[1:].rstrip(), 'UNKNOWN', [])
+            started = True
+            continue
+        if thread is None:
+            continue
+        text = line.strip()
+        if text.startswith('java.lang.Thread.State:'):
+            thread = (thread[0], thread[1], text.split(':', 1)[1].split()[0], thread[3])
+        elif text.startswith('at ') and len(thread[3]) < TOP_FRAMES:
+            thread[3].append(text[3:].split('(', 1)[0])
+        elif not text:
+            yield thread
+            thread = None
+    if thread is not None:
+        yield thread
+
+
+def analyse(threads, files=0):
+    stats = ThreadDumpStats(files=files)
+    states = Counter()
+    samples = Counter()
+    dumpsSeen = {}
+    stuck = Counter()
+    #thread name -> (dump, signature) of where it was last seen
+    lastSeen = {}
+    #(thread name, signature) pairs already counted as stuck
+    stuckThreads = set()
+    lastDump = -1
+
+    for dump, name, state, frames in threads:
+        lastDump = max(lastDump, dump)
+        stats.threads += 1
+        states[state] += 1
+        frames = tuple(frames)
+        if not frames or any(idle in frame for frame in frames for idle in IDLE_FRAMES):
+            lastSeen.pop(name, None)
+            continue
+        signature = (state, frames)
+        samples[signature] += 1
+        dumpsSeen.setdefault(signature, set()).add(dump)
+        previous = lastSeen.get(name)
+        if previous is not None and previous == (dump - 1, signature) and (name, signature) not in stuckThreads:
+            stuckThreads.add((name, signature))
+            stuck[signature] += 1
+        lastSeen[name] = (dump, signature)
+
+    stats.dumps = lastDump + 1
+    stats.states = dict(states.most_common())
+    hotspots = [Hotspot(categorise(frames), state, frames, count, len(dumpsSeen[(state, frames)]), stuck[(state, frames)])
+                for (state, frames), count in samples.items()]
+    stats.hotspots = rank(hotspots)[:KEEP_HOTSPOTS]
+    return stats
+
+
+def rank(hotspots):
+    #threads stuck in one place matter most, then how often the place shows up at all
+    return sorted(hotspots, key=lambda spot: (-spot.stuck, -spot.dumps, -spot.samples, spot.frames))
+
+
+def merge(statsList):
+    """Cluster-wide hotspots from the per-node results; hotspots are matched on state and frames."""
+    merged = {}
+    for stats in statsList:
+        if stats is None:
+            continue
+        for spot in stats.hotspots:
+            key = (spot.state, spot.frames)
+            if key not in merged:
+                merged[key] = Hotspot(spot.category, spot.state, spot.frames, nodes=0)
+            total = merged[key]
+            total.samples += spot.samples
+            total.dumps += spot.dumps
+            total.stuck += spot.stuck
+            total.nodes += 1
+    return sorted(merged.values(), key=lambda spot: (-spot.nodes, -spot.stuck, -spot.dumps, -spot.samples, spot.frames))[:TOP_HOTSPOTS]
+
+
+def analyse_source(source):
+    """Analyse every thread dump in a support zip; None if it has none."""
+    names = source.files(THREAD_DUMPS)
+    if not names:
+        return None
+    return analyse(parse(read_lines(source, names)), files=len(names))
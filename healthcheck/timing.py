@@ -0,0 +1,133 @@
+"""Opt-in wall time, CPU time and memory measurements for --profile.
+
+Timings records one PhaseTiming per phase: wall and CPU seconds, the
+process's peak RSS when the phase ended, and the peak of Python
+allocations during the phase (from tracemalloc, which is only started
+when profiling, as it slows everything down). Phases can be nested with
+phase(), or run back to back with lap(), which ends the previous lap as
+the next one starts, so report sections need only one call each.
+
+When profiling is off, phase() and lap() do nothing, so they can stay in
+the code path permanently.
+"""
+from collections import namedtuple
+import contextlib
+import json
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    #not available on Windows; peak RSS and child CPU time are left out there
+    resource = None
+
+#Python < 3.9 can't reset the peak, so phases there report the peak so far instead
+_reset_peak = getattr(tracemalloc, 'reset_peak', lambda: None)
+
+#parent is the name of the enclosing phase, if any, and depth how deeply it is nested; sizes are bytes and may be None
+PhaseTiming = namedtuple('PhaseTiming', 'name node parent depth wall cpu peak_rss traced_peak')
+
+
+def _cpu():
+    #worker and plugin processes count towards the phase that waited for them
+    cpu = time.process_time()
+    if resource is not None:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu += children.ru_utime + children.ru_stime
+    return cpu
+
+
+def _peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Timings:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.records = []
+        #[name, node, wall start, cpu start, highest traced peak so far, slot in records]
+        self._stack = []
+        self._lap = None
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _start(self, name, node):
+        if self._stack:
+            self._carry_peak()
+        #records are kept in the order the phases started, so nested phases follow the one they are in
+        self.records.append(None)
+        entry = [name, node, time.perf_counter(), _cpu(), 0, len(self.records) - 1]
+        self._stack.append(entry)
+        _reset_peak()
+        return entry
+
+    def _carry_peak(self):
+        #the peak is global, so the enclosing phase keeps the highest peak seen before each reset
+        self._stack[-1][4] = max(self._stack[-1][4], tracemalloc.get_traced_memory()[1])
+
+    def _end(self):
+        self._carry_peak()
+        name, node, wall, cpu, traced, slot = self._stack.pop()
+        parent = self._stack[-1][0] if self._stack else None
+        self.records[slot] = PhaseTiming(name, node, parent, len(self._stack), time.perf_counter() - wall, _cpu() - cpu, _peak_rss(), traced)
+        if self._stack:
+            self._stack[-1][4] = max(self._stack[-1][4], traced)
+        _reset_peak()
+
+    @contextlib.contextmanager
+    def phase(self, name, node=None):
+        if not self.enabled:
+            yield
+            return
+        entry = self._start(name, node)
+        try:
+            yield
+        finally:
+            while self._stack and self._stack[-1] is not entry:
+                self._end()
+            self._end()
+
+    def lap(self, name=None, node=None):
+        """End the current lap, if any, and start a new one called name (none if name is None)."""
+        if not self.enabled:
+            return
+        if self._lap is not None and self._lap in self._stack:
+            while self._stack[-1] is not self._lap:
+                self._end()
+            self._end()
+        self._lap = self._start(name, node) if name is not None else None
+
+    def extend(self, records):
+        """Add timings recorded elsewhere, e.g. in a worker process, under the current phase."""
+        parent = self._stack[-1][0] if self._stack else None
+        for record in records:
+            self.records.append(record._replace(parent=record.parent or parent, depth=record.depth + len(self._stack)))
+            if self._stack and record.traced_peak:
+                self._stack[-1][4] = max(self._stack[-1][4], record.traced_peak)
+
+    def finished(self):
+        return [record for record in self.records if record is not None]
+
+    def table(self):
+        """The finished phases as aligned text, nested phases indented under theirs."""
+        rows = [('Phase', 'Node', 'Wall (s)', 'CPU (s)', 'Peak RSS (MB)', 'Traced peak (MB)')]
+        megabytes = lambda size: '-' if size is None else format(size / 1024.0 / 1024, '.1f')
+        for record in self.finished():
+            rows.append(('  ' * record.depth + record.name, record.node or '', format(record.wall, '.3f'),
+                         format(record.cpu, '.3f'), megabytes(record.peak_rss), megabytes(record.traced_peak)))
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        return "\n".join("  ".join(cell.ljust(width) if i < 2 else cell.rjust(width) for i, (cell, width) in enumerate(zip(row, widths)))
+                         for row in rows)
+
+    def save(self, path, **info):
+        """Write the timings and any extra information (version, arguments, ...) as JSON."""
+        data = dict(info)
+        data['phases'] = [record._asdict() for record in self.finished()]
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
@@ -0,0 +1,25 @@
+"""Parsing and formatting of the human readable sizes found in support zips."""
+import re
+
+_SIZE = re.compile(r'^\s*([0-9]+(?:[.,][0-9]+)?)\s*([kmgtp]?)(?:i?b)?\s*$', re.IGNORECASE)
+_MULTIPLIERS = {'': 1, 'k': 1024, 'm': 1024**2, 'g': 1024**3, 't': 1024**4, 'p': 1024**5}
+
+
+def parse_size(text):
+    """Bytes in a size such as '31.3 GB', '512 MB', '2g' (as in -Xmx2g) or '1073741824'; None if it isn't one."""
+    if text is None:
+        return None
+    match = _SIZE.match(str(text))
+    if match is None:
+        return None
+    return int(float(match.group(1).replace(',', '.')) * _MULTIPLIERS[match.group(2).lower()])
+
+
+def format_size(size):
+    if size is None:
+        return '?'
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if abs(size) < 1024 or unit == 'TB':
+            break
+        size /= 1024.0
+    return ('%d %s' if unit == 'B' else '%.1f %s') % (size, unit)
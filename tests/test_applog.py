@@ -0,0 +1,35 @@
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from healthcheck import applog
+
+
+def counts(text):
+    hits = {}
+    applog.scan(text.encode(), applog.compile_signatures(), hits)
+    return {name: found.count for name, found in hits.items()}
+
+
+def test_split_brain_in_any_case():
+    lines = ["2021-02-03 10:00:01,000 WARN [hz] c.h.i.c.i.ClusterMergeTask Split-Brain detected",
+             "2021-02-03 10:00:02,000 WARN [hz] c.h.i.c.i.ClusterMergeTask SPLIT-BRAIN detected",
+             "2021-02-03 10:00:03,000 WARN [hz] c.h.i.c.i.ClusterMergeTask split brain merge started",
+             "2021-02-03 10:00:04,000 INFO [main] c.a.b.i.Startup splitting the work into batches"]
+    assert counts("\n".join(lines) + "\n") == {'split-brain': 3}
+
+
+def test_elasticsearch_timeout_in_upper_case():
+    assert counts("2021-02-03 10:00:01,000 ERROR [search] OPENSEARCH request timed out\n") == {'elasticsearch-timeout': 1}
+
+
+def test_stream_lines_across_blocks(monkeypatch):
+    monkeypatch.setattr(applog, 'CHUNK_SIZE', 16)
+    hits = {}
+    text = "2021-02-03 10:00:01,000 ERROR java.lang.OutOfMemoryError: Java heap space\n" * 3
+    size = applog.scan_stream(io.BytesIO(text.encode()), applog.compile_signatures(), hits)
+    assert size == len(text)
+    assert hits['out-of-memory'].count == 3
+    assert hits['out-of-memory'].first == '2021-02-03 10:00:01'